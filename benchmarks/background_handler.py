@@ -0,0 +1,56 @@
+"""Caller-side latency of BackgroundStreamHandler against StreamHandler while the output stream stalls.
+
+Run with `python benchmarks/background_handler.py`."""
+
+import argparse
+import io
+import logging
+import statistics
+import time
+
+from harp_logfmt import BackgroundStreamHandler, LogfmtFormatter
+
+
+class SlowStream(io.StringIO):
+    """A stream whose writes stall for `delay` seconds, like a pipe whose reader fell behind."""
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    def write(self, s: str) -> int:
+        time.sleep(self.delay)
+        return len(s)
+
+
+def measure(name: str, handler: logging.Handler, records: int) -> None:
+    handler.setFormatter(LogfmtFormatter(colorize=False))
+    logger = logging.getLogger(f"benchmark.background.{name}")
+    logger.propagate = False
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    latencies = []
+    for i in range(records):
+        start = time.perf_counter()
+        logger.info("Handled request %d", i, extra={"data": {"order_id": i}})
+        latencies.append(time.perf_counter() - start)
+    logger.removeHandler(handler)
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"{name:<40} p50={quantiles[49] * 1e6:>9.1f}us p99={quantiles[98] * 1e6:>9.1f}us")
+    handler.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--delay", type=float, default=0.001, help="seconds each write stalls")
+    args = parser.parse_args()
+    measure("StreamHandler", logging.StreamHandler(SlowStream(args.delay)), args.records)
+    for overflow in ("drop_newest", "drop_oldest"):
+        handler = BackgroundStreamHandler(SlowStream(args.delay), queue_size=256, overflow=overflow)
+        measure(f"BackgroundStreamHandler ({overflow})", handler, args.records)
+        print(f"{'':<40} dropped={handler.dropped}")
+
+
+if __name__ == "__main__":
+    main()
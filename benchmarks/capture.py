@@ -0,0 +1,65 @@
+"""Capturing records in binary against formatting them as text, stdlib only.
+
+Run with `python benchmarks/capture.py`. For each scenario of `benchmarks/formatter.py`, reports the microseconds and
+bytes per record of `LogfmtFormatter.format_into` and of `CaptureEncoder.encode_into` (the work left on the logging
+thread with a CaptureHandler), and checks that rendering the capture gives the formatted text."""
+
+import argparse
+import contextvars
+import time
+
+from formatter import SCENARIOS
+
+from harp_logfmt.capture import CaptureEncoder, render
+
+
+def measure(write, records: int, repeat: int) -> tuple[float, int]:
+    """The fastest microseconds per record of `write(buffer)`, and the bytes it writes per record."""
+    buffer = bytearray()
+    for _ in range(min(records, 1000)):  # warm up caches, and the encoder's shapes
+        write(buffer)
+    buffer.clear()
+    write(buffer)
+    size = len(buffer)
+    elapsed = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(records):
+            write(buffer)
+            buffer.clear()
+        elapsed = min(elapsed, time.perf_counter() - start)
+    return elapsed / records * 1e6, size
+
+
+def run_scenario(name: str, records: int, repeat: int):
+    make_formatter, make = SCENARIOS[name]
+    formatter = make_formatter()
+    record = make()
+    encoder = CaptureEncoder(formatter)
+    text_us, text_size = measure(lambda buffer: formatter.format_into(record, buffer), records, repeat)
+    capture_us, capture_size = measure(lambda buffer: encoder.encode_into(record, buffer), records, repeat)
+    # Exception fingerprints leave out tracebacks logged recently, so each side gets a formatter of its own
+    rendered = list(render(CaptureEncoder(make_formatter()).encode(record), make_formatter()))
+    match = rendered == [make_formatter().format(record)]
+    print(
+        f"{name:<24} text {text_us:>7.1f} us {text_size:>6} B   capture {capture_us:>7.1f} us {capture_size:>6} B"
+        f"   {'renders identically' if match else 'RENDERS DIFFERENTLY'}"
+    )
+    return match
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="run only these scenarios")
+    args = parser.parse_args()
+    matches = [
+        contextvars.copy_context().run(run_scenario, name, args.records, args.repeat)
+        for name in args.scenario or SCENARIOS
+    ]
+    return 0 if all(matches) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,73 @@
+"""Columnar export against parsing lines into dicts. Run with `python benchmarks/columnar.py`.
+
+Reports the conversion throughput, then the time and peak memory (tracemalloc) to sum one numeric column from the
+columnar file and from the parsed log."""
+
+import argparse
+import io
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+from harp_logfmt import LogfmtFormatter
+from harp_logfmt.columnar import ColumnarReader, convert
+from harp_logfmt.parser import iter_parse
+
+
+def build_log(records: int) -> str:
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(LogfmtFormatter(colorize=False))
+    logger = logging.getLogger("benchmark.columnar")
+    logger.propagate = False
+    logger.addHandler(handler)
+    for i in range(records):
+        logger.warning("Handled request %d", i, extra={"data": {"order_id": i, "amount": i / 4, "user": f"u{i % 97}"}})
+    logger.removeHandler(handler)
+    return stream.getvalue()
+
+
+def measure(name: str, func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{name:<28} {elapsed:>8.3f} s {peak / 1e6:>8.1f} MB peak")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "app.log")
+        destination = os.path.join(directory, "app.hlfc")
+        with open(source, "w") as file:
+            file.write(build_log(args.records))
+        start = time.perf_counter()
+        with open(source, "rb") as file, open(destination, "wb") as output:
+            convert(file, output)
+        elapsed = time.perf_counter() - start
+        print(f"convert {os.path.getsize(source) / 1e6:.1f} MB -> {os.path.getsize(destination) / 1e6:.1f} MB")
+        print(f"{'convert':<28} {elapsed:>8.3f} s {os.path.getsize(source) / elapsed / 1e6:>8.1f} MB/s")
+
+        def columnar_sum():
+            with ColumnarReader(destination) as reader:
+                return sum(sum(value for value in column) for column in reader.column_values("data[amount]"))
+
+        def parsed_sum():
+            with open(source) as file:
+                records = list(iter_parse(file))
+            return sum(float(record["data[amount]"]) for record in records)
+
+        assert measure("sum column (columnar)", columnar_sum) == measure("sum column (dicts)", parsed_sum)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Writing and reading a block-compressed log against a plain one, stdlib only.
+
+Run with `python benchmarks/compressed.py`. Reports the logging throughput and file size of a FileHandler and of
+BlockCompressedFileHandler, then the time to read back a one minute range: by decompressing the whole file with gzip
+and filtering, and through the block index."""
+
+import argparse
+import gzip
+import logging
+import os
+import tempfile
+import time
+
+from harp_logfmt import BlockCompressedFileHandler, LogfmtFormatter
+from harp_logfmt.compressed import CompressedLogReader
+from harp_logfmt.index import parse_time
+from harp_logfmt.parser import parse_line
+
+START = 1700000000.0
+
+
+def write(name: str, handler: logging.Handler, records: int):
+    handler.setFormatter(LogfmtFormatter(colorize=False))
+    logger = logging.getLogger(f"benchmark.compressed.{name}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    start = time.perf_counter()
+    for i in range(records):
+        record = logger.makeRecord(
+            logger.name, logging.INFO, __file__, 1, "Handled request %d", (i,), None, extra={"data": {"order_id": i}}
+        )
+        record.created = START + i / 100  # 100 records per second
+        logger.handle(record)
+    handler.close()
+    logger.removeHandler(handler)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=200000)
+    parser.add_argument("--block-size", type=int, default=1 << 20)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        plain, packed = os.path.join(directory, "app.log"), os.path.join(directory, "app.log.gz")
+        for name, path, handler in (
+            ("FileHandler", plain, logging.FileHandler(plain)),
+            ("BlockCompressedFileHandler", packed, BlockCompressedFileHandler(packed, block_size=args.block_size)),
+        ):
+            elapsed = write(name, handler, args.records)
+            print(f"{name:<28} {args.records / elapsed:>10.0f} records/s {os.path.getsize(path):>12} bytes")
+
+        since = START + args.records / 200  # the minute from the middle of the file on
+        until = since + 60
+        start = time.perf_counter()
+        with gzip.open(packed) as file:
+            scanned = 0
+            for line in file:
+                created = parse_time(parse_line(line).get("time", ""))
+                scanned += created is not None and since <= created <= until
+        full = time.perf_counter() - start
+        start = time.perf_counter()
+        reader = CompressedLogReader(packed)
+        indexed = sum(1 for _ in reader.lines(since, until))
+        blocks = len(reader.select(since, until))
+        print(f"{'gzip, full scan':<28} {full * 1e3:>10.1f} ms   {scanned} records")
+        print(
+            f"{'block index':<28} {(time.perf_counter() - start) * 1e3:>10.1f} ms   {indexed} records, "
+            f"{blocks}/{len(reader.blocks)} blocks"
+        )
+
+
+if __name__ == "__main__":
+    main()
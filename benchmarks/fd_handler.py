@@ -0,0 +1,56 @@
+"""Throughput of logging to a pipe: StreamHandler over a text wrapper against FileDescriptorHandler.
+
+Run with `python benchmarks/fd_handler.py`. A thread drains the read end like a log shipper would."""
+
+import argparse
+import logging
+import os
+import threading
+import time
+
+from harp_logfmt import FileDescriptorHandler, LogfmtFormatter
+
+
+def drain(fd: int):
+    while os.read(fd, 1 << 20):
+        pass
+
+
+def measure(name: str, make_handler, records: int) -> None:
+    read_fd, write_fd = os.pipe()
+    reader = threading.Thread(target=drain, args=(read_fd,), daemon=True)
+    reader.start()
+    handler = make_handler(write_fd)
+    handler.setFormatter(LogfmtFormatter(colorize=False))
+    logger = logging.getLogger(f"benchmark.fd.{name}")
+    logger.propagate = False
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    start = time.perf_counter()
+    for i in range(records):
+        logger.info("Handled request %d", i, extra={"data": {"order_id": i, "items": [1, 2, 3]}, "user": "u1"})
+    handler.close()
+    if isinstance(handler, logging.StreamHandler):
+        handler.stream.close()  # StreamHandler leaves its stream open
+    elapsed = time.perf_counter() - start
+    logger.removeHandler(handler)
+    os.close(write_fd)
+    reader.join()
+    os.close(read_fd)
+    print(f"{name:<24} {records / elapsed:>10.0f} records/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=50000)
+    args = parser.parse_args()
+    measure(
+        "StreamHandler",
+        lambda fd: logging.StreamHandler(os.fdopen(os.dup(fd), "w", encoding="utf-8", buffering=1)),
+        args.records,
+    )
+    measure("FileDescriptorHandler", lambda fd: FileDescriptorHandler(fd), args.records)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Throughput and allocation benchmarks for LogfmtFormatter, stdlib only.
+
+Run with `python benchmarks/formatter.py`. Each scenario reports records/sec, microseconds per record, the peak
+memory allocated while formatting one record (tracemalloc) and the number of generation 0 garbage collections per
+1000 records, a proxy for how many container objects are allocated.
+
+`--json results.json` writes the results; `--baseline results.json` compares against a stored run and exits with
+status 1 when a scenario is slower or allocates more than `--threshold` (relative) beyond the baseline."""
+
+import argparse
+import contextvars
+import dataclasses
+import gc
+import json
+import logging
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Callable, NamedTuple
+
+from harp_logfmt import LogfmtFormatter, bind
+
+
+@dataclasses.dataclass
+class Item:
+    sku: str
+    qty: int
+    price: float
+
+
+class Customer(NamedTuple):
+    id: int
+    name: str
+    tier: str
+
+
+def make_record(msg, args=None, exc_info=None, **extra) -> logging.LogRecord:
+    record = logging.LogRecord("benchmark", logging.INFO, __file__, 42, msg, args, exc_info, func="handler")
+    record.__dict__.update(extra)
+    return record
+
+
+def _exc_info():
+    try:
+        {}["missing"]
+    except KeyError:
+        return sys.exc_info()
+
+
+def _nested_payload():
+    return {
+        "order": {"id": 1234, "items": [Item("A-1", 2, 9.99), Item("B-7", 1, 24.5)], "tags": ["new", "priority"]},
+        "customer": Customer(42, "Jane Doe", "gold"),
+        "shipping": {"address": {"city": "Berlin", "zip": "10115"}, "method": "express"},
+    }
+
+
+def _deep_payload(depth: int = 5, width: int = 3):
+    # width ** depth leaves, e.g. data[k0][k2][k1][k0][k2]
+    return {f"k{i}": _deep_payload(depth - 1, width) for i in range(width)} if depth else "leaf value"
+
+
+def _bound_formatter(formatter: LogfmtFormatter) -> LogfmtFormatter:
+    # Each scenario runs in its own context, so these stay bound for this scenario only
+    bind(request_id="5f0c6a9e", tenant="acme", user="jane doe", route="/api/orders/{id}", attempt=1)
+    return formatter
+
+
+# name -> (formatter factory, record factory)
+SCENARIOS: dict[str, tuple[Callable[[], LogfmtFormatter], Callable[[], logging.LogRecord]]] = {
+    "plain": (
+        lambda: LogfmtFormatter(colorize=False),
+        lambda: make_record("Handled request %s", ("abc",)),
+    ),
+    "plain_colorized": (
+        lambda: LogfmtFormatter(colorize=True),
+        lambda: make_record("Handled request %s", ("abc",)),
+    ),
+    "msg_regex": (
+        lambda: LogfmtFormatter(colorize=False, msg_regex=r"^user=(?P<user>\w+) action=(?P<action>\w+)$"),
+        lambda: make_record("user=%s action=%s", ("jane", "login")),
+    ),
+    "msg_template": (
+        lambda: LogfmtFormatter(colorize=False, msg_templates=True),
+        lambda: make_record("user=%(user)s action=%(action)s", ({"user": "jane", "action": "login"},)),
+    ),
+    "many_extra_keys": (
+        lambda: LogfmtFormatter(colorize=False),
+        lambda: make_record("Handled request", **{f"extra_{i}": f"value {i}" for i in range(20)}),
+    ),
+    "bound_fields": (
+        lambda: _bound_formatter(LogfmtFormatter(colorize=False)),
+        lambda: make_record("Handled request %s", ("abc",)),
+    ),
+    "nested_data": (
+        lambda: LogfmtFormatter(colorize=False),
+        lambda: make_record("Order placed", data=_nested_payload()),
+    ),
+    "deep_data": (
+        lambda: LogfmtFormatter(colorize=False),
+        lambda: make_record("Tree built", data=_deep_payload()),
+    ),
+    "nested_data_colorized": (
+        lambda: LogfmtFormatter(colorize=True),
+        lambda: make_record("Order placed", data=_nested_payload()),
+    ),
+    "nested_message": (
+        lambda: LogfmtFormatter(colorize=False),
+        lambda: make_record(_nested_payload()),
+    ),
+    "exc_info": (
+        lambda: LogfmtFormatter(colorize=False),
+        lambda: make_record("Lookup failed", exc_info=_exc_info()),
+    ),
+    "exc_info_fingerprinted": (
+        lambda: LogfmtFormatter(colorize=False, exc_fingerprints=True),
+        lambda: make_record("Lookup failed", exc_info=_exc_info()),
+    ),
+}
+
+
+def run_scenario(name: str, records: int, repeat: int) -> dict[str, float]:
+    make_formatter, make = SCENARIOS[name]
+    formatter = make_formatter()
+    record = make()
+    format_record = formatter.format
+    for _ in range(min(records, 1000)):  # warm up caches
+        format_record(record)
+
+    # Like timeit, the fastest run is the one least disturbed by the rest of the system
+    elapsed = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        collections = gc.get_stats()[0]["collections"]
+        start = time.perf_counter()
+        for _ in range(records):
+            format_record(record)
+        elapsed = min(elapsed, time.perf_counter() - start)
+        collections = gc.get_stats()[0]["collections"] - collections
+
+    samples = min(records, 200)
+    tracemalloc.start()
+    peak = 0
+    for _ in range(samples):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        format_record(record)
+        peak += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+
+    return {
+        "records_per_sec": records / elapsed,
+        "us_per_record": elapsed / records * 1e6,
+        "peak_alloc_bytes_per_record": peak / samples,
+        "gc_collections_per_1k_records": collections / records * 1000,
+        "bytes_per_record": len(format_record(record)) + 1,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    failures = []
+    for name, result in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None:
+            continue
+        if result["us_per_record"] > base["us_per_record"] * (1 + threshold):
+            failures.append(f"{name}: {result['us_per_record']:.2f}us/record vs {base['us_per_record']:.2f}us baseline")
+        if result["peak_alloc_bytes_per_record"] > base["peak_alloc_bytes_per_record"] * (1 + threshold):
+            failures.append(
+                f"{name}: {result['peak_alloc_bytes_per_record']:.0f} peak bytes/record vs "
+                f"{base['peak_alloc_bytes_per_record']:.0f} baseline"
+            )
+    return failures
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=20000, help="records per scenario")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per scenario, the fastest one is reported")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="run only these scenarios")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare against results previously written with --json")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression (default 0.2)")
+    args = parser.parse_args(argv)
+
+    results = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "records": args.records,
+        "repeat": args.repeat,
+        "scenarios": {},
+    }
+    print(f"{'scenario':<24} {'records/s':>11} {'us/record':>10} {'peak B/rec':>11} {'gc0/1k':>7} {'B/line':>7}")
+    for name in args.scenario or SCENARIOS:
+        result = results["scenarios"][name] = contextvars.copy_context().run(
+            run_scenario, name, args.records, args.repeat
+        )
+        print(
+            f"{name:<24} {result['records_per_sec']:>11.0f} {result['us_per_record']:>10.2f} "
+            f"{result['peak_alloc_bytes_per_record']:>11.0f} {result['gc_collections_per_1k_records']:>7.2f} "
+            f"{result['bytes_per_record']:>7}"
+        )
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            failures = compare(results, json.load(file), args.threshold)
+        for failure in failures:
+            print(f"REGRESSION {failure}", file=sys.stderr)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
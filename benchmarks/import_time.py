@@ -0,0 +1,43 @@
+"""Time to `import harp_logfmt`, measured in fresh interpreters with `-X importtime`.
+
+Run with `python benchmarks/import_time.py`. `logging` is imported first by default, since any program using the
+formatter imports it anyway, so only what harp_logfmt adds is measured. With `--budget-ms`, exits with status 1 when the
+fastest run is over budget."""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+_CUMULATIVE = re.compile(r"^import time:\s+\d+ \|\s+(\d+) \| harp_logfmt$", re.MULTILINE)
+
+
+def import_time_us(preload: str = "logging") -> int:
+    """The cumulative import time of harp_logfmt, in microseconds, in a fresh interpreter."""
+    code = f"import {preload}; import harp_logfmt" if preload else "import harp_logfmt"
+    src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (src, os.environ.get("PYTHONPATH")))))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], env=env, capture_output=True, text=True, check=True
+    )
+    return int(_CUMULATIVE.search(result.stderr).group(1))
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--preload", default="logging", help='imported before harp_logfmt, "" for nothing')
+    parser.add_argument("--budget-ms", type=float, help="fail when the fastest run takes longer")
+    args = parser.parse_args(argv)
+
+    times = sorted(import_time_us(args.preload) / 1000 for _ in range(args.runs))
+    print(f"import harp_logfmt: min {times[0]:.1f} ms, median {times[len(times) // 2]:.1f} ms, max {times[-1]:.1f} ms")
+    if args.budget_ms is not None and times[0] > args.budget_ms:
+        print(f"OVER BUDGET {times[0]:.1f} ms > {args.budget_ms:.1f} ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
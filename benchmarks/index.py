@@ -0,0 +1,70 @@
+"""Indexed queries against full scans. Run with `python benchmarks/index.py`.
+
+Writes a log of `--records` records to a temporary file, indexes it (serially and with `--jobs` processes), then
+compares a selective key/value query through the index with a full `iter_parse_buffer` scan."""
+
+import argparse
+import logging
+import mmap
+import os
+import tempfile
+import time
+
+from harp_logfmt import LogfmtFormatter
+from harp_logfmt.index import LogIndex
+from harp_logfmt.parser import iter_parse_buffer
+
+
+def write_log(path: str, records: int):
+    handler = logging.FileHandler(path)
+    handler.setFormatter(LogfmtFormatter(colorize=False))
+    logger = logging.getLogger("benchmark.index")
+    logger.propagate = False
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    for i in range(records):
+        level = logging.ERROR if i % 1000 == 0 else logging.INFO
+        logger.log(level, "Handled request %d", i, extra={"data": {"order_id": i, "user": f"u{i % 97}"}})
+    logger.removeHandler(handler)
+    handler.close()
+
+
+def timed(name: str, func):
+    start = time.perf_counter()
+    result = func()
+    print(f"{name:<28} {time.perf_counter() - start:>8.3f} s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=200000)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--block-size", type=int, default=1 << 16)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "app.log")
+        write_log(path, args.records)
+        print(f"{os.path.getsize(path) / 1e6:.1f} MB, {args.records} records")
+        timed("index (1 process)", lambda: LogIndex(path, block_size=args.block_size).update())
+        os.remove(path + ".idx")
+        timed(f"index ({args.jobs} processes)", lambda: LogIndex(path, block_size=args.block_size).update(args.jobs))
+        index = LogIndex.open(path, block_size=args.block_size)
+        terms = {"level": "ERROR", "name": "benchmark.index"}
+        indexed = timed("indexed query", lambda: sum(1 for _ in index.query(terms)))
+
+        def scan():
+            with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                return sum(
+                    1
+                    for record in iter_parse_buffer(buffer)
+                    if all(record.get(key) == value for key, value in terms.items())
+                )
+
+        scanned = timed("full scan", scan)
+        assert indexed == scanned, (indexed, scanned)
+
+
+if __name__ == "__main__":
+    main()
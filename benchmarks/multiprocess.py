@@ -0,0 +1,72 @@
+"""Multi-process logging throughput: producer-side rendering against a plain QueueHandler/QueueListener setup.
+
+Run with `python benchmarks/multiprocess.py`."""
+
+import argparse
+import dataclasses
+import io
+import logging
+import logging.handlers
+import multiprocessing
+import time
+
+from harp_logfmt import LogfmtFormatter, RenderedLineListener, RenderingQueueHandler
+
+
+@dataclasses.dataclass
+class Order:
+    order_id: int
+    items: list
+    customer: dict
+
+
+def worker(log_queue, records: int, render: bool):
+    if render:
+        handler = RenderingQueueHandler(log_queue)
+        handler.setFormatter(LogfmtFormatter(colorize=False))
+    else:
+        # The listener side formats, so the record and its data payload are pickled
+        handler = logging.handlers.QueueHandler(log_queue)
+    logger = logging.getLogger("benchmark.multiprocess")
+    logger.propagate = False
+    logger.handlers[:] = [handler]
+    logger.setLevel(logging.INFO)
+    for i in range(records):
+        order = Order(i, [{"sku": "A-1", "qty": 2}, {"sku": "B-7", "qty": 1}], {"id": 42, "tier": "gold"})
+        logger.info("Handled order %d", i, extra={"data": order})
+
+
+def run(processes: int, records: int, render: bool) -> float:
+    log_queue = multiprocessing.Queue()
+    stream = io.BytesIO() if render else io.StringIO()
+    if render:
+        listener = RenderedLineListener(log_queue, stream)
+    else:
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(LogfmtFormatter(colorize=False))
+        listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    start = time.perf_counter()
+    workers = [multiprocessing.Process(target=worker, args=(log_queue, records, render)) for _ in range(processes)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+    listener.stop()
+    elapsed = time.perf_counter() - start
+    lines = stream.getvalue().count(b"\n" if render else "\n")
+    assert lines == processes * records, lines
+    return lines / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--records", type=int, default=20000, help="records per process")
+    args = parser.parse_args()
+    for name, render in (("QueueHandler/QueueListener", False), ("RenderingQueueHandler", True)):
+        print(f"{name:<28} {run(args.processes, args.records, render):>10.0f} records/s")
+
+
+if __name__ == "__main__":
+    main()
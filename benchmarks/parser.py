@@ -0,0 +1,50 @@
+"""Parser throughput in MB/s. Run with `python benchmarks/parser.py`."""
+
+import argparse
+import io
+import logging
+import time
+
+from harp_logfmt import LogfmtFormatter
+from harp_logfmt.parser import iter_parse, iter_parse_buffer
+
+
+def build_log(records: int, colorize: bool) -> bytes:
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(LogfmtFormatter(colorize=colorize))
+    logger = logging.getLogger("benchmark.parser")
+    logger.propagate = False
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    for i in range(records):
+        logger.info(
+            "Handled request %d",
+            i,
+            extra={"data": {"order_id": i, "items": [{"sku": "A-1", "qty": 2}], "note": "two words"}, "user": "u1"},
+        )
+    logger.removeHandler(handler)
+    return stream.getvalue().encode()
+
+
+def measure(name: str, size: int, func) -> None:
+    start = time.perf_counter()
+    count = sum(1 for _ in func())
+    elapsed = time.perf_counter() - start
+    print(f"{name:<30} {count:>8} records {size / elapsed / 1e6:>8.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=50000)
+    args = parser.parse_args()
+    for colorize in (False, True):
+        log = build_log(args.records, colorize)
+        suffix = "colorized" if colorize else "plain"
+        measure(f"iter_parse ({suffix})", len(log), lambda: iter_parse(io.BytesIO(log)))
+        measure(f"iter_parse_buffer ({suffix})", len(log), lambda: iter_parse_buffer(log))
+        measure(f"nested buffer ({suffix})", len(log), lambda: iter_parse_buffer(log, nested=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Throughput of logging to one file per tenant: a FileHandler per tenant against ShardedFileHandler.
+
+Run with `python benchmarks/sharded.py`. Records cycle through `--tenants` tenants, the FileHandler setup routes them
+with a filter per handler, like a logging config with a handler per shard would."""
+
+import argparse
+import logging
+import tempfile
+import time
+
+from harp_logfmt import LogfmtFormatter, ShardedFileHandler
+
+
+def measure(name: str, handlers: list[logging.Handler], tenants: int, records: int):
+    logger = logging.getLogger(f"benchmark.sharded.{name}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    for handler in handlers:
+        handler.setFormatter(LogfmtFormatter(colorize=False))
+        logger.addHandler(handler)
+    payloads = [{"tenant": f"tenant{i}", "order_id": 1234, "items": [1, 2, 3]} for i in range(tenants)]
+    start = time.perf_counter()
+    for i in range(records):
+        logger.info("Handled request %d", i, extra={"data": payloads[i % tenants]})
+    for handler in handlers:
+        handler.close()
+        logger.removeHandler(handler)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {records / elapsed:>10.0f} records/s  {len(handlers)} handler(s)")
+
+
+def file_handler(directory: str, tenant: str) -> logging.Handler:
+    handler = logging.FileHandler(f"{directory}/{tenant}.log")
+    handler.addFilter(lambda record: record.data["tenant"] == tenant)
+    return handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=50000)
+    parser.add_argument("--tenants", type=int, default=200)
+    parser.add_argument("--max-open", type=int, default=64, help="ShardedFileHandler's file handle pool size")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        measure(
+            "FileHandler per tenant",
+            [file_handler(directory, f"tenant{i}") for i in range(args.tenants)],
+            args.tenants,
+            args.records,
+        )
+    with tempfile.TemporaryDirectory() as directory:
+        measure(
+            "ShardedFileHandler",
+            [ShardedFileHandler(directory, "data[tenant]", max_open=args.max_open)],
+            args.tenants,
+            args.records,
+        )
+
+
+if __name__ == "__main__":
+    main()
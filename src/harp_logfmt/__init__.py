@@ -5,7 +5,46 @@ from .formatter import (
     CUSTOM_FORMATTER_FUNC_RETURN,
     CUSTOM_FORMATTER_PREDICATE_FUNC,
 )
+from .context import Binding, bind, bound_fields, unbind
 from .value_formatters import default_formatters
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .handlers import (
+        BatchStreamHandler,
+        BackgroundStreamHandler,
+        RenderingQueueHandler,
+        RenderedLineListener,
+        FileDescriptorHandler,
+        DedupHandler,
+        ShardedFileHandler,
+        BlockCompressedFileHandler,
+        CaptureHandler,
+    )
+
+# The handlers pull in logging.handlers (and through it socket, pickle, ...), so they are only imported when used
+_HANDLERS = frozenset(
+    (
+        "BatchStreamHandler",
+        "BackgroundStreamHandler",
+        "RenderingQueueHandler",
+        "RenderedLineListener",
+        "FileDescriptorHandler",
+        "DedupHandler",
+        "ShardedFileHandler",
+        "BlockCompressedFileHandler",
+        "CaptureHandler",
+    )
+)
+
+
+def __getattr__(name: str):
+    if name in _HANDLERS:
+        from . import handlers
+
+        return getattr(handlers, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __all__ = (
     "LogfmtFormatter",
@@ -14,4 +53,17 @@ __all__ = (
     "CUSTOM_FORMATTER_FUNC_RETURN",
     "CUSTOM_FORMATTER_PREDICATE_FUNC",
     "default_formatters",
+    "bind",
+    "unbind",
+    "bound_fields",
+    "Binding",
+    "BatchStreamHandler",
+    "BackgroundStreamHandler",
+    "RenderingQueueHandler",
+    "RenderedLineListener",
+    "FileDescriptorHandler",
+    "DedupHandler",
+    "ShardedFileHandler",
+    "BlockCompressedFileHandler",
+    "CaptureHandler",
 )
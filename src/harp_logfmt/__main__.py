@@ -0,0 +1,147 @@
+"""Command line tools for files written by `LogfmtFormatter`.
+
+    python -m harp_logfmt index app.log --key data[order_id] --jobs 8
+    python -m harp_logfmt query app.log level=ERROR name=payments data[order_id]=42 --since 2024-05-01T00:00:00
+    python -m harp_logfmt query app.log level=ERROR --follow
+    python -m harp_logfmt columnar app.log app.hlfc
+    python -m harp_logfmt cat app.log.gz --since 2024-05-01T00:00:00 --until 2024-05-01T01:00:00
+    python -m harp_logfmt render app.capture --exclude-key function --colorize
+
+`query` builds or updates the sidecar index (`app.log.idx`) first, with the keys and block size it is given.
+`columnar` converts a file to the columnar layout of `harp_logfmt.columnar`.
+`cat` prints the records of a block-compressed file (`harp_logfmt.compressed`), only decompressing the blocks in range.
+`render` prints the text of the records in a binary capture (`harp_logfmt.capture`), with the given rendering options."""
+
+import argparse
+import sys
+import time
+
+from . import capture, columnar
+from .compressed import CompressedLogReader
+from .formatter import LogfmtFormatter
+from .index import DEFAULT_KEYS, LogIndex, parse_time
+
+
+def _term(value: str) -> tuple[str, str]:
+    key, separator, expected = value.partition("=")
+    if not separator or not key:
+        raise argparse.ArgumentTypeError(f"expected key=value, got {value!r}")
+    return key, expected
+
+
+def _time(value: str) -> float:
+    parsed = parse_time(value)
+    if parsed is None:
+        raise argparse.ArgumentTypeError(f"expected an ISO 8601 time or an epoch timestamp, got {value!r}")
+    return parsed
+
+
+def _add_index_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("file")
+    parser.add_argument(
+        "--key",
+        action="append",
+        dest="keys",
+        help=f"flattened key to index, may be repeated (default: {', '.join(DEFAULT_KEYS)})",
+    )
+    parser.add_argument("--block-size", type=int, default=1 << 20, help="bytes per index block (default: 1 MiB)")
+    parser.add_argument("--jobs", type=int, default=None, help="processes to index large files with")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m harp_logfmt", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    index_parser = commands.add_parser("index", help="build or update the sidecar index of a file")
+    _add_index_arguments(index_parser)
+    query_parser = commands.add_parser("query", help="print the records matching every key=value term")
+    _add_index_arguments(query_parser)
+    query_parser.add_argument("terms", nargs="*", type=_term, metavar="key=value")
+    query_parser.add_argument("--since", type=_time, help="only records at or after this time")
+    query_parser.add_argument("--until", type=_time, help="only records at or before this time")
+    query_parser.add_argument("--follow", "-f", action="store_true", help="keep printing records as they are logged")
+    query_parser.add_argument("--interval", type=float, default=0.5, help="seconds between checks with --follow")
+    columnar_parser = commands.add_parser("columnar", help="convert a file to the columnar layout")
+    columnar_parser.add_argument("file")
+    columnar_parser.add_argument("output")
+    columnar_parser.add_argument("--chunk-records", type=int, default=65536, help="records per chunk")
+    columnar_parser.add_argument("--continuation-key", help="keep tracebacks and stack info under this key")
+    cat_parser = commands.add_parser("cat", help="print the records of a block-compressed file")
+    cat_parser.add_argument("file")
+    cat_parser.add_argument("--since", type=_time, help="only records at or after this time")
+    cat_parser.add_argument("--until", type=_time, help="only records at or before this time")
+    render_parser = commands.add_parser("render", help="print a binary capture as logfmt text")
+    render_parser.add_argument("file")
+    render_parser.add_argument("--colorize", action="store_true")
+    render_parser.add_argument("--exclude-key", action="append", default=[], dest="exclude_keys")
+    render_parser.add_argument("--exclude-path", action="append", default=[], dest="exclude_paths")
+    render_parser.add_argument("--highlight-key", action="append", dest="highlight_keys")
+    render_parser.add_argument(
+        "--keep-none", action="store_true", help="render None values instead of leaving them out"
+    )
+    render_parser.add_argument("--max-value-length", type=int)
+    render_parser.add_argument("--time-format", choices=("iso", "epoch_s", "epoch_ms", "epoch_ns"))
+    args = parser.parse_args(argv)
+
+    if args.command == "render":
+        formatter = LogfmtFormatter(
+            colorize=args.colorize,
+            exclude_keys=args.exclude_keys,
+            exclude_paths=args.exclude_paths,
+            highlight_keys=args.highlight_keys if args.highlight_keys is not None else ("message",),
+            discard_none=not args.keep_none,
+            max_value_length=args.max_value_length,
+            time_format=args.time_format,
+        )
+        output = sys.stdout
+        with open(args.file, "rb") as source:
+            for line in capture.render(source, formatter):
+                output.write(line + "\n")
+        output.flush()
+        return 0
+
+    if args.command == "cat":
+        output = sys.stdout.buffer
+        output.writelines(CompressedLogReader(args.file).lines(args.since, args.until))
+        output.flush()
+        return 0
+
+    if args.command == "columnar":
+        with open(args.file, "rb") as source, open(args.output, "wb") as destination:
+            records = columnar.convert(
+                source, destination, chunk_records=args.chunk_records, continuation_key=args.continuation_key
+            )
+        print(f"{args.output}: {records} records")
+        return 0
+
+    index = LogIndex.open(args.file, args.keys or DEFAULT_KEYS, args.block_size, args.jobs)
+    if args.command == "index":
+        print(f"{args.file}: {len(index.blocks)} blocks, {index.size} bytes indexed")
+        return 0
+
+    terms = dict(args.terms)
+    output = sys.stdout.buffer
+    for record in index.query(terms, args.since, args.until):
+        output.write(record)
+    output.flush()
+    if not args.follow:
+        return 0
+    try:
+        while True:
+            time.sleep(args.interval)
+            # Updates only add blocks for the appended bytes, so the new blocks hold exactly the new records
+            first, resets = len(index.blocks), index.resets
+            if not index.update():
+                continue
+            if index.resets != resets:
+                first = 0  # the file was replaced and indexed from scratch
+            for record in index.query(terms, args.since, args.until, first):
+                output.write(record)
+            output.flush()
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,11 @@
-from dataclasses import dataclass
 from typing import Literal
 
+# Plain classes rather than frozen dataclasses, which are slow to create at import time. Their attributes are
+# read-only on instances all the same, since __slots__ is empty
+
 
-@dataclass(frozen=True)
 class _REGULAR:
+    __slots__ = ()
     BLACK: Literal["\x1b[0;30m"] = "\x1b[0;30m"
     RED: Literal["\x1b[0;31m"] = "\x1b[0;31m"
     GREEN: Literal["\x1b[0;32m"] = "\x1b[0;32m"
@@ -14,8 +16,8 @@ class _REGULAR:
     WHITE: Literal["\x1b[0;37m"] = "\x1b[0;37m"
 
 
-@dataclass(frozen=True)
 class _BOLD:
+    __slots__ = ()
     BLACK: Literal["\x1b[1;30m"] = "\x1b[1;30m"
     RED: Literal["\x1b[1;31m"] = "\x1b[1;31m"
     GREEN: Literal["\x1b[1;32m"] = "\x1b[1;32m"
@@ -26,8 +28,8 @@ class _BOLD:
     WHITE: Literal["\x1b[1;37m"] = "\x1b[1;37m"
 
 
-@dataclass(frozen=True)
 class _ANSIColors:
+    __slots__ = ()
     # https://gist.github.com/JBlond/2fea43a3049b38287e5e9cefc87b2124
     # \e -> \x1b
     RESET: Literal["\x1b[0m"] = "\x1b[0m"
@@ -0,0 +1,259 @@
+"""Binary capture of the fields `LogfmtFormatter` would render, and their offline rendering into the same text.
+
+Capturing does everything up to the rendering: fields are collected and flattened, and templates, msg_regex,
+expansion limits, path rules and custom formatters apply as they would in `format`. What is left for `render` is what
+costs most per field, quoting, escaping and coloring, so the options that only affect it are the renderer's own:
+`colorize`, `highlight_keys`, `exclude_keys`, `exclude_paths` (matched against the flattened keys), `discard_none`
+(for top-level values, nested ones are flattened at capture), `max_value_length` and the time format and zone. With the
+same options, `render` produces exactly `format`'s text.
+
+A capture stream is a sequence of frames: a varint length, a tag byte and the rest of the frame.
+- `X` + `MAGIC`: starts a stream, every writer starts with one, it also forgets every shape
+- `S`: a varint shape id, then for each key, a varint length and the UTF-8 key. A shape is the keys of a record in
+  order; records logged from the same place have the same one, so their keys are only written once per stream
+- `R`: `_HEADER` (microseconds since the epoch, shape id, levelno, flags), then with `_NONES` a varint count and the
+  varint positions of the None values, with `_MARKERS` the same for the markers of the expansion limits (which
+  `max_value_length` doesn't cut), with `_TRAILER` a varint length and the UTF-8 exception/stack trailer, then
+  the values, UTF-8 and NUL-separated (with `_LENGTHS`, each prefixed by its varint length instead). With `_TIME` and
+  `_LEVEL`, the `time` and `level` values are left empty and rendered from the header."""
+
+import functools
+import io
+import struct
+from typing import IO, TYPE_CHECKING, Iterator
+
+from .formatter import _CAPTURED_LEVEL, _CAPTURED_TIME, _Marker
+from .parser import split_key
+from .paths import PathRules
+from .timestamps import split_timestamp
+
+if TYPE_CHECKING:
+    import logging
+
+    from .formatter import LogfmtFormatter
+
+MAGIC = b"HLFB2"
+# Streams of older writers that `render` still reads, they are MAGIC's without some of its flags
+_READABLE = (MAGIC, b"HLFB1")
+_HEADER = struct.Struct("<qIHB")
+# Flags of a record frame
+_TIME = 1
+_LEVEL = 2
+_NONES = 4
+_TRAILER = 8
+_LENGTHS = 16
+_MARKERS = 32
+_VARINTS = [bytes((i,)) for i in range(128)]
+
+
+def _varint(value: int) -> bytes:
+    if value < 128:
+        return _VARINTS[value]
+    encoded = bytearray()
+    while value >= 128:
+        encoded.append(value & 0x7F | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _read_varint(data: memoryview | bytes, position: int) -> tuple[int, int]:
+    """Returns the varint at `position` and the position after it."""
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 128:
+            return value, position
+        shift += 7
+
+
+def _frame(buffer: bytearray, tag: bytes, *parts: bytes):
+    buffer += _varint(1 + sum(len(part) for part in parts))
+    buffer += tag
+    for part in parts:
+        buffer += part
+
+
+class CaptureEncoder:
+    """Appends the capture of records to a buffer, through `formatter`'s field collection.
+
+    An encoder's frames only make sense in order and after each other: a stream must be written by one encoder, or
+    each encoder must start with its own `X` frame (which the first `encode_into` writes). At most `max_shapes`
+    shapes are remembered, then they are forgotten (with a new `X` frame) and written again as records use them."""
+
+    def __init__(self, formatter: "LogfmtFormatter", max_shapes: int = 65536):
+        self.formatter = formatter
+        self.max_shapes = max_shapes
+        self._shapes: dict[tuple[str, ...], int] = {}  # keys -> shape id
+        self._started = False
+
+    def _reset(self, buffer: bytearray):
+        self._shapes.clear()
+        _frame(buffer, b"X", MAGIC)
+        self._started = True
+
+    def encode_into(self, record: "logging.LogRecord", buffer: bytearray):
+        if not self._started:
+            self._reset(buffer)
+        formatter = self.formatter
+        data = formatter._record_data(record, capture=True)
+        trailer = formatter._trailer(record, data) if record.exc_info or record.stack_info else ""
+        flags = 0
+        # Extra attributes or msg_regex groups can replace the placeholders
+        if data["time"] is _CAPTURED_TIME:
+            flags |= _TIME
+            data["time"] = ""
+        if data["level"] is _CAPTURED_LEVEL:
+            flags |= _LEVEL
+            data["level"] = ""
+        keys = tuple(data)
+        shape = self._shapes.get(keys)
+        if shape is None:
+            # Encoded before the shape is remembered, so a key that can't be encoded doesn't leave it unwritten
+            encoded_keys = [key.encode() for key in keys]
+            if len(self._shapes) >= self.max_shapes:
+                self._reset(buffer)
+            shape = self._shapes[keys] = len(self._shapes)
+            _frame(buffer, b"S", _varint(shape), *[part for key in encoded_keys for part in (_varint(len(key)), key)])
+        values = list(data.values())
+        parts = []
+        if None in values:
+            flags |= _NONES
+            nones = [i for i, value in enumerate(values) if value is None]
+            parts.append(_varint(len(nones)))
+            parts.extend(_varint(i) for i in nones)
+            for i in nones:
+                values[i] = ""
+        if _Marker in map(type, values):
+            flags |= _MARKERS
+            markers = [i for i, value in enumerate(values) if type(value) is _Marker]
+            parts.append(_varint(len(markers)))
+            parts.extend(_varint(i) for i in markers)
+        if trailer:
+            flags |= _TRAILER
+            encoded = trailer.encode()
+            parts.append(_varint(len(encoded)))
+            parts.append(encoded)
+        joined = "\0".join(values)
+        if joined.count("\0") == len(values) - 1:
+            parts.append(joined.encode())
+        else:
+            flags |= _LENGTHS  # a value contains a NUL
+            for value in values:
+                encoded = value.encode()
+                parts.append(_varint(len(encoded)))
+                parts.append(encoded)
+        seconds, us = split_timestamp(record.created)
+        header = _HEADER.pack(seconds * 1000000 + us, shape, record.levelno, flags)
+        _frame(buffer, b"R", header, *parts)
+
+    def encode(self, record: "logging.LogRecord") -> bytes:
+        buffer = bytearray()
+        self.encode_into(record, buffer)
+        return bytes(buffer)
+
+
+def iter_frames(source: IO[bytes] | bytes, chunk_size: int = 1 << 16) -> Iterator[tuple[int, memoryview]]:
+    """Yields the (tag, rest of the frame) of every frame in a binary file object or bytes. A frame that was cut
+    short at the end is left out."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    pending = b""
+    while chunk := source.read(chunk_size):
+        data = pending + chunk
+        view = memoryview(data)
+        position = 0
+        while True:
+            try:
+                length, start = _read_varint(view, position)
+            except IndexError:
+                break
+            end = start + length
+            if end > len(data):
+                break
+            yield view[start], view[start + 1 : end]
+            position = end
+        pending = data[position:]
+
+
+def _path_excluded(rules: PathRules, key: str) -> bool:
+    """Whether a flattened key, or one of the values it is nested in, is excluded by `rules`."""
+    nodes = (rules.root,)
+    for segment in split_key(key):
+        nodes = PathRules.step(nodes, segment)
+        if not nodes:
+            return False
+        if any(node.exclude for node in nodes):
+            return True
+    return False
+
+
+def render(source: IO[bytes] | bytes, formatter: "LogfmtFormatter") -> Iterator[str]:
+    """Renders every record captured in `source` as `formatter.format` would have, see the module docstring."""
+    shapes: list[tuple[str, ...]] = []
+    started = False
+    kv_to_logfmt = formatter.kv_to_logfmt
+    rules = formatter._path_rules
+    excluded = functools.lru_cache(maxsize=4096)(functools.partial(_path_excluded, rules)) if rules.exclude else None
+    for tag, payload in iter_frames(source):
+        if tag == 0x58:  # X
+            if payload not in _READABLE:
+                raise ValueError("Not a capture stream, or written by an incompatible version.")
+            shapes = []
+            started = True
+            continue
+        if not started:
+            raise ValueError("Not a capture stream.")
+        if tag == 0x53:  # S
+            shape_id, position = _read_varint(payload, 0)
+            keys = []
+            while position < len(payload):
+                length, position = _read_varint(payload, position)
+                keys.append(bytes(payload[position : position + length]).decode())
+                position += length
+            if shape_id != len(shapes):
+                raise ValueError(f"Shape {shape_id} is out of sequence.")
+            shapes.append(tuple(keys))
+        elif tag == 0x52:  # R
+            timestamp_us, shape_id, levelno, flags = _HEADER.unpack_from(payload)
+            position = _HEADER.size
+            keys = shapes[shape_id]
+            nones: list[int] = []
+            if flags & _NONES:
+                count, position = _read_varint(payload, position)
+                for _ in range(count):
+                    index, position = _read_varint(payload, position)
+                    nones.append(index)
+            markers: list[int] = []
+            if flags & _MARKERS:
+                count, position = _read_varint(payload, position)
+                for _ in range(count):
+                    index, position = _read_varint(payload, position)
+                    markers.append(index)
+            trailer = ""
+            if flags & _TRAILER:
+                length, position = _read_varint(payload, position)
+                trailer = bytes(payload[position : position + length]).decode()
+                position += length
+            if flags & _LENGTHS:
+                values = []
+                while position < len(payload):
+                    length, position = _read_varint(payload, position)
+                    values.append(bytes(payload[position : position + length]).decode())
+                    position += length
+            else:
+                values = bytes(payload[position:]).decode().split("\0")
+            data: dict = dict(zip(keys, values))
+            for index in nones:
+                data[keys[index]] = None
+            for index in markers:
+                data[keys[index]] = _Marker(data[keys[index]])
+            if flags & _TIME:
+                data["time"] = formatter._timestamp.render_us(timestamp_us)
+            if flags & _LEVEL:
+                data["level"] = formatter.colorize_level_if_debug(levelno)
+            if excluded is not None:
+                data = {key: value for key, value in data.items() if not excluded(key)}
+            yield " ".join([kv_to_logfmt(key, value) for key, value in formatter._fields(data)]) + trailer
@@ -0,0 +1,299 @@
+"""A compact columnar layout for files written by `LogfmtFormatter`, for analytics without parsing lines into dicts.
+
+Records are converted in chunks of `chunk_records` rows, so memory stays bounded whatever the size of the input.
+Within a chunk, every flattened key (`data[order_id]`, `message.attr`, ...) is a column, and a column chunk is:
+- "int" (`array` type "q") or "float" ("d") when every value in the chunk round-trips through `int`/`float`
+- "time" ("q", microseconds since the epoch) for `time` values, see `index.parse_time`
+- "str" otherwise, dictionary encoded: "I" codes into the chunk's distinct values
+Columns that are missing from some rows of a chunk are sparse: they also store the ("I") row numbers they have values
+for, so keys that only a few records have take no space in the others.
+
+File layout: a magic line, then the column chunks' arrays (8-byte aligned, native byte order), then a JSON footer
+describing where each one is, its length as 8 little-endian bytes and the magic again. `ColumnarReader` memory-maps
+the file and casts the arrays in place, nothing is read until a column is accessed."""
+
+import array
+import json
+import mmap
+import sys
+from typing import IO, Any, BinaryIO, Iterable, Iterator
+
+from .index import parse_time
+from .parser import iter_parse
+
+MAGIC = b"HLFC1\n"
+# The array type of each kind of column values
+_TYPECODES = {"int": "q", "float": "d", "time": "q", "str": "I"}
+_INT64 = (-(1 << 63), (1 << 63) - 1)
+
+
+def _as_int(value: str) -> int | None:
+    try:
+        number = int(value)
+    except ValueError:
+        return None
+    # Only when writing it back gives the same text, e.g. not for "007" or "1_000"
+    return number if str(number) == value and _INT64[0] <= number <= _INT64[1] else None
+
+
+def _as_float(value: str) -> float | None:
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    return number if repr(number) == value else None
+
+
+def _as_time(value: str) -> int | None:
+    created = parse_time(value)
+    return None if created is None else round(created * 1e6)
+
+
+class _ChunkWriter:
+    """Writes arrays to the output, 8-byte aligned, and returns where they went."""
+
+    def __init__(self, file: BinaryIO):
+        self.file = file
+        self.position = len(MAGIC)
+        file.write(MAGIC)
+
+    def write(self, data: bytes | array.array) -> list[int]:
+        padding = -self.position % 8
+        if padding:
+            self.file.write(b"\0" * padding)
+            self.position += padding
+        self.file.write(data)
+        size = memoryview(data).nbytes
+        location = [self.position, size]
+        self.position += size
+        return location
+
+
+def _encode_column(writer: _ChunkWriter, key: str, rows: list[int], values: list[str], chunk_rows: int) -> dict:
+    column: dict[str, Any] = {"index": None if len(rows) == chunk_rows else writer.write(array.array("I", rows))}
+    for kind, typecode, convert in (
+        ("time", "q", _as_time) if key == "time" else ("int", "q", _as_int),
+        ("float", "d", _as_float),
+    ):
+        converted = []
+        for value in values:
+            number = convert(value)
+            if number is None:
+                break
+            converted.append(number)
+        else:
+            column["kind"] = kind
+            column["values"] = writer.write(array.array(typecode, converted))
+            return column
+    codes: dict[str, int] = {}
+    column["kind"] = "str"
+    column["values"] = writer.write(array.array("I", [codes.setdefault(value, len(codes)) for value in values]))
+    encoded = [value.encode() for value in codes]
+    offsets = array.array("Q", [0])
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    column["offsets"] = writer.write(offsets)
+    column["dictionary"] = writer.write(b"".join(encoded))
+    return column
+
+
+def convert(
+    source: IO[str] | IO[bytes] | Iterable[str] | Iterable[bytes] | Iterable[dict[str, str]],
+    destination: BinaryIO,
+    *,
+    chunk_records: int = 65536,
+    continuation_key: str | None = None,
+) -> int:
+    """Converts the records of `source` (a logfmt file object, an iterable of lines or of already parsed records) into
+    the columnar layout, written to the binary file `destination`. Returns the number of records.
+
+    Continuation lines (tracebacks) are dropped unless `continuation_key` is given, see `iter_parse`."""
+    writer = _ChunkWriter(destination)
+    chunks = []
+    keys: dict[str, None] = {}  # every column, in order of first appearance
+    total = 0
+    records = iter(source)
+    first = next(records, None)
+    if first is None:
+        records = iter(())
+    else:
+        records = _chain(first, records)
+        if not isinstance(first, dict):
+            records = iter_parse(records, continuation_key=continuation_key)
+    while True:
+        # {key: (row numbers, values)} of the current chunk
+        columns: dict[str, tuple[list[int], list[str]]] = {}
+        rows = 0
+        for record in records:
+            for key, value in record.items():
+                column = columns.get(key)
+                if column is None:
+                    column = columns[key] = ([], [])
+                    keys.setdefault(key)
+                column[0].append(rows)
+                column[1].append(value)
+            rows += 1
+            if rows == chunk_records:
+                break
+        if not rows:
+            break
+        chunks.append(
+            {
+                "rows": rows,
+                "columns": {
+                    key: _encode_column(writer, key, column_rows, values, rows)
+                    for key, (column_rows, values) in columns.items()
+                },
+            }
+        )
+        total += rows
+    footer = json.dumps(
+        {"version": 1, "byteorder": sys.byteorder, "rows": total, "columns": list(keys), "chunks": chunks},
+        separators=(",", ":"),
+    ).encode()
+    destination.write(footer)
+    destination.write(len(footer).to_bytes(8, "little"))
+    destination.write(MAGIC)
+    return total
+
+
+def _chain(first: Any, rest: Iterator[Any]) -> Iterator[Any]:
+    yield first
+    yield from rest
+
+
+class ColumnChunk:
+    """One column of one chunk. `values` are `memoryview`s cast to the column's type, straight over the mapped file
+    (for "str" columns, the dictionary codes, decoded with `dictionary`). `index` holds the row numbers within the
+    chunk that have values, or is None when every row has one."""
+
+    def __init__(self, buffer: memoryview, rows: int, column: dict, swap: bool):
+        self.kind: str = column["kind"]
+        self.rows = rows
+        self.index = self._array(buffer, column["index"], "I", swap)
+        self.values = self._array(buffer, column["values"], _TYPECODES[self.kind], swap)
+        if self.kind == "str":
+            self._offsets = self._array(buffer, column["offsets"], "Q", swap)
+            start, length = column["dictionary"]
+            self._blob = buffer[start : start + length]
+            self._dictionary: list[str] | None = None
+
+    @staticmethod
+    def _array(buffer: memoryview, location: list[int] | None, typecode: str, swap: bool) -> Any:
+        if location is None:
+            return None
+        start, length = location
+        view = buffer[start : start + length].cast(typecode)
+        if swap:
+            # Written on a machine with the other byte order, the only case that copies
+            swapped = array.array(typecode, view)
+            swapped.byteswap()
+            return swapped
+        return view
+
+    @property
+    def dictionary(self) -> list[str]:
+        """The distinct values of a "str" column chunk, indexed by the codes in `values`."""
+        if self._dictionary is None:
+            offsets, blob = self._offsets, self._blob
+            self._dictionary = [bytes(blob[offsets[i] : offsets[i + 1]]).decode() for i in range(len(offsets) - 1)]
+        return self._dictionary
+
+    def to_list(self) -> list[Any]:
+        """The value of every row of the chunk, None where the key is missing. Times are float epoch seconds."""
+        if self.kind == "str":
+            dictionary = self.dictionary
+            values: list[Any] = [dictionary[code] for code in self.values]
+        elif self.kind == "time":
+            values = [us / 1e6 for us in self.values]
+        else:
+            values = self.values.tolist()
+        if self.index is None:
+            return values
+        result: list[Any] = [None] * self.rows
+        for row, value in zip(self.index, values):
+            result[row] = value
+        return result
+
+
+class ColumnarReader:
+    """Reads a file written by `convert` through a memory map. Use as a context manager or call `close()`."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            self._file.close()
+            raise
+        size = len(self._mmap)
+        if self._mmap[: len(MAGIC)] != MAGIC or self._mmap[size - len(MAGIC) :] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a columnar log file.")
+        end = size - len(MAGIC) - 8
+        length = int.from_bytes(self._mmap[end : end + 8], "little")
+        footer = json.loads(self._mmap[end - length : end])
+        self._buffer = memoryview(self._mmap)
+        self._swap = footer["byteorder"] != sys.byteorder
+        self.rows: int = footer["rows"]
+        self.columns: list[str] = footer["columns"]
+        self._chunks: list[dict] = footer["chunks"]
+
+    def __enter__(self) -> "ColumnarReader":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        buffer = getattr(self, "_buffer", None)
+        if buffer is not None:
+            buffer.release()
+            self._buffer = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass  # column chunks are still in use, the mapping goes away with the last of them
+        self._file.close()
+
+    @property
+    def chunks(self) -> int:
+        return len(self._chunks)
+
+    def chunk_rows(self, chunk: int) -> int:
+        return self._chunks[chunk]["rows"]
+
+    def column_chunk(self, chunk: int, key: str) -> ColumnChunk | None:
+        """Column `key` of chunk number `chunk`, or None if no record of that chunk has the key."""
+        info = self._chunks[chunk]
+        column = info["columns"].get(key)
+        return None if column is None else ColumnChunk(self._buffer, info["rows"], column, self._swap)
+
+    def column(self, key: str) -> list[Any]:
+        """Every row's value of column `key`, None where the key is missing."""
+        result: list[Any] = []
+        for chunk in range(self.chunks):
+            column = self.column_chunk(chunk, key)
+            result.extend([None] * self.chunk_rows(chunk) if column is None else column.to_list())
+        return result
+
+    def column_values(self, key: str) -> Iterator[Any]:
+        """The `values` of column `key` in each chunk that has it, for aggregating without building lists of rows.
+        Check `column_chunk(...).kind` when a column's type may differ between chunks."""
+        for chunk in range(self.chunks):
+            column = self.column_chunk(chunk, key)
+            if column is not None:
+                yield column.values
+
+    def records(self) -> Iterator[dict[str, Any]]:
+        """Rebuilds the records (with typed values), one chunk in memory at a time."""
+        for chunk in range(self.chunks):
+            rows = self.chunk_rows(chunk)
+            records: list[dict[str, Any]] = [{} for _ in range(rows)]
+            for key in self._chunks[chunk]["columns"]:
+                column = self.column_chunk(chunk, key)
+                assert column is not None
+                for record, value in zip(records, column.to_list()):
+                    if value is not None:
+                        record[key] = value
+            yield from records
@@ -0,0 +1,213 @@
+"""Seekable, block-compressed log files, as written by `handlers.BlockCompressedFileHandler`.
+
+The file is a sequence of independent gzip members, each holding the complete lines of a block of records, so
+`zcat`/`gzip -d` read it like any gzip file. Next to it, `<file>.idx` has a logfmt line per block:
+
+    offset=0 size=48211 raw=1048644 records=5127 first=1718000000.123456 last=1718000059.987654
+
+`offset`/`size` locate the member in the file, `raw` is its uncompressed size and `first`/`last` are the earliest and
+latest `LogRecord.created` of its records, so `CompressedLogReader` only decompresses the blocks a time range needs.
+The index is written after its block, so a file that was cut short (e.g. by a crash) is repaired with `recover`."""
+
+import os
+import zlib
+from typing import IO, Iterator, NamedTuple
+
+from .index import parse_time
+from .parser import _RECORD_START_BYTES, parse_line
+
+
+class Block(NamedTuple):
+    offset: int
+    size: int
+    raw: int
+    records: int
+    first: float | None
+    last: float | None
+
+
+def index_path(path: str) -> str:
+    return path + ".idx"
+
+
+def index_line(block: Block) -> str:
+    line = f"offset={block.offset} size={block.size} raw={block.raw} records={block.records}"
+    if block.first is not None and block.last is not None:
+        line += f" first={block.first!r} last={block.last!r}"
+    return line + "\n"
+
+
+def compress_block(data: bytes | bytearray, level: int = 6) -> bytes:
+    """`data` as a gzip member of its own."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def read_index(path: str) -> list[Block] | None:
+    """The blocks listed in the index of `path`, or None if there is no index."""
+    try:
+        with open(index_path(path), encoding="utf-8") as file:
+            lines = file.readlines()
+    except FileNotFoundError:
+        return None
+    blocks = []
+    for line in lines:
+        if not line.endswith("\n"):
+            break  # the last entry was cut short, its block is found again by scanning
+        fields = parse_line(line)
+        first, last = fields.get("first"), fields.get("last")
+        blocks.append(
+            Block(
+                int(fields["offset"]),
+                int(fields["size"]),
+                int(fields["raw"]),
+                int(fields["records"]),
+                float(first) if first is not None else None,
+                float(last) if last is not None else None,
+            )
+        )
+    return blocks
+
+
+def _lines(data: bytes) -> Iterator[bytes]:
+    """The lines of `data`, with their newlines."""
+    position = 0
+    size = len(data)
+    while position < size:
+        end = data.find(b"\n", position) + 1 or size
+        yield data[position:end]
+        position = end
+
+
+def _scan_member(file: IO[bytes], offset: int) -> Block | None:
+    """Decompresses the gzip member at `offset`, returns None if it is incomplete."""
+    file.seek(offset)
+    decompressor = zlib.decompressobj(31)
+    chunks = []
+    consumed = 0
+    while not decompressor.eof:
+        data = file.read(1 << 16)
+        if not data:
+            return None
+        consumed += len(data)
+        try:
+            chunks.append(decompressor.decompress(data))
+        except zlib.error:
+            return None
+    raw = b"".join(chunks)
+    records = 0
+    first = last = None
+    for line in _lines(raw):
+        if not _RECORD_START_BYTES.match(line):
+            continue
+        records += 1
+        if (value := parse_line(line).get("time")) is not None and (created := parse_time(value)) is not None:
+            first = created if first is None else min(first, created)
+            last = created if last is None else max(last, created)
+    size = consumed - len(decompressor.unused_data)
+    return Block(offset, size, len(raw), records, first, last)
+
+
+def scan_blocks(path: str, offset: int = 0) -> list[Block]:
+    """Finds the complete blocks of `path` from `offset` on by decompressing them, for files without a usable index.
+    Their times come from the records' `time` values."""
+    blocks = []
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        while offset < size and (block := _scan_member(file, offset)) is not None:
+            blocks.append(block)
+            offset += block.size
+    return blocks
+
+
+def _consistent(blocks: list[Block]) -> bool:
+    return all(a.offset + a.size == b.offset for a, b in zip(blocks, blocks[1:])) and (
+        not blocks or blocks[0].offset == 0
+    )
+
+
+def recover(path: str) -> int:
+    """Makes `path` and its index agree before appending to them, returns where the next block goes.
+
+    Blocks written after the last index entry are indexed, a trailing incomplete block is cut off, and an index that
+    doesn't match the file is rebuilt."""
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        size = 0
+    blocks = read_index(path)
+    if blocks is None or not _consistent(blocks) or (blocks and blocks[-1].offset + blocks[-1].size > size):
+        rewrite, blocks = True, []
+    else:
+        # Also drops a last entry that was cut short
+        rewrite = os.path.getsize(index_path(path)) != sum(len(index_line(block)) for block in blocks)
+    end = blocks[-1].offset + blocks[-1].size if blocks else 0
+    missing = scan_blocks(path, end) if end < size else []
+    if missing:
+        end = missing[-1].offset + missing[-1].size
+    if end < size:
+        with open(path, "r+b") as file:
+            file.truncate(end)
+    if rewrite or missing:
+        with open(index_path(path), "w" if rewrite else "a", encoding="utf-8") as file:
+            file.writelines(index_line(block) for block in (blocks if rewrite else []) + missing)
+    return end
+
+
+class CompressedLogReader:
+    """Reads a block-compressed log file, through its index when it has a usable one, otherwise by scanning it."""
+
+    def __init__(self, path: str):
+        self.path = path
+        blocks = read_index(path)
+        size = os.path.getsize(path)
+        if blocks is None or not _consistent(blocks) or (blocks and blocks[-1].offset + blocks[-1].size > size):
+            blocks = []
+        end = blocks[-1].offset + blocks[-1].size if blocks else 0
+        if end < size:
+            # Not indexed (yet), e.g. the block the handler is writing right now
+            blocks += scan_blocks(path, end)
+        self.blocks = blocks
+
+    @staticmethod
+    def _read(file: IO[bytes], block: Block) -> bytes:
+        file.seek(block.offset)
+        return zlib.decompress(file.read(block.size), 31)
+
+    def read_block(self, block: Block) -> bytes:
+        """The uncompressed lines of `block`."""
+        with open(self.path, "rb") as file:
+            return self._read(file, block)
+
+    def select(self, since: float | None = None, until: float | None = None) -> list[Block]:
+        """The blocks that may hold records logged within [since, until]."""
+        return [
+            block
+            for block in self.blocks
+            if block.first is None
+            or not ((until is not None and block.first > until) or (since is not None and block.last < since))
+        ]
+
+    def lines(self, since: float | None = None, until: float | None = None) -> Iterator[bytes]:
+        """Yields the lines (with their newlines) of the records within [since, until], by their `time` values, in
+        file order. Continuation lines (tracebacks) come with their record. Only the blocks in range are read."""
+        with open(self.path, "rb") as file:
+            for block in self.select(since, until):
+                yield from self._block_lines(self._read(file, block), block, since, until)
+
+    @staticmethod
+    def _block_lines(data: bytes, block: Block, since: float | None, until: float | None) -> Iterator[bytes]:
+        if (since is None or (block.first is not None and block.first >= since)) and (
+            until is None or (block.last is not None and block.last <= until)
+        ):
+            yield from _lines(data)  # entirely in range
+            return
+        keep = False
+        for line in _lines(data):
+            if _RECORD_START_BYTES.match(line):
+                created = parse_time(parse_line(line).get("time", ""))
+                keep = created is not None and not (
+                    (since is not None and created < since) or (until is not None and created > until)
+                )
+            if keep:
+                yield line
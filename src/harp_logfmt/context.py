@@ -0,0 +1,78 @@
+"""Fields bound to the current `contextvars` context, emitted by `LogfmtFormatter` on every record logged in it.
+
+Each asyncio task runs in a copy of the context it was created in, so fields bound inside a task are only seen by that
+task, while fields bound before creating it are inherited. New threads start without bound fields. The handlers of this
+package that format records later or on another thread keep the fields bound where each record was logged."""
+
+import contextvars
+import logging
+from typing import Any
+
+
+class _Bound:
+    """An immutable set of bound fields, and its rendered logfmt fragment per formatter configuration."""
+
+    __slots__ = ("fields", "fragments")
+
+    def __init__(self, fields: dict[str, Any]):
+        self.fields = fields
+        # LogfmtFormatter._fragment_token -> the rendered fields, filled in as formatters render them
+        self.fragments: dict[object, str] = {}
+
+
+_bound: contextvars.ContextVar[_Bound | None] = contextvars.ContextVar("harp_logfmt_bound", default=None)
+# The attribute of a LogRecord holding the fields bound where it was logged, see `_stash_bound`
+_RECORD_ATTR = "_harp_logfmt_bound"
+_UNSET = object()
+
+
+class Binding:
+    """Returned by `bind` and `unbind`. As a context manager, or with `reset()`, restores the fields bound before."""
+
+    def __init__(self, token: contextvars.Token):
+        self._token = token
+
+    def reset(self):
+        _bound.reset(self._token)
+
+    def __enter__(self) -> "Binding":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.reset()
+
+
+def _set(fields: dict[str, Any]) -> Binding:
+    return Binding(_bound.set(_Bound(fields) if fields else None))
+
+
+def bind(**fields: Any) -> Binding:
+    """Binds `fields` to the current context, on top of those already bound. Either keep them bound, or use the result
+    as a context manager (`with bind(request_id=...):`) to unbind them on exit."""
+    current = _bound.get()
+    return _set({**current.fields, **fields} if current is not None else fields)
+
+
+def unbind(*keys: str) -> Binding:
+    """Removes bound fields from the current context."""
+    current = _bound.get()
+    return _set({key: value for key, value in current.fields.items() if key not in keys} if current else {})
+
+
+def bound_fields() -> dict[str, Any]:
+    """A copy of the fields bound to the current context."""
+    current = _bound.get()
+    return dict(current.fields) if current is not None else {}
+
+
+def _stash_bound(record: logging.LogRecord):
+    """Keeps the fields bound to the current context on `record`, for handlers that format it later or on another
+    thread, outside of the context it was logged in. A record that already has them keeps its own."""
+    if _RECORD_ATTR not in record.__dict__:
+        record.__dict__[_RECORD_ATTR] = _bound.get()
+
+
+def _record_bound(record: logging.LogRecord) -> _Bound | None:
+    """The fields bound where `record` was logged: those stashed on it, or else those of the current context."""
+    bound = record.__dict__.get(_RECORD_ATTR, _UNSET)
+    return _bound.get() if bound is _UNSET else bound  # type: ignore[return-value]
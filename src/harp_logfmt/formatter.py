@@ -1,10 +1,63 @@
+import functools
 import logging
 import re
 import sys
-from typing import Any, Callable, Container, Iterable
+from collections.abc import Mapping, Sized
+from typing import Any, Callable, Container, Iterable, Iterator, Literal, overload
 import datetime
+from . import instrumentation
 from .ansicolors import ANSIColors
-from .value_formatters import default_formatters
+from .context import _RECORD_ATTR, _Bound, _record_bound
+from .paths import PathNode, PathRules
+from .templates import MessageTemplate, compile_template
+from .timestamps import TIME_FORMAT, TimestampRenderer
+from .tracebacks import TracebackCache, exception_fingerprint, stack_fingerprint
+from .value_formatters import default_formatters, limit_aware_formatters
+
+_HAS_TASK_NAME = sys.version_info >= (3, 12)
+
+# Characters that can't appear in keys: whitespace, '=', '"' and control characters (C0, DEL and C1, which includes
+# the NEL line break). U+2028/U+2029 are line breaks to str.splitlines
+_UNSAFE_CHARS = re.compile(r'[\x00-\x20="\x7f-\x9f\u2028\u2029]')
+# Used inside quotes. Every character it maps is non-printable, except '"' and '\\'
+_VALUE_ESCAPES = {
+    **{i: f"\\u{i:04x}" for i in [*range(0x20), *range(0x7F, 0xA0), 0x2028, 0x2029]},
+    ord("\\"): "\\\\",
+    ord('"'): '\\"',
+    ord("\n"): "\\n",
+    ord("\r"): "\\r",
+    ord("\t"): "\\t",
+}
+
+
+# Stands in for the key of the bound fields' fragment in a record's data. Compared by identity, the fragment is
+# emitted as is
+_BOUND_KEY = "\0bound"
+# The attribute of a LogRecord holding which of its traces were rendered, see `_trailer`
+_TRACES_ATTR = "_harp_logfmt_traces"
+# The fields every record has, which `max_value_length` doesn't cut, so lines stay parseable by time and level
+_CORE_KEYS = frozenset(("time", "function", "taskName", "name", "level"))
+# The fields a record sets itself, bound fields named like one of them are left out
+_RESERVED_KEYS = _CORE_KEYS | {"message", "data"}
+
+
+# Stand in for the time and level of a record in `_record_data(record, capture=True)`, see harp_logfmt.capture
+_CAPTURED_TIME = object()
+_CAPTURED_LEVEL = object()
+
+
+class _PreRendered(str):
+    """A value that is already valid logfmt (e.g. the ANSI colored level) and is emitted without quoting/escaping."""
+
+    __slots__ = ()
+
+
+class _Marker(str):
+    """A value written in place of what the expansion limits left out (e.g. `<cycle>`), which `max_value_length`
+    doesn't cut."""
+
+    __slots__ = ()
+
 
 CUSTOM_FORMATTER_PREDICATE_FUNC = Callable[[Any], bool]
 CUSTOM_FORMATTER_PREDICATE = type | tuple[type, ...] | CUSTOM_FORMATTER_PREDICATE_FUNC
@@ -14,6 +67,17 @@ CUSTOM_FORMATTER_FUNC = Callable[
 ]  # Returns a dict of {key: value} pairs and a boolean indicating whether to use getitem syntax (getitem syntax = '[key]=value', non-getitem syntax = '.key=value')
 
 
+class _ExpansionState:
+    """Per-record bookkeeping shared by the recursive `_format_value` calls."""
+
+    __slots__ = ("keys_left", "seen")
+
+    def __init__(self, keys_left: int | None):
+        self.keys_left = keys_left
+        # ids of the containers on the current expansion path, for cycle detection
+        self.seen: set[int] = set()
+
+
 class LogfmtFormatter(logging.Formatter):
     """A logfmt formatter for Python's logging module."""
 
@@ -22,24 +86,103 @@ class LogfmtFormatter(logging.Formatter):
         *args,
         colorize: bool = True,
         exclude_keys: Iterable[str] = (),
+        exclude_paths: Iterable[str] = (),
+        include_paths: Iterable[str] = (),
         msg_regex: str | re.Pattern | None = None,
+        msg_templates: bool | Mapping[str, Iterable[str]] = False,
         highlight_keys: Iterable[str] = ("message",),
         include_default_formatters: bool = True,
         timezone: datetime.tzinfo = datetime.timezone.utc,
         discard_none: bool = True,
+        key_cache_size: int | None = 1024,
+        template_cache_size: int | None = 1024,
+        time_format: TIME_FORMAT | None = None,
+        max_depth: int | None = None,
+        max_items: int | None = None,
+        max_value_length: int | None = None,
+        max_keys: int | None = None,
+        exc_fingerprints: bool = False,
+        exc_cache_size: int = 1024,
+        exc_reemit_interval: float | None = 300.0,
+        instrument: bool = False,
+        stats_interval: float | None = None,
         **kwargs,
     ):
+        if time_format is None:
+            # An explicitly passed datefmt (keyword or logging.Formatter's second positional argument) is honored
+            time_format = "datefmt" if kwargs.get("datefmt") or (len(args) > 1 and args[1]) else "iso"
         kwargs.setdefault("datefmt", "%Y-%m-%dT%H:%M:%S%.%f%z")
         super().__init__(*args, **kwargs)
+        self._time_format: TIME_FORMAT = time_format
+        # LRU of key -> pre-rendered (head, tail, quoted head, quoted tail), bounded so high-cardinality keys can't
+        # grow it without limit
+        self._key_plan = functools.lru_cache(maxsize=key_cache_size)(self._build_key_plan)
+        self._key_plan_bytes = functools.lru_cache(maxsize=key_cache_size)(self._build_key_plan_bytes)
+        self._default_attributes = frozenset(self.default_logrecord_attributes)
+        # Replaced whenever the rendering or exclusion of keys changes, so fragments cached by bound contexts expire
+        self._fragment_token = object()
         self._exclude_keys = set(exclude_keys)
-        self.colorize = colorize
+        self._key_cache_size = key_cache_size
+        self._set_path_rules(PathRules(exclude_paths, include_paths))
+        self._colorize = colorize
         self._msg_regex: re.Pattern | None = re.compile(msg_regex) if isinstance(msg_regex, str) else msg_regex
+        # msg_templates=True emits the arguments of `%(name)s` templates as fields instead of the message, without
+        # interpolating it. A {template: field names} mapping also names the positional placeholders of those
+        # templates. Messages that aren't templates fitting their args, or whose placeholders are named like fields the
+        # record already has (time, name, extras...), fall back to msg_regex and message.
+        # LRU of record.msg -> compiled template (None for messages that aren't named-placeholder templates)
+        self._compiled_template = functools.lru_cache(maxsize=template_cache_size)(compile_template)
+        self.msg_templates = msg_templates
         self._highlight_keys = set(highlight_keys)
         self.custom_formatters: dict[CUSTOM_FORMATTER_PREDICATE, CUSTOM_FORMATTER_FUNC] = {}
-        self.timezone = timezone
+        # Conditions that must be re-evaluated for every value instead of being resolved once per type
+        self._uncached_conditions: set[CUSTOM_FORMATTER_PREDICATE] = set()
+        # Maps type(value) -> ((condition or None if already resolved, formatter), ...) in resolution order
+        self._dispatch_cache: dict[
+            type, tuple[tuple[CUSTOM_FORMATTER_PREDICATE | None, CUSTOM_FORMATTER_FUNC], ...]
+        ] = {}
+        self._timestamp = TimestampRenderer(time_format, timezone, self.datefmt)
         self.discard_none = discard_none
+        # Expansion limits, None means unlimited
+        self.max_depth = max_depth
+        self.max_items = max_items
+        self._max_value_length = max_value_length
+        self.max_keys = max_keys
+        # With exc_fingerprints, records with exc_info/stack_info get exc_hash, exc_type and exc_msg (or stack_hash)
+        # fields, and a trace is only rendered the first time its fingerprint is seen and every exc_reemit_interval
+        # seconds after that
+        self._tracebacks = TracebackCache(exc_cache_size, exc_reemit_interval) if exc_fingerprints else None
         if include_default_formatters:
             self.custom_formatters.update(default_formatters)
+        self._stats = instrumentation.FormatterStats(stats_interval)
+        self._instrument = False
+        self.instrument = instrument
+
+    @property
+    def colorize(self) -> bool:
+        return self._colorize
+
+    @colorize.setter
+    def colorize(self, value: bool):
+        self._colorize = value
+        self._clear_key_plans()
+
+    @property
+    def timezone(self) -> datetime.tzinfo | None:
+        return self._timestamp.timezone
+
+    @timezone.setter
+    def timezone(self, value: datetime.tzinfo | None):
+        self._timestamp = TimestampRenderer(self._time_format, value, self.datefmt)
+
+    @property
+    def time_format(self) -> TIME_FORMAT:
+        return self._time_format
+
+    @time_format.setter
+    def time_format(self, value: TIME_FORMAT):
+        self._timestamp = TimestampRenderer(value, self._timestamp.timezone, self.datefmt)
+        self._time_format = value
 
     @property
     def exclude_keys(self) -> Container[str]:
@@ -48,6 +191,40 @@ class LogfmtFormatter(logging.Formatter):
     @exclude_keys.setter
     def exclude_keys(self, value: Iterable[str]):
         self._exclude_keys = set(value)
+        self._fragment_token = object()
+
+    @property
+    def max_value_length(self) -> int | None:
+        """Longer values are cut to this many characters, followed by `...`. The core fields (`_CORE_KEYS`) and the
+        markers of the expansion limits are left whole."""
+        return self._max_value_length
+
+    @max_value_length.setter
+    def max_value_length(self, value: int | None):
+        self._max_value_length = value
+        self._fragment_token = object()
+
+    def _set_path_rules(self, rules: PathRules):
+        self._path_rules = rules
+        self._fragment_token = object()
+        # Top-level keys repeat from record to record, so their exclusion is memoized
+        self._root_excluded = functools.lru_cache(maxsize=self._key_cache_size)(rules.root_excluded)
+
+    @property
+    def exclude_paths(self) -> tuple[str, ...]:
+        return self._path_rules.exclude
+
+    @exclude_paths.setter
+    def exclude_paths(self, value: Iterable[str]):
+        self._set_path_rules(PathRules(value, self._path_rules.include))
+
+    @property
+    def include_paths(self) -> tuple[str, ...]:
+        return self._path_rules.include
+
+    @include_paths.setter
+    def include_paths(self, value: Iterable[str]):
+        self._set_path_rules(PathRules(self._path_rules.exclude, value))
 
     @property
     def msg_regex(self) -> re.Pattern | None:
@@ -57,6 +234,43 @@ class LogfmtFormatter(logging.Formatter):
     def msg_regex(self, value: str | re.Pattern | None):
         self._msg_regex = re.compile(value) if isinstance(value, str) else value
 
+    @property
+    def msg_templates(self) -> bool | dict[str, tuple[str, ...]]:
+        return self._msg_templates
+
+    @msg_templates.setter
+    def msg_templates(self, value: bool | Mapping[str, Iterable[str]]):
+        registered: dict[str, MessageTemplate | None] = {}
+        if isinstance(value, Mapping):
+            value = {msg: tuple(names) for msg, names in value.items()}
+            # Compiled right away, so field names that don't fit their template fail here rather than when logging
+            registered = {msg: compile_template(msg, names) for msg, names in value.items()}
+        self._msg_templates = value
+        self._registered_templates = registered
+        self._compiled_template.cache_clear()
+
+    @property
+    def instrument(self) -> bool:
+        """Whether per-phase timings and counters are recorded for `stats()`. Without it, nothing is measured and
+        formatting runs no extra code. With a `stats_interval`, `stats()` is also logged (as `data`) to the
+        "harp_logfmt.stats" logger every `stats_interval` seconds, checked as records are formatted."""
+        return self._instrument
+
+    @instrument.setter
+    def instrument(self, value: bool):
+        if value and not self._instrument:
+            instrumentation.install(self, self._stats)
+        elif not value and self._instrument:
+            instrumentation.uninstall(self)
+        self._instrument = value
+
+    def stats(self) -> dict[str, Any]:
+        """A snapshot of the timings (per phase, in microseconds) and counters recorded while `instrument` was set."""
+        return self._stats.snapshot()
+
+    def reset_stats(self):
+        self._stats.reset()
+
     @property
     def highlight_keys(self) -> Container[str]:
         return self._highlight_keys
@@ -64,29 +278,88 @@ class LogfmtFormatter(logging.Formatter):
     @highlight_keys.setter
     def highlight_keys(self, value: Iterable[str]):
         self._highlight_keys = set(value)
+        self._clear_key_plans()
 
     @msg_regex.setter
     def msg_regex(self, value: str | re.Pattern | None):
         self._msg_regex = re.compile(value) if isinstance(value, str) else value
 
-    def kv_to_logfmt(self, key: str, value: str) -> str:
-        realkey = f"{ANSIColors.BOLD.BLACK}{key}={ANSIColors.RESET}" if self.colorize else (key + "=")
-        realvalue = (
-            f"{ANSIColors.REGULAR.BLACK}{value}{ANSIColors.RESET}"
-            if self.colorize and key not in self._highlight_keys
-            else str(value)
+    def _build_key_plan(self, key: str) -> tuple[str, str, str, str]:
+        """Pre-renders everything around the value of `key`: (head, tail, quoted head, quoted tail)."""
+        # Keys can't be quoted, so anything that would need quoting is replaced
+        key = _UNSAFE_CHARS.sub("_", key) or "_"
+        realkey = f"{ANSIColors.BOLD.BLACK}{key}={ANSIColors.RESET}" if self._colorize else (key + "=")
+        if self._colorize and key not in self._highlight_keys:
+            value_head, value_tail = ANSIColors.REGULAR.BLACK, ANSIColors.RESET
+        else:
+            value_head, value_tail = "", ""
+        quotechar = f'{ANSIColors.REGULAR.BLACK}"{ANSIColors.RESET}' if self._colorize else '"'
+        return (
+            realkey + value_head,
+            value_tail,
+            realkey + quotechar + value_head,
+            value_tail + quotechar,
         )
-        quotechar = f'{ANSIColors.REGULAR.BLACK}"{ANSIColors.RESET}' if self.colorize else '"'
-        if " " in realvalue:
-            return f"{realkey}{quotechar}{realvalue}{quotechar}"
-        return f"{realkey}{realvalue}"
+
+    def _build_key_plan_bytes(self, key: str) -> tuple[bytes, bytes, bytes, bytes]:
+        head, tail, quoted_head, quoted_tail = self._key_plan(key)
+        return head.encode(), tail.encode(), quoted_head.encode(), quoted_tail.encode()
+
+    def _clear_key_plans(self):
+        self._key_plan.cache_clear()
+        self._key_plan_bytes.cache_clear()
+        self._fragment_token = object()
+
+    def _render_value(self, value: Any, key: str | None = None) -> tuple[str, bool]:
+        """Returns the text of `value` (of `key`) as it goes between the key plan's head and tail, and whether it is
+        quoted.
+
+        Values with whitespace, '=', '"' or control characters are quoted, and inside quotes backslashes, quotes and
+        control characters are escaped. Other values, like identifiers, numbers and UUIDs, are returned as is."""
+        if type(value) is _PreRendered:
+            return value, False
+        cut = type(value) is not _Marker
+        value = str(value)
+        max_value_length = self._max_value_length
+        if max_value_length is not None and len(value) > max_value_length and key not in _CORE_KEYS and cut:
+            value = value[:max_value_length] + "..."
+        if value.isalnum():
+            return value, False
+        # str.isprintable() is False for every control character and for whitespace other than ' '
+        if value.isprintable() and '"' not in value:
+            if " " not in value and "=" not in value:
+                return value, False
+            if "\\" not in value:
+                return value, True
+        return value.translate(_VALUE_ESCAPES), True
+
+    def kv_to_logfmt(self, key: str, value: str) -> str:
+        if key is _BOUND_KEY:
+            return value
+        # Same rules as _render_value, inlined since this runs for every key of every record
+        head, tail, quoted_head, quoted_tail = self._key_plan(key)
+        if type(value) is _PreRendered:
+            return head + value + tail
+        cut = type(value) is not _Marker
+        value = str(value)
+        max_value_length = self._max_value_length
+        if max_value_length is not None and len(value) > max_value_length and key not in _CORE_KEYS and cut:
+            value = value[:max_value_length] + "..."
+        if value.isalnum():
+            return head + value + tail
+        if value.isprintable() and '"' not in value:
+            if " " not in value and "=" not in value:
+                return head + value + tail
+            if "\\" not in value:
+                return quoted_head + value + quoted_tail
+        return quoted_head + value.translate(_VALUE_ESCAPES) + quoted_tail
 
     level_words_colored = {
-        logging.DEBUG: f"{ANSIColors.REGULAR.BLACK}DEBUG{ANSIColors.RESET}",
-        logging.INFO: f"{ANSIColors.REGULAR.CYAN}INFO{ANSIColors.RESET}",
-        logging.WARNING: f"{ANSIColors.REGULAR.YELLOW}WARNING{ANSIColors.RESET}",
-        logging.ERROR: f"{ANSIColors.REGULAR.RED}ERROR{ANSIColors.RESET}",
-        logging.CRITICAL: f"{ANSIColors.BOLD.RED}CRITICAL{ANSIColors.RESET}",
+        logging.DEBUG: _PreRendered(f"{ANSIColors.REGULAR.BLACK}DEBUG{ANSIColors.RESET}"),
+        logging.INFO: _PreRendered(f"{ANSIColors.REGULAR.CYAN}INFO{ANSIColors.RESET}"),
+        logging.WARNING: _PreRendered(f"{ANSIColors.REGULAR.YELLOW}WARNING{ANSIColors.RESET}"),
+        logging.ERROR: _PreRendered(f"{ANSIColors.REGULAR.RED}ERROR{ANSIColors.RESET}"),
+        logging.CRITICAL: _PreRendered(f"{ANSIColors.BOLD.RED}CRITICAL{ANSIColors.RESET}"),
     }
 
     level_words = {
@@ -122,6 +395,8 @@ class LogfmtFormatter(logging.Formatter):
         "threadName",
         "taskName",
         "data",  # Technically this is not part of the default log record but we specially handle this attribute
+        _RECORD_ATTR,  # The bound fields stashed by handlers that format records later, see context._stash_bound
+        _TRACES_ATTR,
     ]
 
     def colorize_level_if_debug(self, levelno: int) -> str:
@@ -129,50 +404,170 @@ class LogfmtFormatter(logging.Formatter):
             return LogfmtFormatter.level_words_colored[levelno]
         return LogfmtFormatter.level_words[levelno]
 
-    def _format_value(self, value: Any, prefix: str) -> dict[str, str]:
+    @staticmethod
+    def _condition_matches(condition: CUSTOM_FORMATTER_PREDICATE, value: Any) -> bool:
+        if isinstance(condition, (type, tuple)):
+            return isinstance(value, condition)
+        return condition(value)
+
+    def _resolve_formatters(
+        self, value: Any
+    ) -> tuple[tuple[CUSTOM_FORMATTER_PREDICATE | None, CUSTOM_FORMATTER_FUNC], ...]:
+        """Returns the formatters that may apply to values of type(value), in resolution order.
+
+        Cacheable conditions are evaluated once per type: failing ones are dropped and the first matching one ends the
+        chain with a `None` condition. Uncached conditions are kept and evaluated against every value."""
+        value_type = type(value)
+        try:
+            return self._dispatch_cache[value_type]
+        except KeyError:
+            pass
+        candidates: list[tuple[CUSTOM_FORMATTER_PREDICATE | None, CUSTOM_FORMATTER_FUNC]] = []
+        for condition, formatter in reversed(self.custom_formatters.items()):
+            if condition in self._uncached_conditions:
+                candidates.append((condition, formatter))
+            elif self._condition_matches(condition, value):
+                candidates.append((None, formatter))
+                break
+        resolved = tuple(candidates)
+        self._dispatch_cache[value_type] = resolved
+        return resolved
+
+    def clear_formatter_cache(self):
+        """Clears the per-type formatter dispatch cache. Only needed if `custom_formatters` is modified directly."""
+        self._dispatch_cache.clear()
+
+    def _format_value(
+        self,
+        value: Any,
+        prefix: str,
+        out: dict[str, Any],
+        depth: int = 0,
+        state: _ExpansionState | None = None,
+        nodes: tuple[PathNode, ...] = (),
+        restricted: bool = False,
+    ):
+        """Flattens `value` into {key: value} pairs below `prefix`, written straight into `out`.
+
+        Every level writes into the same dict, so nothing is built and merged per container. As with `dict.update`, a
+        key that is already in `out` keeps its position and gets the new value.
+
+        `nodes` are the path rule nodes matching `prefix`. If `restricted`, `prefix` is under a root with include rules
+        but not (yet) inside an included path, so only the parts leading to an included path are visited."""
         if isinstance(value, str):
-            return {prefix: value}
+            if not restricted:
+                out[prefix] = value
+            return
         elif value is None:
-            return {} if self.discard_none else {prefix: "None"}
-        for formatter_type, formatter in reversed(self.custom_formatters.items()):
-            if isinstance(formatter_type, (type, tuple)):
-                is_formatter_type = isinstance(value, formatter_type)
-            else:
-                is_formatter_type = formatter_type(value)
-            if is_formatter_type:
-                base: dict[str, str] = {}
+            if not (self.discard_none or restricted):
+                out[prefix] = "None"
+            return
+        for condition, formatter in self._resolve_formatters(value):
+            if condition is None or self._condition_matches(condition, value):
+                if state is None:
+                    state = _ExpansionState(self.max_keys)
+                value_id = id(value)
+                if value_id in state.seen:
+                    if not restricted:
+                        out[prefix] = _Marker("<cycle>")
+                    return
+                if self.max_depth is not None and depth >= self.max_depth:
+                    if not restricted:
+                        out[prefix] = _Marker(f"<{type(value).__name__}>")
+                    return
+                max_items = self.max_items
+                limited = max_items is not None and formatter in limit_aware_formatters
                 # new_keys is a dict of {"key": "value"} pairs
                 # If as_getitem, the final keys will be {f"{prefix}[{key}]": value}
                 # If not as_getitem, the final keys will be {f"{prefix}.{key}": value}
-                new_data, as_getitem = formatter(value)
-                for key, value in new_data.items():
-                    expanded = self._format_value(value, f"{prefix}[{key}]" if as_getitem else f"{prefix}.{key}")
-                    base.update(expanded)
-                return base
-        return {prefix: str(value)}
+                if limited:
+                    # One extra item tells whether anything was cut off
+                    new_data, as_getitem = formatter(value, limit=max_items + 1)
+                else:
+                    new_data, as_getitem = formatter(value)
+                format_value = self._format_value
+                state.seen.add(value_id)
+                try:
+                    for index, (key, item) in enumerate(new_data.items()):
+                        keys_left = state.keys_left
+                        if (max_items is not None and index >= max_items) or (
+                            # Leave room for the truncation marker itself
+                            keys_left is not None and keys_left <= 1
+                        ):
+                            # With no room left, a nested value already used the last key for its own marker
+                            if keys_left is None or keys_left >= 1:
+                                total = (len(value) if isinstance(value, Sized) else None) if limited else len(new_data)
+                                out[f"{prefix}[...]"] = _Marker("+more" if total is None else f"+{total - index} more")
+                            break
+                        child_nodes: tuple[PathNode, ...] = ()
+                        child_restricted = False
+                        if nodes:
+                            child_nodes = PathRules.step(nodes, str(key))
+                            if any(node.exclude for node in child_nodes):
+                                continue
+                            if restricted and not any(node.include for node in child_nodes):
+                                if not any(node.has_include for node in child_nodes):
+                                    continue
+                                child_restricted = True
+                        child_prefix = f"{prefix}[{key}]" if as_getitem else f"{prefix}.{key}"
+                        if keys_left is None:
+                            format_value(item, child_prefix, out, depth + 1, state, child_nodes, child_restricted)
+                        else:
+                            # Counts every key the child added once, replacing what nested levels subtracted for
+                            # the same keys
+                            size = len(out)
+                            format_value(item, child_prefix, out, depth + 1, state, child_nodes, child_restricted)
+                            state.keys_left = keys_left - (len(out) - size)
+                finally:
+                    state.seen.discard(value_id)
+                return
+        if not restricted:
+            out[prefix] = str(value)
 
-    def format(self, record: logging.LogRecord) -> str:
-        dt = datetime.datetime.fromtimestamp(record.created, tz=datetime.timezone.utc).astimezone(self.timezone)
-        data = {
-            "time": dt.isoformat("T"),
+    def _expand_root(self, value: Any, root: str, state: _ExpansionState, out: dict[str, Any]):
+        rules = self._path_rules
+        if not rules:
+            self._format_value(value, root, out, 0, state)
+            return
+        nodes = PathRules.step((rules.root,), root)
+        if any(node.exclude for node in nodes):
+            return
+        restricted = any(node.has_include for node in nodes) and not any(node.include for node in nodes)
+        self._format_value(value, root, out, 0, state, nodes, restricted)
+
+    def _record_data(self, record: logging.LogRecord, capture: bool = False) -> dict[str, Any]:
+        """Collects every field of `record` in output order, before exclusion and None filtering.
+
+        With `capture`, the time and level are left to be rendered later (`_CAPTURED_TIME`/`_CAPTURED_LEVEL`) and
+        bound fields are added one by one, so that nothing depends on the rendering options."""
+        data: dict[str, Any] = {
+            "time": _CAPTURED_TIME if capture else self._timestamp.render(record.created),
             "function": record.funcName,
         }
-        if sys.version_info >= (3, 12):
+        if _HAS_TASK_NAME:
             data["taskName"] = record.taskName
-        data.update(
-            {
-                key: (value if isinstance(value, str) and value is not None else str(value))
-                for key, value in record.__dict__.items()
-                if key not in self.default_logrecord_attributes
-            }
-        )
-        data.update(
-            {"name": record.name, "level": self.colorize_level_if_debug(record.levelno)}
-        )  # We put this last because we always want this to be last
+        default_attributes = self._default_attributes
+        for key, value in record.__dict__.items():
+            if key not in default_attributes:
+                data[key] = value if isinstance(value, str) else str(value)
+        if (bound := _record_bound(record)) is not None:
+            self._add_bound(bound, data, as_fragment=not capture)
+        # We put these last because we always want them to be last
+        data["name"] = record.name
+        data["level"] = _CAPTURED_LEVEL if capture else self.colorize_level_if_debug(record.levelno)
+        state = None
         if not isinstance(record.msg, str):
-            msg = record.msg
-            data.update(self._format_value(msg, "message"))
-        elif self.msg_regex and (match := self.msg_regex.search(record.getMessage())):
+            state = _ExpansionState(None if self.max_keys is None else self.max_keys - len(data))
+            self._expand_root(record.msg, "message", state, data)
+        elif (
+            self._msg_templates is not False
+            and (fields := self._template_fields(record)) is not None
+            # A placeholder named like one of the record's fields would replace it, keep the message instead
+            and fields.keys().isdisjoint(data)
+            and not (bound is not None and _BOUND_KEY in data and not fields.keys().isdisjoint(bound.fields))
+        ):
+            data.update(fields)
+        elif self._msg_regex and (match := self._msg_regex.search(record.getMessage())):
             groups = match.groupdict()
             if not groups:
                 raise ValueError("msg_regex must have at least one named group.")
@@ -180,33 +575,268 @@ class LogfmtFormatter(logging.Formatter):
         else:
             data["message"] = record.getMessage()
         if (attr := getattr(record, "data", None)) is not None:
-            data.update(self._format_value(attr, "data"))
-        if self._exclude_keys:
-            common_keys = set(data.keys()) & self._exclude_keys
-            for key in common_keys:
-                if key in data:
-                    del data[key]
-        for key, value in data.copy().items():
-            if value is None and self.discard_none:
-                del data[key]
-        base = " ".join([self.kv_to_logfmt(key, value) for key, value in data.items()])
+            if state is None:
+                state = _ExpansionState(None)
+            if self.max_keys is not None:
+                state.keys_left = self.max_keys - len(data)
+            self._expand_root(attr, "data", state, data)
+        return data
+
+    def _template_fields(self, record: logging.LogRecord) -> dict[str, str] | None:
+        """The fields of a templated `record.msg`, or None when the message isn't a template that fits `record.args`."""
+        if not record.args:
+            return None  # getMessage doesn't interpolate without args
+        msg = record.msg
+        template = self._registered_templates.get(msg)
+        if template is None:
+            if msg in self._registered_templates:
+                return None
+            template = self._compiled_template(msg)
+            if template is None:
+                return None
+        return template.extract(record.args)
+
+    def _add_bound(self, bound: _Bound, data: dict[str, Any], as_fragment: bool = True):
+        """Adds the fields bound to the current context, as a fragment rendered once per context and configuration.
+
+        Bound fields named like a field the record sets itself (`_RESERVED_KEYS`) are left out."""
+        if not as_fragment or not bound.fields.keys().isdisjoint(data):
+            # Extra attributes win over bound fields, render the others one by one
+            for key, value in bound.fields.items():
+                if key not in data and key not in _RESERVED_KEYS:
+                    data[key] = value if isinstance(value, str) else str(value)
+            return
+        token = self._fragment_token
+        fragment = bound.fragments.get(token)
+        if fragment is None:
+            fields = {
+                key: value if isinstance(value, str) else str(value)
+                for key, value in bound.fields.items()
+                if key not in _RESERVED_KEYS
+            }
+            fragment = bound.fragments[token] = " ".join(
+                [self.kv_to_logfmt(key, value) for key, value in self._fields(fields)]
+            )
+        if fragment:
+            data[_BOUND_KEY] = fragment
+
+    def _fields(self, data: dict[str, Any]) -> Iterator[tuple[str, Any]]:
+        """Yields the (key, value) pairs of `data` that are actually emitted."""
+        exclude_keys = self._exclude_keys
+        keep_none = not self.discard_none
+        root_excluded = self._root_excluded if self._path_rules.exclude else None
+        for key, value in data.items():
+            if (
+                (value is not None or keep_none)
+                and key not in exclude_keys
+                and not (root_excluded and root_excluded(key))
+            ):
+                yield key, value
+
+    def _trailer(self, record: logging.LogRecord, data: dict[str, Any]) -> str:
+        """The exception and stack info text that follows the logfmt line.
+
+        With exception fingerprints, adds the fingerprint fields to `data` and leaves out the traces that were rendered
+        recently. Whether they are is decided once per record, so every handler sharing this formatter renders the
+        same trailer for it."""
+        tracebacks = self._tracebacks
+        trailer = ""
+        if tracebacks is None:
+            if record.exc_info:
+                trailer += "\n" + self.formatException(record.exc_info)
+            if record.stack_info:
+                trailer += "\n" + self.formatStack(record.stack_info)
+            return trailer
+        exc_hash = stack_hash = None
         if record.exc_info:
-            base += "\n" + self.formatException(record.exc_info)
+            exc_hash = data["exc_hash"] = exception_fingerprint(record.exc_info)
+            exc_type, exc, _ = record.exc_info
+            data["exc_type"] = exc_type.__qualname__ if exc_type is not None else None
+            data["exc_msg"] = str(exc) if exc is not None else None
         if record.stack_info:
-            base += "\n" + self.formatStack(record.stack_info)
-        return base
+            stack_hash = data["stack_hash"] = stack_fingerprint(record.stack_info)
+        # (token of the cache, render the exception, render the stack), the token keeps the record picklable
+        decided = record.__dict__.get(_TRACES_ATTR)
+        if decided is None or decided[0] != tracebacks.token:
+            decided = record.__dict__[_TRACES_ATTR] = (
+                tracebacks.token,
+                exc_hash is not None and tracebacks.should_render(exc_hash, record.created),
+                stack_hash is not None and tracebacks.should_render(stack_hash, record.created),
+            )
+        if decided[1]:
+            trailer += "\n" + self.formatException(record.exc_info)
+        if decided[2]:
+            trailer += "\n" + self.formatStack(record.stack_info)  # type: ignore[arg-type]
+        return trailer
 
-    def add_custom_formatter(self, condition: CUSTOM_FORMATTER_PREDICATE, formatter: CUSTOM_FORMATTER_FUNC):
+    def format(self, record: logging.LogRecord) -> str:
+        data = self._record_data(record)
+        trailer = self._trailer(record, data) if record.exc_info or record.stack_info else ""
+        exclude_keys = self._exclude_keys
+        keep_none = not self.discard_none
+        root_excluded = self._root_excluded if self._path_rules.exclude else None
+        kv_to_logfmt = self.kv_to_logfmt
+        # Same filtering as _fields, inlined to avoid a generator frame per record
+        base = " ".join(
+            [
+                kv_to_logfmt(key, value)
+                for key, value in data.items()
+                if (value is not None or keep_none)
+                and key not in exclude_keys
+                and not (root_excluded and root_excluded(key))
+            ]
+        )
+        return base + trailer
+
+    def format_into(self, record: logging.LogRecord, buffer: bytearray):
+        """Appends `format(record)` encoded as UTF-8 to `buffer`, without a trailing newline.
+
+        The line is written piece by piece from cached encoded key prefixes and ANSI codes, so no intermediate line
+        string is built."""
+        if self._custom_rendering():
+            buffer += self.format(record).encode()
+            return
+        self._render_into(record, self._record_data(record), buffer)
+
+    def _custom_rendering(self) -> bool:
+        """Whether a subclass changed the rendering, so lines must go through its `format`."""
+        return (
+            type(self).format is not LogfmtFormatter.format
+            or type(self).kv_to_logfmt is not LogfmtFormatter.kv_to_logfmt
+        )
+
+    def _render_into(self, record: logging.LogRecord, data: dict[str, Any], buffer: bytearray):
+        """The second half of `format_into`: appends the line of `record`, whose fields `_record_data` returned.
+
+        If rendering fails (e.g. a lone surrogate can't be encoded), the part of the line already appended is removed,
+        so the next record isn't glued onto it in a shared buffer."""
+        key_plan = self._key_plan_bytes
+        render_value = self._render_value
+        first = True
+        trailer = self._trailer(record, data) if record.exc_info or record.stack_info else ""
+        start = len(buffer)
+        try:
+            for key, value in self._fields(data):
+                if first:
+                    first = False
+                else:
+                    buffer += b" "
+                if key is _BOUND_KEY:
+                    buffer += value.encode()
+                    continue
+                head, tail, quoted_head, quoted_tail = key_plan(key)
+                value, quoted = render_value(value, key)
+                if quoted:
+                    buffer += quoted_head
+                    buffer += value.encode()
+                    buffer += quoted_tail
+                else:
+                    buffer += head
+                    buffer += value.encode()
+                    buffer += tail
+            if trailer:
+                buffer += trailer.encode()
+        except BaseException:
+            del buffer[start:]
+            raise
+
+    def format_bytes(self, record: logging.LogRecord) -> bytes:
+        """`format(record)` encoded as UTF-8."""
+        buffer = bytearray()
+        self.format_into(record, buffer)
+        return bytes(buffer)
+
+    @overload
+    def format_many(
+        self,
+        records: Iterable[logging.LogRecord],
+        *,
+        join: Literal[True] = True,
+        on_error: Callable[[logging.LogRecord], Any] | None = None,
+    ) -> str: ...
+
+    @overload
+    def format_many(
+        self,
+        records: Iterable[logging.LogRecord],
+        *,
+        join: Literal[False],
+        on_error: Callable[[logging.LogRecord], Any] | None = None,
+    ) -> list[str]: ...
+
+    def format_many(
+        self,
+        records: Iterable[logging.LogRecord],
+        *,
+        join: bool = True,
+        on_error: Callable[[logging.LogRecord], Any] | None = None,
+    ) -> str | list[str]:
+        """Formats a batch of records, e.g. everything drained from a queue at once.
+
+        Returns the lines joined with newlines (without a trailing one), or the list of lines if `join` is False. The
+        lookups `format` does per record are done once for the batch. If `on_error` is given, a record that fails to
+        format is passed to it (from within the `except` block, like `Handler.handleError`) and left out, otherwise
+        the exception propagates."""
+        if self._custom_rendering() or self._instrument:
+            format_record = self.format
+        else:
+            record_data = self._record_data
+            record_trailer = self._trailer
+            exclude_keys = self._exclude_keys
+            keep_none = not self.discard_none
+            root_excluded = self._root_excluded if self._path_rules.exclude else None
+            kv_to_logfmt = self.kv_to_logfmt
+
+            def format_record(record: logging.LogRecord) -> str:
+                data = record_data(record)
+                trailer = record_trailer(record, data) if record.exc_info or record.stack_info else ""
+                base = " ".join(
+                    [
+                        kv_to_logfmt(key, value)
+                        for key, value in data.items()
+                        if (value is not None or keep_none)
+                        and key not in exclude_keys
+                        and not (root_excluded and root_excluded(key))
+                    ]
+                )
+                return base + trailer
+
+        lines = []
+        for record in records:
+            try:
+                lines.append(format_record(record))
+            except RecursionError:
+                raise
+            except Exception:
+                if on_error is None:
+                    raise
+                on_error(record)
+        return "\n".join(lines) if join else lines
+
+    def add_custom_formatter(
+        self, condition: CUSTOM_FORMATTER_PREDICATE, formatter: CUSTOM_FORMATTER_FUNC, *, cache: bool = True
+    ):
+        """Registers `formatter` for values matching `condition`.
+
+        Conditions are resolved once per value type and cached. Pass `cache=False` for predicates whose result depends
+        on the value itself rather than only on its type."""
         self.custom_formatters[condition] = formatter
+        if cache:
+            self._uncached_conditions.discard(condition)
+        else:
+            self._uncached_conditions.add(condition)
+        self._dispatch_cache.clear()
 
-    def custom_formatter(self, condition: CUSTOM_FORMATTER_PREDICATE):
+    def custom_formatter(self, condition: CUSTOM_FORMATTER_PREDICATE, *, cache: bool = True):
         """Decorator form of add_custom_formatter"""
 
         def decorator(func: CUSTOM_FORMATTER_FUNC) -> CUSTOM_FORMATTER_FUNC:
-            self.add_custom_formatter(condition, func)
+            self.add_custom_formatter(condition, func, cache=cache)
             return func
 
         return decorator
 
     def remove_custom_formatter(self, condition: CUSTOM_FORMATTER_PREDICATE):
         del self.custom_formatters[condition]
+        self._uncached_conditions.discard(condition)
+        self._dispatch_cache.clear()
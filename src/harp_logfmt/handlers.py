@@ -0,0 +1,951 @@
+import atexit
+import collections
+import logging
+import logging.handlers
+import operator
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from collections.abc import Callable, Hashable, Iterable, Mapping
+from typing import Any, BinaryIO, Literal, TextIO
+
+from . import compressed
+from .capture import CaptureEncoder
+from .context import _record_bound, _stash_bound
+from .formatter import _BOUND_KEY, LogfmtFormatter, _PreRendered
+from .parser import parse_line
+
+OVERFLOW_POLICY = Literal["block", "drop_newest", "drop_oldest", "drop_below_level"]
+# Characters that can't be part of a shard's file name
+_UNSAFE_SHARD_CHARS = re.compile(r"[^\w.@+-]")
+_SHARD_FLAGS = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_CLOEXEC", 0)
+
+
+def format_batch(handler: logging.Handler, records: list[logging.LogRecord]) -> list[str]:
+    """Formats `records` with `handler`'s formatter into lines, using `format_many` when possible.
+
+    A record that fails to format is reported with `handler.handleError` and left out, the others are still
+    returned."""
+    formatter = handler.formatter
+    if isinstance(formatter, LogfmtFormatter):
+        return formatter.format_many(records, join=False, on_error=handler.handleError)
+    lines = []
+    for record in records:
+        try:
+            lines.append(handler.format(record))
+        except RecursionError:
+            raise
+        except Exception:
+            handler.handleError(record)
+    return lines
+
+
+class BatchStreamHandler(logging.StreamHandler):
+    """A `StreamHandler` that buffers records and writes each batch with a single `write` call.
+
+    The buffer is flushed when it holds `capacity` records, when a record of at least `flush_level` arrives, when
+    `flush_interval` seconds have passed since the last flush (checked as records arrive), and on `flush()`/`close()`.
+    Batches are formatted with `LogfmtFormatter.format_many` when the handler's formatter is a `LogfmtFormatter`."""
+
+    def __init__(
+        self,
+        stream: TextIO | None = None,
+        capacity: int = 1024,
+        flush_level: int = logging.ERROR,
+        flush_interval: float | None = None,
+    ):
+        super().__init__(stream)
+        self.capacity = capacity
+        self.flush_level = flush_level
+        self.flush_interval = flush_interval
+        self.buffer: list[logging.LogRecord] = []
+        self._last_flush = time.monotonic()
+
+    def emit(self, record: logging.LogRecord):
+        _stash_bound(record)  # formatted on flush, maybe in another context
+        self.buffer.append(record)
+        if (
+            len(self.buffer) >= self.capacity
+            or record.levelno >= self.flush_level
+            or (self.flush_interval is not None and time.monotonic() - self._last_flush >= self.flush_interval)
+        ):
+            self.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.buffer:
+                records, self.buffer = self.buffer, []
+                lines = format_batch(self, records)
+                try:
+                    if lines:
+                        self.stream.write("\n".join(lines) + self.terminator)
+                except RecursionError:
+                    raise
+                except Exception:
+                    self.handleError(records[-1])
+            self._last_flush = time.monotonic()
+            super().flush()
+        finally:
+            self.release()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            super().close()
+
+
+class BackgroundStreamHandler(logging.Handler):
+    """A handler that only enqueues records on the calling thread and formats and writes them on a background thread.
+
+    The queue holds at most `queue_size` records. When it is full, `overflow` decides what happens:
+    - "block": wait for space, for at most `block_timeout` seconds if given, then drop the record
+    - "drop_newest": drop the incoming record
+    - "drop_oldest": drop the oldest queued record to make room
+    - "drop_below_level": drop incoming records below `drop_level`, block (like "block") for the others
+
+    Dropped records are counted in `dropped` and `dropped_by_level`. The writer drains up to `batch_size` records at a
+    time and writes each batch with a single `write` call. Records are formatted on the writer thread, so mutable
+    `args`/`data` are rendered as they are at that point. Queued records are written at interpreter exit."""
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        stream: TextIO | None = None,
+        queue_size: int = 10000,
+        overflow: OVERFLOW_POLICY = "block",
+        drop_level: int = logging.WARNING,
+        block_timeout: float | None = None,
+        batch_size: int = 1024,
+        flush_timeout: float | None = 5.0,
+    ):
+        if overflow not in ("block", "drop_newest", "drop_oldest", "drop_below_level"):
+            raise ValueError(f"Unknown overflow policy {overflow!r}.")
+        super().__init__()
+        self.stream: TextIO = stream if stream is not None else sys.stderr
+        self.terminator = "\n"
+        self.queue: queue.Queue = queue.Queue(queue_size)
+        self.overflow = overflow
+        self.drop_level = drop_level
+        self.block_timeout = block_timeout
+        self.batch_size = batch_size
+        self.flush_timeout = flush_timeout
+        self.dropped = 0
+        self.dropped_by_level: collections.Counter[int] = collections.Counter()
+        self._drop_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="BackgroundStreamHandler", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _count_drop(self, record: logging.LogRecord):
+        with self._drop_lock:
+            self.dropped += 1
+            self.dropped_by_level[record.levelno] += 1
+
+    def emit(self, record: logging.LogRecord):
+        if self._closed:
+            self._count_drop(record)
+            return
+        _stash_bound(record)  # formatted on the writer thread
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        overflow = self.overflow
+        if overflow == "drop_newest" or (overflow == "drop_below_level" and record.levelno < self.drop_level):
+            self._count_drop(record)
+        elif overflow == "drop_oldest":
+            while True:
+                try:
+                    oldest = self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+                else:
+                    self.queue.task_done()
+                    if oldest is self._STOP:
+                        # Closed concurrently, keep the writer's stop marker and give up on this record
+                        self.queue.put(oldest)
+                        self._count_drop(record)
+                        return
+                    self._count_drop(oldest)
+                try:
+                    self.queue.put_nowait(record)
+                    return
+                except queue.Full:
+                    continue
+        else:
+            try:
+                self.queue.put(record, timeout=self.block_timeout)
+            except queue.Full:
+                self._count_drop(record)
+
+    def _write(self, records: list[logging.LogRecord]):
+        # A record that fails to format is reported on its own, the rest of the batch is still written
+        lines = format_batch(self, records)
+        if not lines:
+            return
+        try:
+            self.stream.write("\n".join(lines) + self.terminator)
+            self.stream.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(records[-1])
+
+    def _run(self):
+        get, get_nowait, task_done = self.queue.get, self.queue.get_nowait, self.queue.task_done
+        while True:
+            batch = [get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(get_nowait())
+            except queue.Empty:
+                pass
+            stop = False
+            if any(item is self._STOP for item in batch):
+                stop = True
+                batch = [item for item in batch if item is not self._STOP]
+            if batch:
+                self._write(batch)
+            for _ in range(len(batch) + stop):
+                task_done()
+            if stop:
+                return
+
+    def flush(self):
+        """Waits (up to `flush_timeout` seconds) until every queued record has been written."""
+        deadline = None if self.flush_timeout is None else time.monotonic() + self.flush_timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks and self._thread.is_alive():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self.queue.all_tasks_done.wait(remaining)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            atexit.unregister(self.close)
+            try:
+                self.queue.put(self._STOP, timeout=self.flush_timeout)
+            except queue.Full:
+                pass
+            self._thread.join(self.flush_timeout)
+        super().close()
+
+
+class RenderingQueueHandler(logging.handlers.QueueHandler):
+    """A `QueueHandler` that renders each record in the producing process and only enqueues the encoded line.
+
+    Meant for `multiprocessing` workers: nothing but `bytes` crosses the process boundary, so `data` payloads never
+    have to be picklable. Pair it with a `RenderedLineListener` reading the same queue in the writer process. Lines
+    from one process stay in order since each producer's queue feeder is FIFO."""
+
+    def __init__(self, queue: Any, encoding: str = "utf-8"):
+        super().__init__(queue)
+        self.encoding = encoding
+
+    def prepare(self, record: logging.LogRecord) -> bytes:  # type: ignore[override]
+        return (self.format(record) + "\n").encode(self.encoding)
+
+
+class RenderedLineListener:
+    """Writes the lines enqueued by `RenderingQueueHandler`s to a binary stream from a background thread.
+
+    Like `logging.handlers.QueueListener`, call `start()` and `stop()`. Every batch of up to `batch_size` lines that is
+    already waiting in the queue is written with a single `write` call."""
+
+    _sentinel = None
+
+    def __init__(self, queue: Any, stream: BinaryIO, batch_size: int = 1024):
+        self.queue = queue
+        self.stream = stream
+        self.batch_size = batch_size
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor, name="RenderedLineListener", daemon=True)
+        self._thread.start()
+
+    def _monitor(self):
+        get, get_nowait = self.queue.get, self.queue.get_nowait
+        while True:
+            line = get()
+            if line is self._sentinel:
+                return
+            batch = [line]
+            stop = False
+            try:
+                while len(batch) < self.batch_size:
+                    line = get_nowait()
+                    if line is self._sentinel:
+                        stop = True
+                        break
+                    batch.append(line)
+            except queue.Empty:
+                pass
+            self.stream.write(b"".join(batch))
+            self.stream.flush()
+            if stop:
+                return
+
+    def stop(self):
+        """Writes every line enqueued so far, then stops the listener thread."""
+        if self._thread is not None:
+            self.queue.put(self._sentinel)
+            self._thread.join()
+            self._thread = None
+
+
+def _write_all(fd: int, data: bytes | bytearray):
+    """Writes all of `data` to `fd`, repeating `os.write` on short writes."""
+    view = memoryview(data)
+    try:
+        while view:
+            view = view[os.write(fd, view) :]
+    finally:
+        view.release()
+
+
+class FileDescriptorHandler(logging.Handler):
+    """Renders records straight into a `bytearray` and writes them to a raw file descriptor (e.g. a pipe).
+
+    Records are rendered with `LogfmtFormatter.format_into`, so no intermediate `str` line is built or re-encoded.
+    The buffer is written with one `os.write` call (repeated only on short writes) when it reaches `buffer_size`
+    bytes, when a record of at least `flush_level` arrives, when `flush_interval` seconds have passed since the last
+    write (checked as records arrive), and on `flush()`/`close()`. The descriptor is closed on `close()` only if
+    `close_fd` is set."""
+
+    terminator = b"\n"
+
+    def __init__(
+        self,
+        fd: int,
+        buffer_size: int = 65536,
+        flush_level: int = logging.ERROR,
+        flush_interval: float | None = None,
+        close_fd: bool = False,
+    ):
+        super().__init__()
+        self.fd = fd
+        self.buffer_size = buffer_size
+        self.flush_level = flush_level
+        self.flush_interval = flush_interval
+        self.close_fd = close_fd
+        self.buffer = bytearray()
+        self._last_flush = time.monotonic()
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            formatter = self.formatter
+            if isinstance(formatter, LogfmtFormatter):
+                formatter.format_into(record, self.buffer)
+            else:
+                self.buffer += self.format(record).encode()
+            self.buffer += self.terminator
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+            return
+        if (
+            len(self.buffer) >= self.buffer_size
+            or record.levelno >= self.flush_level
+            or (self.flush_interval is not None and time.monotonic() - self._last_flush >= self.flush_interval)
+        ):
+            try:
+                self.flush()
+            except OSError:
+                self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.buffer and self.fd >= 0:
+                try:
+                    _write_all(self.fd, self.buffer)
+                finally:
+                    self.buffer.clear()
+            self._last_flush = time.monotonic()
+        finally:
+            self.release()
+
+    def close(self):
+        self.acquire()
+        try:
+            try:
+                self.flush()
+            finally:
+                if self.close_fd and self.fd >= 0:
+                    os.close(self.fd)
+                self.fd = -1
+        finally:
+            self.release()
+            super().close()
+
+
+class CaptureHandler(FileDescriptorHandler):
+    """A `FileDescriptorHandler` that writes the binary capture of records (see `harp_logfmt.capture`) instead of their
+    text, leaving the rendering to `python -m harp_logfmt render` or `capture.render`.
+
+    The formatter must be a `LogfmtFormatter`, its rendering options are ignored (they are the renderer's) and so are
+    subclasses' overrides of `format`. Every handler starts its output with an `X` frame, so captures of several
+    handlers (or runs) appended to the same file render as one stream."""
+
+    def __init__(
+        self,
+        fd: int,
+        buffer_size: int = 65536,
+        flush_level: int = logging.ERROR,
+        flush_interval: float | None = None,
+        close_fd: bool = False,
+        max_shapes: int = 65536,
+    ):
+        super().__init__(fd, buffer_size, flush_level, flush_interval, close_fd)
+        self.max_shapes = max_shapes
+        self._encoder: CaptureEncoder | None = None
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            formatter = self.formatter
+            if not isinstance(formatter, LogfmtFormatter):
+                raise TypeError("CaptureHandler requires a LogfmtFormatter.")
+            encoder = self._encoder
+            if encoder is None or encoder.formatter is not formatter:
+                encoder = self._encoder = CaptureEncoder(formatter, self.max_shapes)
+            encoder.encode_into(record, self.buffer)
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+            return
+        if (
+            len(self.buffer) >= self.buffer_size
+            or record.levelno >= self.flush_level
+            or (self.flush_interval is not None and time.monotonic() - self._last_flush >= self.flush_interval)
+        ):
+            try:
+                self.flush()
+            except OSError:
+                self.handleError(record)
+
+
+class _Shard:
+    """An open shard file of a `ShardedFileHandler`, and the lines waiting to be written to it."""
+
+    __slots__ = ("path", "fd", "size", "buffer")
+
+    def __init__(self, path: str, fd: int):
+        self.path = path
+        self.fd = fd
+        self.size = os.fstat(fd).st_size  # bytes written to the file so far
+        self.buffer = bytearray()
+
+
+class ShardedFileHandler(logging.Handler):
+    """Writes each record to one of many files, picked by the record's fields, e.g. one file per logger or tenant.
+
+    `shard_key` is a flattened key (`"name"`, `"data[tenant]"`, ...) or a function of the record's fields (keys as
+    rendered, values as strings, before `exclude_keys`, including the fields bound with `bind`), and the shard is its
+    value, or `default_shard` when missing.
+    Shard files are `directory/filename.format(shard=...)`, with characters other than letters, digits and `.@+-_`
+    in the shard replaced by "_". Records are rendered with `LogfmtFormatter.format_into` into a buffer per shard.
+
+    At most `max_open` shard files are kept open: opening another one writes out and closes the least recently used.
+    Buffers are written, one `os.write` per shard, when they hold `buffer_size` bytes together, when a record of at
+    least `flush_level` arrives, when `flush_interval` seconds have passed since the last write (checked as records
+    arrive and by a background thread), and on `flush()`/`close()`. With `max_bytes`, a shard file that a record would grow beyond it is rotated
+    first, like `RotatingFileHandler`: it is renamed to `<file>.1`, `<file>.1` to `<file>.2` and so on up to
+    `backup_count` (a file is never rotated for its first record, and with no backups it is truncated instead)."""
+
+    terminator = b"\n"
+
+    def __init__(
+        self,
+        directory: str,
+        shard_key: str | Callable[[dict[str, Any]], Any] = "name",
+        filename: str = "{shard}.log",
+        default_shard: str = "default",
+        max_open: int = 64,
+        buffer_size: int = 1 << 20,
+        flush_level: int = logging.ERROR,
+        flush_interval: float | None = 1.0,
+        max_bytes: int | None = None,
+        backup_count: int = 5,
+    ):
+        super().__init__()
+        self.directory = directory
+        self.shard_key = shard_key
+        self.filename = filename
+        self.default_shard = default_shard
+        self.max_open = max_open
+        self.buffer_size = buffer_size
+        self.flush_level = flush_level
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        # shard -> open shard file, least recently used first
+        self.shards: collections.OrderedDict[str, _Shard] = collections.OrderedDict()
+        self.buffered = 0  # bytes waiting in the shards' buffers
+        self.rotations = 0
+        self._last_flush = time.monotonic()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+        if flush_interval is not None:
+            self._thread = threading.Thread(target=self._run, name="ShardedFileHandler", daemon=True)
+            self._thread.start()
+
+    def shard_for(self, fields: dict[str, Any]) -> str:
+        shard_key = self.shard_key
+        shard = fields.get(shard_key) if isinstance(shard_key, str) else shard_key(fields)
+        if shard is None or shard == "":
+            return self.default_shard
+        shard = _UNSAFE_SHARD_CHARS.sub("_", str(shard))
+        return "_" if shard in (".", "..") else shard
+
+    @staticmethod
+    def _shard_fields(record: logging.LogRecord, fields: dict[str, Any]) -> dict[str, Any]:
+        """`fields` as the shard key sees them: with the bound fields one by one, where `_record_data` collected them
+        as one rendered fragment, and with the level word without its colors."""
+        shard_fields = fields
+        if _BOUND_KEY in fields and (bound := _record_bound(record)) is not None:
+            shard_fields = {key: value if isinstance(value, str) else str(value) for key, value in bound.fields.items()}
+            shard_fields.update(fields)  # the record's own fields win, as when they are rendered
+            del shard_fields[_BOUND_KEY]
+        if type(fields.get("level")) is _PreRendered:
+            if shard_fields is fields:
+                shard_fields = dict(fields)
+            shard_fields["level"] = LogfmtFormatter.level_words[record.levelno]
+        return shard_fields
+
+    def _open(self, shard: str) -> _Shard:
+        entry = self.shards.get(shard)
+        if entry is not None:
+            self.shards.move_to_end(shard)
+            return entry
+        if len(self.shards) >= self.max_open:
+            self._close_shard(next(iter(self.shards)))
+        path = os.path.join(self.directory, self.filename.format(shard=shard))
+        try:
+            fd = os.open(path, _SHARD_FLAGS, 0o644)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd = os.open(path, _SHARD_FLAGS, 0o644)
+        entry = self.shards[shard] = _Shard(path, fd)
+        return entry
+
+    def _write(self, entry: _Shard, end: int | None = None):
+        """Writes the first `end` bytes (by default all) of the shard's buffer to its file."""
+        if end is None:
+            end = len(entry.buffer)
+        if end:
+            try:
+                _write_all(entry.fd, entry.buffer if end == len(entry.buffer) else memoryview(entry.buffer)[:end])
+            finally:
+                del entry.buffer[:end]
+                self.buffered -= end
+            entry.size += end
+
+    def _close_shard(self, shard: str):
+        entry = self.shards.pop(shard)
+        try:
+            self._write(entry)
+        finally:
+            os.close(entry.fd)
+
+    def _rotate(self, entry: _Shard):
+        path = entry.path
+        os.close(entry.fd)
+        try:
+            if self.backup_count > 0:
+                for i in range(self.backup_count - 1, 0, -1):
+                    if os.path.exists(f"{path}.{i}"):
+                        os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+                os.replace(path, f"{path}.1")
+            else:
+                os.remove(path)
+            self.rotations += 1
+        finally:
+            # If renaming failed, this reopens the same file and keeps appending to it
+            entry.fd = os.open(path, _SHARD_FLAGS, 0o644)
+            entry.size = os.fstat(entry.fd).st_size
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            formatter = self.formatter
+            if isinstance(formatter, LogfmtFormatter) and not formatter._custom_rendering():
+                fields = formatter._record_data(record)
+                entry = self._open(self.shard_for(self._shard_fields(record, fields)))
+                start = len(entry.buffer)
+                formatter._render_into(record, fields, entry.buffer)
+            else:
+                line = self.format(record).encode()
+                entry = self._open(self.shard_for(parse_line(line)))
+                start = len(entry.buffer)
+                entry.buffer += line
+            entry.buffer += self.terminator
+            self.buffered += len(entry.buffer) - start
+            if (
+                self.max_bytes is not None
+                and entry.size + len(entry.buffer) > self.max_bytes
+                and entry.size + start > 0
+            ):
+                # Whatever was buffered before this record goes to the current file, the record to the next one
+                self._write(entry, start)
+                self._rotate(entry)
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+            return
+        if (
+            self.buffered >= self.buffer_size
+            or record.levelno >= self.flush_level
+            or (self.flush_interval is not None and time.monotonic() - self._last_flush >= self.flush_interval)
+        ):
+            try:
+                self.flush()
+            except OSError:
+                self.handleError(record)
+
+    def _run(self):
+        while (interval := self.flush_interval) is not None and not self._stopped.wait(interval):
+            self.acquire()
+            try:
+                if self.buffered and time.monotonic() - self._last_flush >= interval:
+                    self.flush()
+            except OSError:
+                self.handleError(logging.makeLogRecord({"msg": f"Writing {self.buffered} buffered bytes"}))
+            finally:
+                self.release()
+
+    def flush(self):
+        self.acquire()
+        try:
+            for entry in self.shards.values():
+                self._write(entry)
+            self._last_flush = time.monotonic()
+        finally:
+            self.release()
+
+    def close(self):
+        # Before taking the lock, which the flushing thread may be waiting for
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.acquire()
+        try:
+            while self.shards:
+                self._close_shard(next(iter(self.shards)))
+        finally:
+            self.release()
+            super().close()
+
+
+class BlockCompressedFileHandler(logging.Handler):
+    """Writes records to a file of independently gzip-compressed blocks, see `harp_logfmt.compressed`.
+
+    Records are rendered into the current block, which is sealed once it holds `block_size` uncompressed bytes or
+    `block_interval` seconds after its first record (checked as records arrive and by the writer thread), and on
+    `flush()`/`close()`. Sealed blocks are compressed and written with their index entry by a background thread, at
+    most `max_pending` of them wait for it before logging blocks. Each `flush()` seals a block, however small, so
+    call it sparingly. When the file already exists, it is appended to, after `compressed.recover` repaired it."""
+
+    terminator = b"\n"
+    _STOP = object()
+
+    def __init__(
+        self,
+        filename: str,
+        block_size: int = 1 << 20,
+        block_interval: float | None = 60.0,
+        compresslevel: int = 6,
+        max_pending: int = 4,
+        flush_timeout: float | None = 5.0,
+    ):
+        super().__init__()
+        self.filename = os.path.abspath(filename)
+        self.block_size = block_size
+        self.block_interval = block_interval
+        self.compresslevel = compresslevel
+        self.flush_timeout = flush_timeout
+        self.blocks_written = 0
+        self._offset = compressed.recover(self.filename)
+        self._file = open(self.filename, "ab")
+        self._index = open(compressed.index_path(self.filename), "a", encoding="utf-8")
+        self._new_block()
+        self.queue: queue.Queue = queue.Queue(max_pending)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="BlockCompressedFileHandler", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _new_block(self):
+        self.block = bytearray()
+        self._records = 0
+        self._first = self._last = 0.0
+        self._started = 0.0  # time.monotonic() at the block's first record
+
+    def emit(self, record: logging.LogRecord):
+        if self._closed:
+            return
+        try:
+            formatter = self.formatter
+            if isinstance(formatter, LogfmtFormatter):
+                formatter.format_into(record, self.block)
+            else:
+                self.block += self.format(record).encode()
+            self.block += self.terminator
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+            return
+        created = record.created
+        if self._records:
+            if created < self._first:
+                self._first = created
+            elif created > self._last:
+                self._last = created
+        else:
+            self._first = self._last = created
+            self._started = time.monotonic()
+        self._records += 1
+        if len(self.block) >= self.block_size or (
+            self.block_interval is not None and time.monotonic() - self._started >= self.block_interval
+        ):
+            self._seal()
+
+    def _seal(self):
+        """Hands the current block to the writer thread. Called with the handler's lock held."""
+        if self._records:
+            self.queue.put((self.block, self._records, self._first, self._last))
+            self._new_block()
+
+    def _seal_stale(self):
+        # Never wait for the lock or for room in the queue here: an emit() holding the lock may be waiting for this
+        # thread to make room
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            if (
+                self._records
+                and self.block_interval is not None
+                and time.monotonic() - self._started >= self.block_interval
+                and not self.queue.full()
+            ):
+                self._seal()
+        finally:
+            self.lock.release()
+
+    def _write(self, block: bytearray, records: int, first: float, last: float):
+        member = compressed.compress_block(block, self.compresslevel)
+        self._file.write(member)
+        self._file.flush()
+        self._index.write(
+            compressed.index_line(compressed.Block(self._offset, len(member), len(block), records, first, last))
+        )
+        self._index.flush()
+        self._offset += len(member)
+        self.blocks_written += 1
+
+    def _run(self):
+        get, task_done = self.queue.get, self.queue.task_done
+        while True:
+            try:
+                item = get(timeout=self.block_interval)
+            except queue.Empty:
+                self._seal_stale()
+                continue
+            try:
+                if item is self._STOP:
+                    return
+                self._write(*item)
+            except Exception:
+                self.handleError(logging.makeLogRecord({"msg": f"Writing a block of {item[1]} records"}))
+            finally:
+                task_done()
+
+    def flush(self):
+        """Seals the current block and waits (up to `flush_timeout` seconds) until every block has been written."""
+        self.acquire()
+        try:
+            if not self._closed:
+                self._seal()
+        finally:
+            self.release()
+        deadline = None if self.flush_timeout is None else time.monotonic() + self.flush_timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks and self._thread.is_alive():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self.queue.all_tasks_done.wait(remaining)
+
+    def close(self):
+        if not self._closed:
+            self.flush()
+            self._closed = True
+            atexit.unregister(self.close)
+            try:
+                self.queue.put(self._STOP, timeout=self.flush_timeout)
+            except queue.Full:
+                pass
+            self._thread.join(self.flush_timeout)
+            if not self._thread.is_alive():
+                self._file.close()
+                self._index.close()
+        super().close()
+
+
+class _Fingerprint:
+    """The dedup and sampling state of one fingerprint."""
+
+    __slots__ = ("start", "tokens", "updated", "suppressed", "first", "last", "record")
+
+    def __init__(self, now: float, tokens: float):
+        self.start = now  # when the current window started
+        self.tokens = tokens
+        self.updated = now  # when the token bucket was last refilled
+        self.suppressed = 0
+        self.first = 0.0
+        self.last = 0.0
+        self.record: logging.LogRecord | None = None  # the last suppressed record
+
+
+class DedupHandler(logging.Handler):
+    """Suppresses repeated records and passes the others on to the `target` handler.
+
+    Records are fingerprinted by the record attributes in `fields` (by default logger name, level, function and the
+    unformatted `record.msg` template, so no message is rendered) and the `data_keys` of a mapping `data`. The first
+    record of a fingerprint starts a `window` of that many seconds, during which further records with the same
+    fingerprint are suppressed unless they are sampled:
+    - with `rate`, each fingerprint has a token bucket refilled at `rate` records per second and holding at most
+      `burst` tokens, a record passes when it can take a token
+    - otherwise with `sample_rate`, a record passes with that probability
+
+    Once the window is over, the next record of that fingerprint starts a new one, and if records were suppressed, a
+    copy of the last of them is emitted first with `repeated`, `first` and `last` fields (how many were suppressed,
+    and when the first and last of them were logged). Summaries of every fingerprint are also emitted on `flush()`
+    and `close()`, and when a fingerprint is evicted: at most `max_fingerprints` are tracked, least recently seen
+    first out. Times are `LogRecord.created`, so the window follows the records' own clock."""
+
+    def __init__(
+        self,
+        target: logging.Handler,
+        window: float = 60.0,
+        fields: Iterable[str] = ("name", "levelno", "funcName", "msg"),
+        data_keys: Iterable[str] = (),
+        rate: float | None = None,
+        burst: int = 1,
+        sample_rate: float | None = None,
+        max_fingerprints: int = 10000,
+    ):
+        super().__init__()
+        self.target = target
+        self.window = window
+        self.fields = tuple(fields)
+        self.data_keys = tuple(data_keys)
+        self.rate = rate
+        self.burst = burst
+        self.sample_rate = sample_rate
+        self.max_fingerprints = max_fingerprints
+        self.fingerprints: collections.OrderedDict[Hashable, _Fingerprint] = collections.OrderedDict()
+        if len(self.fields) > 1:
+            self._get_fields = operator.attrgetter(*self.fields)
+        else:
+            # attrgetter only returns a tuple for several attributes
+            self._get_fields = lambda record: tuple(getattr(record, field) for field in self.fields)
+
+    def fingerprint(self, record: logging.LogRecord) -> Hashable:
+        key = self._get_fields(record)
+        if self.data_keys:
+            data = getattr(record, "data", None)
+            if isinstance(data, Mapping):
+                key += tuple(data.get(data_key) for data_key in self.data_keys)
+        try:
+            hash(key)
+        except TypeError:
+            key = repr(key)  # e.g. a dict record.msg
+        return key
+
+    def _render_time(self, created: float) -> str:
+        formatter = self.target.formatter
+        if isinstance(formatter, LogfmtFormatter):
+            return formatter._timestamp.render(created)
+        return logging.Formatter().formatTime(logging.makeLogRecord({"created": created}))
+
+    def _emit_summary(self, entry: _Fingerprint):
+        if entry.record is not None and entry.suppressed:
+            summary = logging.makeLogRecord(entry.record.__dict__)
+            summary.repeated = entry.suppressed
+            summary.first = self._render_time(entry.first)
+            summary.last = self._render_time(entry.last)
+            self.target.handle(summary)
+        entry.suppressed = 0
+        entry.record = None
+
+    def _sampled(self, entry: _Fingerprint, now: float) -> bool:
+        if self.rate is not None:
+            entry.tokens = min(self.burst, entry.tokens + (now - entry.updated) * self.rate)
+            entry.updated = now
+            if entry.tokens >= 1:
+                entry.tokens -= 1
+                return True
+            return False
+        return self.sample_rate is not None and random.random() < self.sample_rate
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            _stash_bound(record)  # also kept by the summary, which is emitted from elsewhere
+            key = self.fingerprint(record)
+            now = record.created
+            fingerprints = self.fingerprints
+            entry = fingerprints.get(key)
+            if entry is not None:
+                fingerprints.move_to_end(key)
+                if now - entry.start < self.window:
+                    if not self._sampled(entry, now):
+                        if not entry.suppressed:
+                            entry.first = now
+                        entry.suppressed += 1
+                        entry.last = now
+                        entry.record = record
+                        return
+                else:
+                    self._emit_summary(entry)
+                    entry.start = now
+            else:
+                fingerprints[key] = _Fingerprint(now, self.burst)
+                if len(fingerprints) > self.max_fingerprints:
+                    self._emit_summary(fingerprints.popitem(last=False)[1])
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+            return
+        self.target.handle(record)
+
+    def flush(self):
+        """Emits the summaries of the records suppressed so far, then flushes `target`."""
+        self.acquire()
+        try:
+            for entry in self.fingerprints.values():
+                self._emit_summary(entry)
+        finally:
+            self.release()
+        self.target.flush()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            super().close()
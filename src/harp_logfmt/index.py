@@ -0,0 +1,265 @@
+"""Sidecar indexes over files written by `LogfmtFormatter`, for key/value and time range queries without full scans.
+
+A file is split into blocks of about `block_size` bytes, each starting at a record. The index stores every block's
+byte range and time range (from the `time` key), and for each indexed key, the blocks each of its values occurs in.
+A query only scans, through an `mmap`, the blocks that can contain matching records.
+
+The index is saved as JSON next to the log file (`<file>.idx`) and can be updated incrementally as the file grows."""
+
+import datetime
+import json
+import mmap
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator
+
+from .parser import _RECORD_START_BYTES, parse_line
+
+INDEX_VERSION = 2
+DEFAULT_KEYS = ("level", "name", "function")
+# How much of the start of the file is checksummed to notice that it was replaced (e.g. rotated), at most what was
+# indexed
+_HEAD_SIZE = 4096
+# A block is (start offset, end offset, min time, max time), the times are None when no record had one
+BLOCK = tuple[int, int, float | None, float | None]
+
+
+def parse_time(value: str) -> float | None:
+    """Parses a `time` value (ISO 8601, or epoch seconds, milliseconds or nanoseconds) into epoch seconds."""
+    try:
+        number = float(value)
+    except ValueError:
+        try:
+            parsed = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            return None
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+        return parsed.timestamp()
+    # time_format="epoch_ms"/"epoch_ns" values are integers far beyond any plausible number of seconds
+    if number > 1e17:
+        return number / 1e9
+    if number > 1e11:
+        return number / 1e3
+    return number
+
+
+def _record_start(buffer: mmap.mmap, position: int, size: int) -> int:
+    """The offset of the first record starting at or after `position`."""
+    if position > 0:
+        position = buffer.find(b"\n", position - 1, size) + 1 or size
+    while position < size:
+        end = buffer.find(b"\n", position, size)
+        if end == -1:
+            end = size
+        if _RECORD_START_BYTES.match(buffer, position, end):
+            return position
+        position = end + 1
+    return size
+
+
+def _iter_records(buffer: mmap.mmap, start: int, end: int) -> Iterator[tuple[int, int, int]]:
+    """Yields (record start, first line end, record end) for every record in [start, end). Lines before the first
+    record (the tail of a record starting before `start`) are skipped."""
+    record = first_end = -1
+    position = start
+    while position < end:
+        line_end = buffer.find(b"\n", position, end)
+        if line_end == -1:
+            line_end = end
+        if _RECORD_START_BYTES.match(buffer, position, line_end):
+            if record != -1:
+                yield record, first_end, position
+            record, first_end = position, line_end
+        position = line_end + 1
+    if record != -1:
+        yield record, first_end, end
+
+
+def _index_range(
+    path: str, start: int, end: int, keys: tuple[str, ...], block_size: int
+) -> tuple[list[BLOCK], dict[str, dict[str, list[int]]]]:
+    """Indexes the records in [start, end) of `path`. Block ids in the postings are relative to the returned blocks.
+
+    A module level function, so that it can run in a process pool."""
+    blocks: list[BLOCK] = []
+    postings: dict[str, dict[str, list[int]]] = {key: {} for key in keys}
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        block_start = start
+        min_time = max_time = None
+        for record_start, first_end, _ in _iter_records(buffer, start, end):
+            if record_start - block_start >= block_size:
+                blocks.append((block_start, record_start, min_time, max_time))
+                block_start = record_start
+                min_time = max_time = None
+            block = len(blocks)
+            record = parse_line(buffer[record_start:first_end])
+            if (value := record.get("time")) is not None and (created := parse_time(value)) is not None:
+                if min_time is None or created < min_time:
+                    min_time = created
+                if max_time is None or created > max_time:
+                    max_time = created
+            for key in keys:
+                if (value := record.get(key)) is not None:
+                    values = postings[key].setdefault(value, [])
+                    if not values or values[-1] != block:
+                        values.append(block)
+        if block_start < end:
+            blocks.append((block_start, end, min_time, max_time))
+    return blocks, postings
+
+
+class LogIndex:
+    """The index of one log file, see the module docstring. Use `LogIndex.open` to load, build or update it."""
+
+    def __init__(self, path: str, keys: Iterable[str] = DEFAULT_KEYS, block_size: int = 1 << 20):
+        self.path = path
+        self.keys = tuple(keys)
+        self.block_size = block_size
+        self.size = 0  # bytes of `path` indexed so far, always ends after a newline
+        self.head = 0  # checksum of the first min(size, _HEAD_SIZE) bytes
+        self.blocks: list[BLOCK] = []
+        self.postings: dict[str, dict[str, list[int]]] = {key: {} for key in self.keys}
+        self.resets = 0  # how many times the file was found truncated or replaced and indexed from scratch
+
+    @property
+    def index_path(self) -> str:
+        return self.path + ".idx"
+
+    @classmethod
+    def open(
+        cls, path: str, keys: Iterable[str] = DEFAULT_KEYS, block_size: int = 1 << 20, jobs: int | None = None
+    ) -> "LogIndex":
+        """Loads the index of `path` and updates it with whatever was appended since. It is rebuilt when it is missing,
+        was built with other `keys` or `block_size`, or the file was replaced."""
+        index = cls(path, keys, block_size)
+        try:
+            with open(index.index_path) as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            saved = None
+        if (
+            saved is not None
+            and saved.get("version") == INDEX_VERSION
+            and tuple(saved["keys"]) == index.keys
+            and saved["block_size"] == block_size
+        ):
+            index.size = saved["size"]
+            index.head = saved["head"]
+            index.blocks = [tuple(block) for block in saved["blocks"]]  # type: ignore[misc]
+            index.postings = saved["postings"]
+        index.update(jobs)
+        return index
+
+    def save(self):
+        saved = {
+            "version": INDEX_VERSION,
+            "keys": self.keys,
+            "block_size": self.block_size,
+            "size": self.size,
+            "head": self.head,
+            "blocks": self.blocks,
+            "postings": self.postings,
+        }
+        temporary = self.index_path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(saved, file, separators=(",", ":"))
+        os.replace(temporary, self.index_path)
+
+    def _reset(self):
+        self.resets += 1
+        self.size = 0
+        self.head = 0
+        self.blocks = []
+        self.postings = {key: {} for key in self.keys}
+
+    def update(self, jobs: int | None = None) -> int:
+        """Indexes the records appended since the last update and saves the index if anything changed. Returns the
+        number of new blocks. With `jobs` > 1, large ranges are indexed by that many processes."""
+        with open(self.path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            # A file replaced by a larger one is noticed too, as long as what was indexed of it differs
+            head = zlib.crc32(file.read(min(self.size, _HEAD_SIZE)))
+        if size < self.size or head != self.head:
+            self._reset()  # truncated or replaced
+        if size == 0 or size == self.size:
+            return 0
+        with open(self.path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            # Only complete lines are indexed, a partial last line is picked up by the next update
+            end = buffer.rfind(b"\n", self.size, size) + 1
+            if end <= self.size:
+                return 0
+            head = zlib.crc32(buffer[: min(end, _HEAD_SIZE)])
+            ranges = [(self.size, end)]
+            if jobs is not None and jobs > 1 and end - self.size > 4 * self.block_size:
+                step = (end - self.size) // jobs
+                bounds = [self.size] + [_record_start(buffer, self.size + step * i, end) for i in range(1, jobs)]
+                bounds.append(end)
+                ranges = [(a, b) for a, b in zip(bounds, bounds[1:]) if a < b]
+        if len(ranges) > 1:
+            with ProcessPoolExecutor(len(ranges)) as pool:
+                results = list(
+                    pool.map(
+                        _index_range,
+                        *zip(*[(self.path, a, b, self.keys, self.block_size) for a, b in ranges]),
+                    )
+                )
+        else:
+            results = [_index_range(self.path, ranges[0][0], ranges[0][1], self.keys, self.block_size)]
+        added = 0
+        for blocks, postings in results:
+            offset = len(self.blocks)
+            self.blocks.extend(blocks)
+            added += len(blocks)
+            for key, values in postings.items():
+                indexed = self.postings.setdefault(key, {})
+                for value, ids in values.items():
+                    indexed.setdefault(value, []).extend(offset + block for block in ids)
+        self.size = end
+        self.head = head
+        self.save()
+        return added
+
+    def candidate_blocks(
+        self, terms: dict[str, str], since: float | None = None, until: float | None = None, first: int = 0
+    ) -> list[int]:
+        """The ids (from `first` on) of the blocks that may hold records matching every term and the time range."""
+        candidates: set[int] | None = None
+        for key, value in terms.items():
+            if key in self.postings:
+                ids = set(self.postings[key].get(value, ()))
+                candidates = ids if candidates is None else candidates & ids
+        ids = range(first, len(self.blocks)) if candidates is None else sorted(i for i in candidates if i >= first)
+        result = []
+        for i in ids:
+            _, _, min_time, max_time = self.blocks[i]
+            if min_time is not None and (
+                (until is not None and min_time > until) or (since is not None and max_time < since)
+            ):
+                continue
+            result.append(i)
+        return result
+
+    def query(
+        self, terms: dict[str, str], since: float | None = None, until: float | None = None, first: int = 0
+    ) -> Iterator[bytes]:
+        """Yields the text (with continuation lines, e.g. tracebacks) of every record whose flattened keys have the
+        values in `terms` and whose time is within [since, until], in file order, from block `first` on."""
+        blocks = self.candidate_blocks(terms, since, until, first)
+        if not blocks:
+            return
+        with open(self.path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            for block in blocks:
+                start, end, _, _ = self.blocks[block]
+                for record_start, first_end, record_end in _iter_records(buffer, start, end):
+                    record = parse_line(buffer[record_start:first_end])
+                    if any(record.get(key) != value for key, value in terms.items()):
+                        continue
+                    if since is not None or until is not None:
+                        created = parse_time(record.get("time", ""))
+                        if created is None or (since is not None and created < since):
+                            continue
+                        if until is not None and created > until:
+                            continue
+                    yield buffer[record_start:record_end]
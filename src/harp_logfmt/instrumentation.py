@@ -0,0 +1,249 @@
+"""Opt-in timings and counters for `LogfmtFormatter`, see `LogfmtFormatter.instrument`.
+
+Instrumentation works by shadowing the formatter's methods with timed wrappers on the instance, so a formatter that
+isn't instrumented runs exactly the same code as before."""
+
+import collections
+import functools
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable
+
+if TYPE_CHECKING:
+    from .formatter import LogfmtFormatter
+
+# "collect" is the part of gathering a record's fields that isn't one of the nested phases (level, extra attributes,
+# message interpolation) and "render" is everything in format() that isn't gathering fields or formatting exceptions
+PHASES = ("format", "timestamp", "collect", "expand", "extract", "render", "exception")
+# Upper bounds of the histogram buckets, in microseconds
+HISTOGRAM_BOUNDS_US = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, float("inf"))
+# The methods shadowed on an instrumented formatter
+_WRAPPED = (
+    "format",
+    "format_into",
+    "_record_data",
+    "_expand_root",
+    "_template_fields",
+    "_trailer",
+    "kv_to_logfmt",
+    "_render_value",
+    "_format_value",
+)
+
+_clock = time.perf_counter
+
+
+class _PhaseStats:
+    __slots__ = ("count", "total", "max", "histogram")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * len(HISTOGRAM_BOUNDS_US)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        us = seconds * 1e6
+        for i, bound in enumerate(HISTOGRAM_BOUNDS_US):
+            if us <= bound:
+                self.histogram[i] += 1
+                break
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "total_us": round(self.total * 1e6, 3),
+            "mean_us": round(self.total * 1e6 / self.count, 3) if self.count else 0.0,
+            "max_us": round(self.max * 1e6, 3),
+            "histogram_us": {
+                "inf" if bound == float("inf") else str(bound): count
+                for bound, count in zip(HISTOGRAM_BOUNDS_US, self.histogram)
+            },
+        }
+
+
+class _Frame:
+    """The timings of the record being formatted on the current thread."""
+
+    __slots__ = ("record_data", "timestamp", "expand", "extract", "exception", "keys")
+
+    def __init__(self):
+        self.record_data = self.timestamp = self.expand = self.extract = self.exception = 0.0
+        self.keys = 0
+
+
+class FormatterStats:
+    """Timings per phase of `format`, and counts of records, emitted keys, output bytes and custom formatter calls."""
+
+    def __init__(self, interval: float | None = None, logger: logging.Logger | None = None):
+        self.interval = interval
+        self.logger = logger or logging.getLogger("harp_logfmt.stats")
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.phases = {phase: _PhaseStats() for phase in PHASES}
+            self.records = 0
+            self.keys = 0
+            self.bytes = 0
+            self.formatter_hits: collections.Counter[str] = collections.Counter()
+            self.since = time.time()
+            self._last_report = time.monotonic()
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "since": self.since,
+                "records": self.records,
+                "keys": self.keys,
+                "bytes": self.bytes,
+                "phases": {phase: stats.snapshot() for phase, stats in self.phases.items()},
+                "formatter_hits": dict(self.formatter_hits),
+            }
+
+    def _commit(self, frame: _Frame, total: float, size: int):
+        phases = self.phases
+        with self._lock:
+            self.records += 1
+            self.keys += frame.keys
+            self.bytes += size
+            phases["format"].add(total)
+            phases["timestamp"].add(frame.timestamp)
+            phases["collect"].add(frame.record_data - frame.timestamp - frame.expand - frame.extract)
+            if frame.expand:
+                phases["expand"].add(frame.expand)
+            if frame.extract:
+                phases["extract"].add(frame.extract)
+            phases["render"].add(total - frame.record_data - frame.exception)
+            if frame.exception:
+                phases["exception"].add(frame.exception)
+            report = self.interval is not None and time.monotonic() - self._last_report >= self.interval
+            if report:
+                self._last_report = time.monotonic()
+        if report:
+            self.logger.info("Formatter stats", extra={"data": self.snapshot()})
+
+    def _frame(self) -> _Frame | None:
+        return getattr(self._local, "frame", None)
+
+    def _timed(self, formatter: "LogfmtFormatter", write: Callable[..., Any]):
+        """Wraps `format` and `format_into`: opens a frame for the record and commits it once the record is done."""
+
+        @functools.wraps(write)
+        def wrapper(record: logging.LogRecord, *args, **kwargs):
+            _ensure_proxies(formatter, self)
+            local = self._local
+            outer = getattr(local, "frame", None)
+            frame = local.frame = _Frame()
+            buffer = args[0] if args else kwargs.get("buffer")  # format_into's
+            before = len(buffer) if buffer is not None else 0
+            try:
+                start = _clock()
+                result = write(record, *args, **kwargs)
+                total = _clock() - start
+            finally:
+                local.frame = outer
+            self._commit(frame, total, len(result.encode()) if buffer is None else len(buffer) - before)
+            return result
+
+        return wrapper
+
+    def _phase(self, method: Callable[..., Any], phase: str):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            frame = self._frame()
+            if frame is None:
+                return method(*args, **kwargs)
+            start = _clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                setattr(frame, phase, getattr(frame, phase) + _clock() - start)
+
+        return wrapper
+
+    def _counted(self, method: Callable[..., Any]):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            frame = self._frame()
+            if frame is not None:
+                frame.keys += 1
+            return method(*args, **kwargs)
+
+        return wrapper
+
+    def _format_value_hits(self, formatter: "LogfmtFormatter", method: Callable[..., Any]):
+        @functools.wraps(method)
+        def wrapper(value: Any, *args, **kwargs):
+            if isinstance(value, str) or value is None:
+                return method(value, *args, **kwargs)
+            for condition, custom in formatter._resolve_formatters(value):
+                if condition is None or formatter._condition_matches(condition, value):
+                    with self._lock:
+                        self.formatter_hits[getattr(custom, "__qualname__", repr(custom))] += 1
+                    break
+            return method(value, *args, **kwargs)
+
+        return wrapper
+
+
+class _TimedTimestamp:
+    """Stands in for the formatter's `TimestampRenderer`, timing `render`."""
+
+    def __init__(self, wrapped: Any, stats: FormatterStats):
+        self.wrapped = wrapped
+        self.render = stats._phase(wrapped.render, "timestamp")
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.wrapped, name)
+
+
+class _TimedPattern:
+    """Stands in for the formatter's `msg_regex`, timing `search`."""
+
+    def __init__(self, wrapped: Any, stats: FormatterStats):
+        self.wrapped = wrapped
+        self.search = stats._phase(wrapped.search, "extract")
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.wrapped, name)
+
+
+def _ensure_proxies(formatter: "LogfmtFormatter", stats: FormatterStats):
+    # The timestamp and time zone setters and the msg_regex setter replace these, wrap the new ones
+    if type(formatter._timestamp) is not _TimedTimestamp:
+        formatter._timestamp = _TimedTimestamp(formatter._timestamp, stats)
+    if formatter._msg_regex is not None and type(formatter._msg_regex) is not _TimedPattern:
+        formatter._msg_regex = _TimedPattern(formatter._msg_regex, stats)
+
+
+def install(formatter: "LogfmtFormatter", stats: FormatterStats):
+    """Shadows the methods of `formatter` with wrappers recording into `stats`."""
+    uninstall(formatter)
+    formatter.format = stats._timed(formatter, formatter.format)
+    formatter.format_into = stats._timed(formatter, formatter.format_into)
+    formatter._record_data = stats._phase(formatter._record_data, "record_data")
+    formatter._expand_root = stats._phase(formatter._expand_root, "expand")
+    formatter._template_fields = stats._phase(formatter._template_fields, "extract")
+    formatter._trailer = stats._phase(formatter._trailer, "exception")
+    formatter.kv_to_logfmt = stats._counted(formatter.kv_to_logfmt)
+    formatter._render_value = stats._counted(formatter._render_value)
+    formatter._format_value = stats._format_value_hits(formatter, formatter._format_value)
+    _ensure_proxies(formatter, stats)
+
+
+def uninstall(formatter: "LogfmtFormatter"):
+    """Removes the wrappers `install` added."""
+    for name in _WRAPPED:
+        formatter.__dict__.pop(name, None)
+    if type(formatter._timestamp) is _TimedTimestamp:
+        formatter._timestamp = formatter._timestamp.wrapped
+    if type(formatter._msg_regex) is _TimedPattern:
+        formatter._msg_regex = formatter._msg_regex.wrapped
@@ -0,0 +1,173 @@
+"""Parser for the logfmt lines written by `LogfmtFormatter`."""
+
+import mmap
+import re
+from typing import IO, Any, Iterable, Iterator
+
+BUFFER = bytes | bytearray | mmap.mmap
+
+# Every sequence in ansicolors.ANSIColors is a SGR sequence
+_ANSI = re.compile(r"\x1b\[[0-9;]*m")
+_ANSI_BYTES = re.compile(rb"\x1b\[[0-9;]*m")
+_PAIR = re.compile(r'([^\s=]+)=("[^"\\]*(?:\\.[^"\\]*)*"|\S*)')
+_PAIR_BYTES = re.compile(rb'([^\s=]+)=("[^"\\]*(?:\\.[^"\\]*)*"|\S*)')
+# A line that starts a record, anything else (tracebacks, stack info) continues the previous record
+_RECORD_START = re.compile(r"[^\s=]+=")
+_RECORD_START_BYTES = re.compile(rb"[^\s=]+=")
+_ESCAPE = re.compile(r"\\(u[0-9a-fA-F]{4}|.)", re.DOTALL)
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r"}
+_KEY_SEGMENT = re.compile(r"\[([^\]]*)\]|\.([^.\[]*)")
+
+
+def _unescape(match: re.Match) -> str:
+    char = match.group(1)
+    if len(char) == 5:
+        return chr(int(char[1:], 16))
+    return _ESCAPES.get(char, char)
+
+
+def _unquote(value: str) -> str:
+    if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+        value = value[1:-1]
+        if "\\" in value:
+            return _ESCAPE.sub(_unescape, value)
+    return value
+
+
+def parse_line(line: str | bytes, *, nested: bool = False, strip_ansi: bool = True) -> dict[str, Any]:
+    """Parses one logfmt line into a {key: value} dict. If `nested`, flattened keys are rebuilt with `unflatten`."""
+    if isinstance(line, (bytes, bytearray)):
+        line = line.decode("utf-8", "replace")
+    if strip_ansi and "\x1b" in line:
+        line = _ANSI.sub("", line)
+    record = {key: _unquote(value) for key, value in _PAIR.findall(line)}
+    return unflatten(record) if nested else record
+
+
+def split_key(key: str) -> list[str]:
+    """Splits a flattened key into its path, e.g. `data[a][0].b` -> `["data", "a", "0", "b"]`."""
+    start = key.find("[")
+    dot = key.find(".")
+    if dot != -1 and (start == -1 or dot < start):
+        start = dot
+    if start <= 0:
+        return [key]
+    path = [key[:start]]
+    position = start
+    for match in _KEY_SEGMENT.finditer(key, start):
+        if match.start() != position:
+            # Not something _format_value produces, keep the remainder as a single segment
+            path.append(key[position:])
+            return path
+        item, attr = match.groups()
+        path.append(item if item is not None else attr)
+        position = match.end()
+    if position != len(key):
+        path.append(key[position:])
+    return path
+
+
+def _listify(value: Any) -> Any:
+    if not isinstance(value, dict):
+        return value
+    for key, item in value.items():
+        value[key] = _listify(item)
+    if value and all(key == str(i) for i, key in enumerate(value)):
+        return list(value.values())
+    return value
+
+
+def unflatten(record: dict[str, str]) -> dict[str, Any]:
+    """Rebuilds the nesting that `_format_value` flattened. Both `[key]` and `.attr` segments become dicts, and dicts
+    whose keys are exactly "0", "1", ... become lists."""
+    result: dict[str, Any] = {}
+    for key, value in record.items():
+        path = split_key(key)
+        node = result
+        for segment in path[:-1]:
+            child = node.get(segment)
+            if not isinstance(child, dict):
+                child = node[segment] = {}
+            node = child
+        node[path[-1]] = value
+    return {key: _listify(value) for key, value in result.items()}
+
+
+def _finish(record: dict[str, Any], continuation: list[str], continuation_key: str | None, nested: bool):
+    if continuation_key is not None and continuation:
+        record[continuation_key] = "\n".join(continuation)
+    return unflatten(record) if nested else record
+
+
+def iter_parse(
+    lines: IO[str] | IO[bytes] | Iterable[str] | Iterable[bytes],
+    *,
+    nested: bool = False,
+    strip_ansi: bool = True,
+    continuation_key: str | None = None,
+) -> Iterator[dict[str, Any]]:
+    """Lazily parses records from a file object (text or binary) or any iterable of lines.
+
+    Lines that do not start with `key=` (the traceback and stack info `format` appends) belong to the previous record.
+    They are dropped unless `continuation_key` is given, in which case they are joined under that key."""
+    record: dict[str, Any] | None = None
+    continuation: list[str] = []
+    for line in lines:
+        if isinstance(line, (bytes, bytearray)):
+            line = line.decode("utf-8", "replace")
+        line = line.rstrip("\r\n")
+        if strip_ansi and "\x1b" in line:
+            line = _ANSI.sub("", line)
+        if not _RECORD_START.match(line):
+            if record is not None and continuation_key is not None:
+                continuation.append(line)
+            continue
+        if record is not None:
+            yield _finish(record, continuation, continuation_key, nested)
+            continuation = []
+        record = {key: _unquote(value) for key, value in _PAIR.findall(line)}
+    if record is not None:
+        yield _finish(record, continuation, continuation_key, nested)
+
+
+def iter_parse_buffer(
+    buffer: BUFFER,
+    *,
+    nested: bool = False,
+    strip_ansi: bool = True,
+    continuation_key: str | None = None,
+    encoding: str = "utf-8",
+) -> Iterator[dict[str, Any]]:
+    """Like `iter_parse`, but scans a bytes-like object (e.g. an `mmap` of a multi-GB file) in place.
+
+    Lines are never copied out of `buffer`, only the matched keys and values are, except for lines containing ANSI
+    sequences, which are copied once to strip them."""
+    record: dict[str, Any] | None = None
+    continuation: list[str] = []
+    position = 0
+    size = len(buffer)
+    find = buffer.find
+    while position < size:
+        end = find(b"\n", position)
+        if end == -1:
+            end = size
+        line, start, stop = buffer, position, end
+        position = end + 1
+        if stop > start and buffer[stop - 1] == 13:
+            stop -= 1
+        if strip_ansi and find(b"\x1b", start, stop) != -1:
+            line = _ANSI_BYTES.sub(b"", buffer[start:stop])
+            start, stop = 0, len(line)
+        if not _RECORD_START_BYTES.match(line, start, stop):
+            if record is not None and continuation_key is not None:
+                continuation.append(bytes(line[start:stop]).decode(encoding, "replace"))
+            continue
+        if record is not None:
+            yield _finish(record, continuation, continuation_key, nested)
+            continuation = []
+        record = {
+            key.decode(encoding, "replace"): _unquote(value.decode(encoding, "replace"))
+            for key, value in _PAIR_BYTES.findall(line, start, stop)
+        }
+    if record is not None:
+        yield _finish(record, continuation, continuation_key, nested)
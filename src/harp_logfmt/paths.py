@@ -0,0 +1,86 @@
+import fnmatch
+import re
+from typing import Callable, Iterable
+
+from .parser import split_key
+
+_GLOB_CHARS = re.compile(r"[*?\[]")
+# Wildcards right after a closing bracket extend that segment, e.g. the `*` of `data[secrets]*`
+_TRAILING_GLOB = re.compile(r"\]([^.\[\]]*[*?][^.\[\]]*)")
+
+
+class PathNode:
+    """One segment of a compiled path rule. Literal children are looked up directly, glob children are matched."""
+
+    __slots__ = ("children", "globs", "exclude", "include", "has_include")
+
+    def __init__(self):
+        self.children: dict[str, PathNode] = {}
+        self.globs: list[tuple[str, Callable[[str], re.Match | None], PathNode]] = []
+        self.exclude = False  # this path and everything below it is excluded
+        self.include = False  # this path and everything below it is included
+        self.has_include = False  # an include rule ends at or below this node
+
+
+class PathRules:
+    """Exclusion and inclusion rules over flattened keys, compiled once into a trie.
+
+    A rule is a flattened key such as `data.payload`, `data[secrets]` or `message[*][raw]`. `[key]` and `.key` are
+    interchangeable and a rule covers the key itself and everything expanded below it. Segments may use `fnmatch`
+    wildcards, so `*` matches any single segment and `secret*` any segment starting with "secret". Wildcards right
+    after a closing bracket belong to that segment: `data[secrets]*` is `data[secrets*]`, so it covers
+    `data[secrets]` and `data[secrets2]`.
+
+    Exclusion wins over inclusion. Include rules only restrict the roots they start with: with `data[user]` included,
+    nothing else under `data` is emitted, while `message` and every other key are left alone."""
+
+    def __init__(self, exclude: Iterable[str] = (), include: Iterable[str] = ()):
+        self.root = PathNode()
+        self.exclude = tuple(exclude)
+        self.include = tuple(include)
+        for path in self.exclude:
+            self._add(path)[-1].exclude = True
+        for path in self.include:
+            nodes = self._add(path)
+            nodes[-1].include = True
+            for node in nodes:
+                node.has_include = True
+
+    def __bool__(self) -> bool:
+        return bool(self.exclude or self.include)
+
+    def _add(self, path: str) -> list[PathNode]:
+        nodes = []
+        node = self.root
+        for segment in split_key(_TRAILING_GLOB.sub(r"\1]", path)):
+            if _GLOB_CHARS.search(segment):
+                for pattern, _, child in node.globs:
+                    if pattern == segment:
+                        break
+                else:
+                    child = PathNode()
+                    node.globs.append((segment, re.compile(fnmatch.translate(segment)).match, child))
+            else:
+                child = node.children.get(segment)
+                if child is None:
+                    child = node.children[segment] = PathNode()
+            node = child
+            nodes.append(node)
+        return nodes
+
+    @staticmethod
+    def step(nodes: tuple[PathNode, ...], key: str) -> tuple[PathNode, ...]:
+        """Returns the nodes matching the child `key` of the keys matched by `nodes`."""
+        children = []
+        for node in nodes:
+            child = node.children.get(key)
+            if child is not None:
+                children.append(child)
+            for _, match, child in node.globs:
+                if match(key):
+                    children.append(child)
+        return tuple(children)
+
+    def root_excluded(self, key: str) -> bool:
+        """Whether a top-level key is excluded."""
+        return any(node.exclude for node in self.step((self.root,), key))
@@ -0,0 +1,74 @@
+import re
+from collections.abc import Mapping
+from typing import Any, Iterable
+
+# Matches every "%" of a printf-style template. Anything but a valid conversion in the last group means the message
+# is not a template `str % args` could render, and `*` widths consume arguments, so neither is supported
+_PLACEHOLDER = re.compile(
+    r"%(?:\((?P<name>[^)]*)\))?(?P<spec>[#0 +\-]*\d*(?:\.\d+)?[hlL]?)(?P<conversion>.?)", re.DOTALL
+)
+_CONVERSIONS = frozenset("diouxXeEfFgGcrsa%")
+
+
+class MessageTemplate:
+    """A compiled `%`-style `record.msg` that maps `record.args` straight to fields.
+
+    `fields` holds one (field name, argument key or index, format spec) entry per placeholder. The spec is None for a
+    plain `%s`, which is rendered with `str()`, otherwise the argument is rendered with `spec % (argument,)` so the
+    field reads exactly like it would in the interpolated message."""
+
+    __slots__ = ("named", "fields")
+
+    def __init__(self, named: bool, fields: tuple[tuple[str, str | int, str | None], ...]):
+        self.named = named
+        self.fields = fields
+
+    def extract(self, args: Any) -> dict[str, str] | None:
+        """Returns the fields for `args`, or None when `args` don't fit the template (the message is then handled as if
+        there were no template)."""
+        if self.named:
+            if not isinstance(args, Mapping):
+                return None
+        elif not isinstance(args, tuple) or len(args) != len(self.fields):
+            return None
+        fields = {}
+        try:
+            for field, key, spec in self.fields:
+                value = args[key]
+                fields[field] = str(value) if spec is None else spec % (value,)
+        except (KeyError, TypeError, ValueError):
+            return None
+        return fields
+
+
+def compile_template(msg: str, names: Iterable[str] | None = None) -> MessageTemplate | None:
+    """Compiles `msg`, or returns None if it has no placeholders or isn't a template `LogRecord.getMessage` renders.
+
+    The fields are named by `names`, in placeholder order, when given, otherwise by the `%(name)s` placeholders
+    themselves. Positional placeholders without `names` can't be named, so such templates aren't compiled."""
+    placeholders = []
+    for match in _PLACEHOLDER.finditer(msg):
+        name, spec, conversion = match.groups()
+        if conversion not in _CONVERSIONS:
+            return None
+        if conversion == "%":
+            if name is not None or spec:
+                return None
+            continue
+        placeholders.append((name, None if not spec and conversion == "s" else f"%{spec}{conversion}"))
+    if not placeholders:
+        return None
+    named = placeholders[0][0] is not None
+    if any((name is not None) != named for name, _ in placeholders):
+        return None  # mixing named and positional placeholders is an error in `str % args`
+    if names is not None:
+        names = tuple(names)
+        if len(names) != len(placeholders):
+            raise ValueError(f"Template {msg!r} has {len(placeholders)} placeholders but {len(names)} field names.")
+    elif not named:
+        return None
+    fields = tuple(
+        (names[i] if names is not None else name, name if named else i, spec)
+        for i, (name, spec) in enumerate(placeholders)
+    )
+    return MessageTemplate(named, fields)
@@ -0,0 +1,91 @@
+import datetime
+import math
+import re
+from typing import Literal
+
+TIME_FORMAT = Literal["iso", "datefmt", "epoch_s", "epoch_ms", "epoch_ns"]
+
+_UTC = datetime.timezone.utc
+# Stands in for %f while the per-second part of a datefmt is rendered, then gets replaced by the microseconds
+_MICROSECOND_PLACEHOLDER = "\ue000"
+_STRFTIME_DIRECTIVE = re.compile(r"%(.)", re.DOTALL)
+
+
+def split_timestamp(created: float) -> tuple[int, int]:
+    """Splits a `time.time()` float into whole seconds and microseconds, rounding exactly like
+    `datetime.datetime.fromtimestamp` does."""
+    frac, seconds = math.modf(created)
+    us = round(frac * 1e6)
+    if us >= 1000000:
+        seconds += 1
+        us -= 1000000
+    elif us < 0:
+        seconds -= 1
+        us += 1000000
+    return int(seconds), us
+
+
+class TimestampRenderer:
+    """Renders `LogRecord.created` timestamps, caching everything that only changes once per second.
+
+    Modes:
+    - "iso": `datetime.isoformat("T")` in `timezone` (microseconds are omitted when they are zero, like isoformat)
+    - "datefmt": `datetime.strftime(datefmt)` in `timezone`, `%f` is supported
+    - "epoch_s", "epoch_ms", "epoch_ns": time since the epoch with microsecond precision
+    """
+
+    def __init__(self, mode: TIME_FORMAT = "iso", timezone: datetime.tzinfo | None = _UTC, datefmt: str | None = None):
+        if mode not in ("iso", "datefmt", "epoch_s", "epoch_ms", "epoch_ns"):
+            raise ValueError(f"Unknown time format {mode!r}.")
+        if mode == "datefmt" and not datefmt:
+            raise ValueError('time_format="datefmt" requires a datefmt.')
+        self.mode = mode
+        self.timezone = timezone
+        self.datefmt = datefmt
+        self._has_microseconds = False
+        if datefmt is not None:
+            replaced = _STRFTIME_DIRECTIVE.sub(
+                lambda match: _MICROSECOND_PLACEHOLDER if match.group(1) == "f" else match.group(0), datefmt
+            )
+            self._has_microseconds = replaced != datefmt
+            self._datefmt_seconds = replaced
+        # (second, head, tail) of the last rendered second. Swapped as a whole so concurrent renders stay consistent
+        self._last: tuple[int, str, str] | None = None
+
+    def _render_second(self, seconds: int) -> tuple[int, str, str]:
+        dt = datetime.datetime.fromtimestamp(seconds, tz=_UTC).astimezone(self.timezone)
+        if self.mode == "iso":
+            iso = dt.isoformat("T")
+            # "YYYY-MM-DDTHH:MM:SS" is always 19 characters, the rest is the UTC offset
+            last = (seconds, iso[:19], iso[19:])
+        else:
+            last = (seconds, dt.strftime(self._datefmt_seconds), "")
+        self._last = last
+        return last
+
+    def render(self, created: float) -> str:
+        return self._render(*split_timestamp(created))
+
+    def render_us(self, timestamp_us: int) -> str:
+        """Renders microseconds since the epoch, e.g. a timestamp captured with `split_timestamp`."""
+        return self._render(*divmod(timestamp_us, 1000000))
+
+    def _render(self, seconds: int, us: int) -> str:
+        mode = self.mode
+        if mode == "epoch_s":
+            return f"{seconds}.{us:06d}"
+        elif mode == "epoch_ms":
+            return str(seconds * 1000 + us // 1000)
+        elif mode == "epoch_ns":
+            return str(seconds * 1000000000 + us * 1000)
+        last = self._last
+        if last is None or last[0] != seconds:
+            last = self._render_second(seconds)
+        _, head, tail = last
+        if mode == "iso":
+            if us:
+                return f"{head}.{us:06d}{tail}"
+            return head + tail
+        if self._has_microseconds:
+            return head.replace(_MICROSECOND_PLACEHOLDER, f"{us:06d}")
+        return head
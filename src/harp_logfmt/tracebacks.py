@@ -0,0 +1,78 @@
+import collections
+import itertools
+import threading
+from types import TracebackType
+from typing import Optional
+
+EXC_INFO = tuple[Optional[type[BaseException]], Optional[BaseException], Optional[TracebackType]]
+
+
+# Tells caches apart for as long as the process runs, unlike id(), which a new cache may reuse
+_tokens = itertools.count()
+
+
+def _digest(text: str) -> str:
+    import hashlib  # only needed once there is an exception to fingerprint
+
+    # Not hash(), which is salted per process, so the same traceback gets the same fingerprint everywhere
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+def exception_fingerprint(exc_info: EXC_INFO) -> str:
+    """Hashes the exception types and code locations (file, function, line) of `exc_info` and of the exceptions it was
+    raised from or while handling. The messages are left out, so the fingerprint is the same for every occurrence of
+    "the same" error."""
+    exc_type, exc, tb = exc_info
+    parts = [exc_type.__qualname__ if exc_type is not None else "None"]
+    seen: set[int] = set()
+    while True:
+        while tb is not None:
+            code = tb.tb_frame.f_code
+            parts.append(f"{code.co_filename}:{code.co_name}:{tb.tb_lineno}")
+            tb = tb.tb_next
+        if exc is None or id(exc) in seen:
+            break
+        seen.add(id(exc))
+        exc = exc.__cause__ or (None if exc.__suppress_context__ else exc.__context__)
+        if exc is None:
+            break
+        parts.append(type(exc).__qualname__)
+        tb = exc.__traceback__
+    return _digest("\n".join(parts))
+
+
+def stack_fingerprint(stack_info: str) -> str:
+    return _digest(stack_info)
+
+
+class TracebackCache:
+    """Decides which tracebacks are rendered, given their fingerprints.
+
+    A fingerprint's trace is rendered the first time it is seen and again once `reemit_interval` seconds (if not None)
+    have passed since it was last rendered. At most `maxsize` fingerprints are remembered, least recently seen first
+    out, so a forgotten one is rendered again."""
+
+    def __init__(self, maxsize: int = 1024, reemit_interval: float | None = 300.0):
+        self.maxsize = maxsize
+        self.reemit_interval = reemit_interval
+        # fingerprint -> when its trace was last rendered
+        self._rendered: collections.OrderedDict[str, float] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.token = next(_tokens)
+
+    def should_render(self, fingerprint: str, now: float) -> bool:
+        with self._lock:
+            rendered = self._rendered
+            last = rendered.get(fingerprint)
+            if last is not None:
+                rendered.move_to_end(fingerprint)
+                if self.reemit_interval is None or now - last < self.reemit_interval:
+                    return False
+            rendered[fingerprint] = now
+            if len(rendered) > self.maxsize:
+                rendered.popitem(last=False)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._rendered.clear()
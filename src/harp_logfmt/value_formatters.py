@@ -1,30 +1,56 @@
-from multiprocessing.dummy import Namespace as MultiprocessingDummyNamespace
-from multiprocessing.managers import Namespace as MulltiprocessingManagersNamespace
-from typing import Any
+from typing import TYPE_CHECKING, Any, Callable
 from collections.abc import Mapping, Iterable
+import itertools
+import sys
 import types
-import dataclasses
-import argparse
 
+if TYPE_CHECKING:
+    from multiprocessing.dummy import Namespace as MultiprocessingDummyNamespace
+    from multiprocessing.managers import Namespace as MulltiprocessingManagersNamespace
+    import argparse
 
-def format_mapping(value: Mapping) -> tuple[dict[str, Any], bool]:
-    return {str(key): value for key, value in value.items()}, True
+# (module, name) of the namespace types besides SimpleNamespace. They are looked up in sys.modules instead of being
+# imported: a value can only be one of them if its module has already been imported by someone else
+_NAMESPACE_TYPES = (
+    ("argparse", "Namespace"),
+    ("multiprocessing.dummy", "Namespace"),
+    ("multiprocessing.managers", "Namespace"),
+)
 
 
-def format_iterable(value: Iterable) -> tuple[dict[str, Any], bool]:
-    return {str(i): item for i, item in enumerate(value)}, True
+def format_mapping(value: Mapping, limit: int | None = None) -> tuple[dict[str, Any], bool]:
+    return {str(key): value for key, value in itertools.islice(value.items(), limit)}, True
+
+
+def format_iterable(value: Iterable, limit: int | None = None) -> tuple[dict[str, Any], bool]:
+    return {str(i): item for i, item in itertools.islice(enumerate(value), limit)}, True
+
+
+def is_namespace(value: Any) -> bool:
+    if isinstance(value, types.SimpleNamespace):
+        return True
+    modules = sys.modules
+    for module, name in _NAMESPACE_TYPES:
+        namespace = getattr(modules.get(module), name, None)
+        if namespace is not None and isinstance(value, namespace):
+            return True
+    return False
 
 
 def format_namespace(
-    value: types.SimpleNamespace
-    | argparse.Namespace
-    | MultiprocessingDummyNamespace
-    | MulltiprocessingManagersNamespace,
+    value: "types.SimpleNamespace | argparse.Namespace | MultiprocessingDummyNamespace | MulltiprocessingManagersNamespace",
 ) -> tuple[dict[str, Any], bool]:
     return {str(key): value for key, value in value.__dict__.items()}, False
 
 
+def is_dataclass_instance(value: Any) -> bool:
+    # What dataclasses.is_dataclass checks, without importing dataclasses
+    return hasattr(type(value), "__dataclass_fields__") and not isinstance(value, type)
+
+
 def format_dataclass(value) -> tuple[dict[str, Any], bool]:
+    import dataclasses
+
     return {field.name: getattr(value, field.name) for field in dataclasses.fields(value)}, False
 
 
@@ -32,15 +58,14 @@ def format_namedtuple(value: tuple) -> tuple[dict[str, Any], bool]:
     return value._asdict(), False
 
 
+# Formatters that accept a `limit` keyword and then only produce that many items, so that huge containers are never
+# fully materialized when LogfmtFormatter.max_items is set
+limit_aware_formatters: set[Callable[..., tuple[dict[str, Any], bool]]] = {format_mapping, format_iterable}
+
 default_formatters = {
     Iterable: format_iterable,  # Goes to top because it is the most generic
     Mapping: format_mapping,
-    (
-        types.SimpleNamespace,
-        argparse.Namespace,
-        MultiprocessingDummyNamespace,
-        MulltiprocessingManagersNamespace,
-    ): format_namespace,
-    (lambda value: dataclasses.is_dataclass(value) and not isinstance(value, type)): format_dataclass,
+    is_namespace: format_namespace,
+    is_dataclass_instance: format_dataclass,
     (lambda value: isinstance(value, tuple) and hasattr(value, "_asdict")): format_namedtuple,
 }
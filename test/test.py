@@ -1,11 +1,14 @@
-from harp_logfmt import LogfmtFormatter, CUSTOM_FORMATTER_FUNC_RETURN
-from unittest import TestCase
+from harp_logfmt import LogfmtFormatter, CUSTOM_FORMATTER_FUNC_RETURN, bind, bound_fields, unbind
+from unittest import TestCase, mock
 from dataclasses import dataclass
 from typing import NamedTuple
 from harp_logfmt.ansicolors import ANSIColors
 from uuid import uuid4
+import asyncio
 import logging
 import io
+import datetime
+import re
 
 
 @dataclass(frozen=True)
@@ -309,3 +312,599 @@ class TestSimple(TestCase):
         self.assertIn("data=Hello,world!", value)
         self.assertIn("function=test_auto_space_quotes", value)
         self.assertIn("name=auto_space_quotes", value)
+
+
+class TestFormatterDispatchCache(TestCase):
+    def test_add_invalidates_cache(self):
+        formatter = LogfmtFormatter(colorize=False)
+        logger, stream = setup_logger(formatter, name="dispatch_cache_add")
+        logger.debug([1.5])
+        self.assertIn("message[0]=1.5", stream.getvalue())
+
+        @formatter.custom_formatter(float)
+        def float_formatter(value: float) -> CUSTOM_FORMATTER_FUNC_RETURN:
+            return {"integer": int(value)}, False
+
+        logger.debug([1.5])
+        self.assertIn("message[0].integer=1", stream.getvalue())
+
+    def test_remove_invalidates_cache(self):
+        formatter = LogfmtFormatter(colorize=False)
+        logger, stream = setup_logger(formatter, name="dispatch_cache_remove")
+        formatter.add_custom_formatter(float, lambda value: ({"integer": int(value)}, False))
+        logger.debug([1.5])
+        self.assertIn("message[0].integer=1", stream.getvalue())
+        formatter.remove_custom_formatter(float)
+        logger.debug([2.5])
+        self.assertIn("message[0]=2.5", stream.getvalue())
+
+    def test_uncached_predicate(self):
+        formatter = LogfmtFormatter(colorize=False)
+        logger, stream = setup_logger(formatter, name="dispatch_cache_uncached")
+
+        @formatter.custom_formatter(lambda value: isinstance(value, int) and value > 100, cache=False)
+        def big_int_formatter(value: int) -> CUSTOM_FORMATTER_FUNC_RETURN:
+            return {"hundreds": value // 100}, False
+
+        logger.debug([1, 250])
+        value = stream.getvalue()
+        self.assertIn("message[0]=1", value)
+        self.assertIn("message[1].hundreds=2", value)
+
+    def test_cache_is_per_type(self):
+        formatter = LogfmtFormatter(colorize=False)
+        logger, stream = setup_logger(formatter, name="dispatch_cache_per_type")
+        logger.debug({"a": SimpleDataclass(1, 2, 3), "b": SimpleNamedTuple(4, 5, 6), "c": (7,)})
+        value = stream.getvalue()
+        self.assertIn("message[a].a=1", value)
+        self.assertIn("message[b].a=4", value)
+        self.assertIn("message[c][0]=7", value)
+        self.assertIn(SimpleDataclass, formatter._dispatch_cache)
+        self.assertIn(SimpleNamedTuple, formatter._dispatch_cache)
+
+
+class TestKeyRenderPlan(TestCase):
+    def test_colorize_toggle_rebuilds_plan(self):
+        formatter = LogfmtFormatter(colorize=True)
+        logger, stream = setup_logger(formatter, name="key_plan_colorize")
+        logger.debug("Hello, world!")
+        self.assertIn(f"{ANSIColors.BOLD.BLACK}name={ANSIColors.RESET}", stream.getvalue())
+        formatter.colorize = False
+        logger.debug("Hello, world!")
+        self.assertIn('name=key_plan_colorize level=DEBUG message="Hello, world!"', stream.getvalue())
+
+    def test_highlight_keys_rebuilds_plan(self):
+        formatter = LogfmtFormatter(colorize=True)
+        logger, stream = setup_logger(formatter, name="key_plan_highlight")
+        logger.debug("Hello")
+        self.assertIn(f"{ANSIColors.BOLD.BLACK}message={ANSIColors.RESET}Hello\n", stream.getvalue())
+        formatter.highlight_keys = ()
+        logger.debug("Hello")
+        self.assertIn(
+            f"{ANSIColors.BOLD.BLACK}message={ANSIColors.RESET}{ANSIColors.REGULAR.BLACK}Hello{ANSIColors.RESET}\n",
+            stream.getvalue(),
+        )
+
+    def test_key_cache_is_bounded(self):
+        formatter = LogfmtFormatter(colorize=False, key_cache_size=8)
+        logger, stream = setup_logger(formatter, name="key_plan_bounded")
+        logger.debug({str(i): i for i in range(100)})
+        self.assertIn("message[99]=99", stream.getvalue())
+        self.assertLessEqual(formatter._key_plan.cache_info().currsize, 8)
+
+
+class TestTimestamps(TestCase):
+    def make_record(self, created: float) -> logging.LogRecord:
+        record = logging.LogRecord("timestamps", logging.INFO, __file__, 1, "Hello", None, None)
+        record.created = created
+        return record
+
+    def test_iso_matches_datetime(self):
+        timezone = datetime.timezone(datetime.timedelta(hours=-5))
+        formatter = LogfmtFormatter(colorize=False, timezone=timezone)
+        for created in (1700000000.0, 1700000000.123456, 1700000000.9999996, 1700000001.5):
+            expected = datetime.datetime.fromtimestamp(created, tz=datetime.timezone.utc).astimezone(timezone)
+            self.assertIn(f"time={expected.isoformat('T')} ", formatter.format(self.make_record(created)))
+
+    def test_timezone_change(self):
+        formatter = LogfmtFormatter(colorize=False)
+        self.assertIn("time=2023-11-14T22:13:20+00:00 ", formatter.format(self.make_record(1700000000.0)))
+        formatter.timezone = datetime.timezone(datetime.timedelta(hours=1))
+        self.assertIn("time=2023-11-14T23:13:20+01:00 ", formatter.format(self.make_record(1700000000.0)))
+
+    def test_explicit_datefmt(self):
+        formatter = LogfmtFormatter(colorize=False, datefmt="%Y-%m-%d %H:%M:%S.%f")
+        self.assertIn('time="2023-11-14 22:13:20.250000" ', formatter.format(self.make_record(1700000000.25)))
+
+    def test_epoch(self):
+        formatter = LogfmtFormatter(colorize=False, time_format="epoch_s")
+        self.assertIn("time=1700000000.250000 ", formatter.format(self.make_record(1700000000.25)))
+        formatter.time_format = "epoch_ms"
+        self.assertIn("time=1700000000250 ", formatter.format(self.make_record(1700000000.25)))
+        formatter.time_format = "epoch_ns"
+        self.assertIn("time=1700000000250000000 ", formatter.format(self.make_record(1700000000.25)))
+
+    def test_unknown_time_format(self):
+        with self.assertRaises(ValueError):
+            LogfmtFormatter(time_format="unix")  # type: ignore[arg-type]
+
+
+class TestExpansionLimits(TestCase):
+    def test_max_items(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False, max_items=3), name="max_items")
+        logger.debug("Hello", extra={"data": list(range(10000))})
+        value = stream.getvalue()
+        self.assertIn('data[2]=2 data[...]="+9997 more"', value)
+        self.assertNotIn("data[3]=", value)
+
+    def test_max_items_unsized(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False, max_items=2), name="max_items_unsized")
+        logger.debug("Hello", extra={"data": (i for i in range(10))})
+        self.assertIn("data[1]=1 data[...]=+more", stream.getvalue())
+
+    def test_max_items_custom_formatter(self):
+        formatter = LogfmtFormatter(colorize=False, max_items=1)
+        formatter.add_custom_formatter(complex, lambda value: ({"real": value.real, "imag": value.imag}, False))
+        logger, stream = setup_logger(formatter, name="max_items_custom_formatter")
+        logger.debug(complex(1, 2))
+        self.assertIn('message.real=1.0 message[...]="+1 more"', stream.getvalue())
+
+    def test_max_depth(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False, max_depth=2), name="max_depth")
+        logger.debug({"a": {"b": {"c": 1}}, "d": 2})
+        value = stream.getvalue()
+        self.assertIn("message[a][b]=<dict>", value)
+        self.assertIn("message[d]=2", value)
+
+    def test_max_value_length(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False, max_value_length=5), name="max_value_length")
+        logger.debug("Hello", extra={"data": "x" * 100})
+        self.assertIn("data=xxxxx...", stream.getvalue())
+        self.assertNotIn("xxxxxx", stream.getvalue())
+
+    def test_max_value_length_keeps_core_fields(self):
+        formatter = LogfmtFormatter(colorize=False, max_value_length=3)
+        logger, stream = setup_logger(formatter, name="max_value_length_core")
+        logger.info("Hello", extra={"data": "abcdef"})
+        value = stream.getvalue()
+        self.assertRegex(
+            value, r"^time=\d{4}-\d\d-\d\dT[\d:.]+\+00:00 function=test_max_value_length_keeps_core_fields "
+        )
+        self.assertIn("name=max_value_length_core level=INFO message=Hel... data=abc...", value)
+        record = logging.makeLogRecord({"msg": "Hello", "levelno": logging.INFO, "data": "abcdef"})
+        self.assertEqual(formatter.format_bytes(record).decode(), formatter.format(record))
+
+    def test_max_value_length_keeps_markers(self):
+        formatter = LogfmtFormatter(colorize=False, max_items=3, max_depth=2, max_value_length=3)
+        logger, stream = setup_logger(formatter, name="max_value_length_markers")
+        cyclic: list = []
+        cyclic.append(cyclic)
+        logger.info("Hello", extra={"data": {"big": list(range(99)), "nested": [{"a": 1}], "cyclic": cyclic}})
+        value = stream.getvalue()
+        self.assertIn('data[big][...]="+96 more"', value)
+        self.assertIn("data[nested][0]=<dict>", value)
+        self.assertIn("data[cyclic][0]=<cycle>", value)
+
+    def test_max_keys(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False, max_keys=10), name="max_keys")
+        logger.debug("Hello", extra={"data": {str(i): i for i in range(100)}})
+        value = stream.getvalue()
+        self.assertIn('data[...]="+96 more"', value)
+        self.assertEqual(value.count("="), 10)
+
+    def test_max_keys_nested(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False, max_keys=9), name="max_keys_nested")
+        logger.debug("Hello", extra={"data": {"a": {"x": 1, "y": 2, "z": 3}, "b": {"x": 4, "y": 5}, "c": 6}})
+        self.assertTrue(
+            stream.getvalue().endswith('message=Hello data[a][x]=1 data[a][y]=2 data[a][z]=3 data[...]="+2 more"\n')
+        )
+
+    def test_max_keys_counts_nested_keys_once(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False, max_keys=20), name="max_keys_deep")
+        logger.debug("Hello", extra={"data": {"a": {"b": {"c": list(range(5))}}, "z": 1, "y": 2, "x": 3}})
+        value = stream.getvalue()
+        self.assertTrue(value.endswith("data[a][b][c][4]=4 data[z]=1 data[y]=2 data[x]=3\n"))
+        self.assertNotIn("[...]", value)
+
+    def test_max_keys_single_marker(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False, max_keys=8), name="max_keys_marker")
+        logger.debug("Hello", extra={"data": {"a": {"b": {"c": list(range(5))}}, "z": 1, "y": 2, "x": 3}})
+        value = stream.getvalue()
+        self.assertTrue(value.endswith('data[a][b][c][1]=1 data[a][b][c][...]="+3 more"\n'))
+        self.assertEqual(value.count("="), 8)
+
+    def test_colliding_keys(self):
+        # Like dict.update, a flattened key that is already there keeps its position and takes the last value
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False), name="colliding_keys")
+        logger.debug({"a": {"b": 1}, "a][b": 2, "c": 3}, extra={"message[c]": "extra"})
+        self.assertIn(
+            "function=test_colliding_keys message[c]=3 name=colliding_keys level=DEBUG message[a][b]=2\n",
+            stream.getvalue(),
+        )
+
+    def test_cycle(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False), name="cycle")
+        cyclic: dict = {"a": 1}
+        cyclic["self"] = cyclic
+        logger.debug(cyclic)
+        value = stream.getvalue()
+        self.assertIn("message[a]=1", value)
+        self.assertIn("message[self]=<cycle>", value)
+
+    def test_shared_reference_is_not_a_cycle(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False), name="shared_reference")
+        shared = [1]
+        logger.debug({"a": shared, "b": shared})
+        value = stream.getvalue()
+        self.assertIn("message[a][0]=1", value)
+        self.assertIn("message[b][0]=1", value)
+
+
+class TestPathRules(TestCase):
+    def test_exclude_subtree(self):
+        formatter = LogfmtFormatter(colorize=False, exclude_paths=["data.payload"])
+        logger, stream = setup_logger(formatter, name="exclude_subtree")
+        logger.debug("Hello", extra={"data": {"payload": [1, 2, 3], "id": 7}})
+        value = stream.getvalue()
+        self.assertNotIn("payload", value)
+        self.assertIn("data[id]=7", value)
+
+    def test_glob_after_bracket(self):
+        formatter = LogfmtFormatter(colorize=False, exclude_paths=["data[secrets]*"])
+        logger, stream = setup_logger(formatter, name="glob_after_bracket")
+        logger.debug("Hello", extra={"data": {"secrets": "pw", "secrets2": {"k": "v"}, "other": 1}})
+        value = stream.getvalue()
+        self.assertNotIn("secrets", value)
+        self.assertIn("message=Hello data[other]=1\n", value)
+
+    def test_excluded_subtree_is_not_visited(self):
+        formatter = LogfmtFormatter(colorize=False, exclude_paths=["data[payload]"])
+        visited = []
+
+        @formatter.custom_formatter(SimpleDataclass)
+        def tracking_formatter(value: SimpleDataclass) -> CUSTOM_FORMATTER_FUNC_RETURN:
+            visited.append(value)
+            return {"a": value.a}, False
+
+        logger, stream = setup_logger(formatter, name="excluded_not_visited")
+        logger.debug("Hello", extra={"data": {"payload": SimpleDataclass(1, 2, 3), "other": SimpleDataclass(4, 5, 6)}})
+        self.assertEqual(visited, [SimpleDataclass(4, 5, 6)])
+        self.assertIn("data[other].a=4", stream.getvalue())
+
+    def test_wildcards(self):
+        formatter = LogfmtFormatter(colorize=False, exclude_paths=["message[*][raw]", "data[secret*]"])
+        logger, stream = setup_logger(formatter, name="wildcards")
+        logger.debug([{"raw": "x", "id": 1}, {"raw": "y", "id": 2}], extra={"data": {"secret_key": 1, "public": 2}})
+        value = stream.getvalue()
+        self.assertNotIn("[raw]", value)
+        self.assertIn("message[0][id]=1", value)
+        self.assertIn("message[1][id]=2", value)
+        self.assertNotIn("secret", value)
+        self.assertIn("data[public]=2", value)
+
+    def test_exclude_top_level(self):
+        formatter = LogfmtFormatter(colorize=False, exclude_paths=["function", "task*"])
+        logger, stream = setup_logger(formatter, name="exclude_top_level")
+        logger.debug("Hello", extra={"task_id": 1})
+        value = stream.getvalue()
+        self.assertNotIn("function=", value)
+        self.assertNotIn("task_id=", value)
+        self.assertIn("message=Hello", value)
+
+    def test_include(self):
+        formatter = LogfmtFormatter(colorize=False, include_paths=["data[user].name"])
+        logger, stream = setup_logger(formatter, name="include")
+        logger.debug({"a": 1}, extra={"data": {"user": {"name": "jane", "password": "x"}, "other": 1}})
+        value = stream.getvalue()
+        self.assertIn("data[user][name]=jane", value)
+        self.assertNotIn("password", value)
+        self.assertNotIn("data[other]", value)
+        self.assertIn("message[a]=1", value)
+
+    def test_exclude_wins_over_include(self):
+        formatter = LogfmtFormatter(colorize=False, include_paths=["data[user]"], exclude_paths=["data.user.password"])
+        logger, stream = setup_logger(formatter, name="exclude_over_include")
+        logger.debug("Hello", extra={"data": {"user": {"name": "jane", "password": "x"}}})
+        value = stream.getvalue()
+        self.assertIn("data[user][name]=jane", value)
+        self.assertNotIn("password", value)
+
+    def test_setter_recompiles(self):
+        formatter = LogfmtFormatter(colorize=False)
+        logger, stream = setup_logger(formatter, name="path_setter")
+        formatter.exclude_paths = ["data"]
+        logger.debug("Hello", extra={"data": {"a": 1}})
+        self.assertNotIn("data", stream.getvalue())
+        self.assertEqual(formatter.exclude_paths, ("data",))
+
+
+class TestEscaping(TestCase):
+    def test_safe_values_are_not_quoted(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False), name="escaping_safe")
+        uuid = "1b4e28ba-2fa1-11d2-883f-0016d3cca427"
+        logger.debug("Hello", extra={"data": {"id": uuid, "n": 1.5, "path": "a/b:c"}})
+        value = stream.getvalue()
+        self.assertIn(f"data[id]={uuid} data[n]=1.5 data[path]=a/b:c", value)
+
+    def test_special_characters_are_quoted_and_escaped(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False), name="escaping_special")
+        logger.debug('say "hi"\nnext\tline=1 back\\slash \x1b[0m')
+        self.assertIn(r'message="say \"hi\"\nnext\tline=1 back\\slash \u001b[0m"' + "\n", stream.getvalue())
+
+    def test_equals_without_space_is_quoted(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False), name="escaping_equals")
+        logger.debug("a=b")
+        self.assertIn('message="a=b"', stream.getvalue())
+
+    def test_keys_are_sanitized(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False), name="escaping_keys")
+        logger.debug({"a b": 1, 'c="d"': 2})
+        value = stream.getvalue()
+        self.assertIn("message[a_b]=1", value)
+        self.assertIn("message[c__d_]=2", value)
+
+    def test_same_rules_colorized(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=True), name="escaping_colorized")
+        logger.debug('say "hi"')
+        self.assertIn(
+            f'{ANSIColors.BOLD.BLACK}message={ANSIColors.RESET}{ANSIColors.REGULAR.BLACK}"{ANSIColors.RESET}'
+            f'say \\"hi\\"{ANSIColors.REGULAR.BLACK}"{ANSIColors.RESET}',
+            stream.getvalue(),
+        )
+
+
+class TestMsgTemplates(TestCase):
+    def test_named_placeholders(self):
+        formatter = LogfmtFormatter(colorize=False, msg_templates=True)
+        logger, stream = setup_logger(formatter, name="msg_templates_named")
+        logger.debug("user %(user)s took %(elapsed).2f s", {"user": "jane", "elapsed": 1.23456})
+        value = stream.getvalue()
+        self.assertIn("level=DEBUG user=jane elapsed=1.23\n", value)
+        self.assertNotIn("message=", value)
+
+    def test_registry_names_positional_placeholders(self):
+        formatter = LogfmtFormatter(colorize=False, msg_templates={"user %s logged in from %s": ["user", "ip"]})
+        logger, stream = setup_logger(formatter, name="msg_templates_registry")
+        logger.debug("user %s logged in from %s", "jane", "10.0.0.1")
+        self.assertIn("user=jane ip=10.0.0.1", stream.getvalue())
+
+    def test_colliding_placeholders(self):
+        formatter = LogfmtFormatter(colorize=False, msg_templates=True)
+        logger, stream = setup_logger(formatter, name="msg_templates_colliding")
+        logger.error("%(name)s failed at %(time)s", {"name": "bob", "time": "noon"})
+        logger.error("%(user)s failed", {"user": "bob"}, extra={"user": "extra"})
+        with bind(tenant="acme"):
+            logger.error("%(tenant)s failed", {"tenant": "globex"})
+        lines = stream.getvalue().splitlines()
+        self.assertRegex(lines[0], r"^time=\d{4}-")
+        self.assertIn('name=msg_templates_colliding level=ERROR message="bob failed at noon"', lines[0])
+        self.assertIn('user=extra name=msg_templates_colliding level=ERROR message="bob failed"', lines[1])
+        self.assertIn('tenant=acme name=msg_templates_colliding level=ERROR message="globex failed"', lines[2])
+
+    def test_fallback(self):
+        formatter = LogfmtFormatter(colorize=False, msg_templates=True, msg_regex=r"^(?P<a>\d+),(?P<b>\d+)$")
+        logger, stream = setup_logger(formatter, name="msg_templates_fallback")
+        logger.debug("%s,%s", 1, 2)  # positional and not registered
+        logger.debug("%(user)s done")  # no args, not interpolated
+        lines = stream.getvalue().splitlines()
+        self.assertIn("a=1 b=2", lines[0])
+        self.assertIn('message="%(user)s done"', lines[1])
+
+    def test_registry_mismatch(self):
+        with self.assertRaises(ValueError):
+            LogfmtFormatter(msg_templates={"user %s": ["user", "ip"]})
+
+    def test_template_cache_is_bounded(self):
+        formatter = LogfmtFormatter(colorize=False, msg_templates=True, template_cache_size=2)
+        logger, stream = setup_logger(formatter, name="msg_templates_cache")
+        for i in range(5):
+            logger.debug(f"%(user)s {i}", {"user": "jane"})
+        self.assertEqual(formatter._compiled_template.cache_info().currsize, 2)
+        self.assertEqual(stream.getvalue().count("user=jane"), 5)
+
+
+class TestExcFingerprints(TestCase):
+    @staticmethod
+    def fail(key):
+        return {}[key]
+
+    def log_failures(self, logger: logging.Logger, *keys: str):
+        for key in keys:
+            try:
+                self.fail(key)
+            except KeyError:
+                logger.exception("Lookup failed")
+
+    def test_trace_rendered_once_per_fingerprint(self):
+        formatter = LogfmtFormatter(colorize=False, exc_fingerprints=True)
+        logger, stream = setup_logger(formatter, name="exc_fingerprints")
+        self.log_failures(logger, "a", "b", "c")
+        value = stream.getvalue()
+        self.assertEqual(value.count("Traceback (most recent call last)"), 1)
+        lines = [line for line in value.splitlines() if line.startswith("time=")]
+        self.assertEqual(len(lines), 3)
+        hashes = {line.split("exc_hash=")[1].split()[0] for line in lines}
+        self.assertEqual(len(hashes), 1)
+        self.assertIn("exc_type=KeyError exc_msg='c'", lines[2])
+
+    def test_formatter_shared_by_handlers(self):
+        formatter = LogfmtFormatter(colorize=False, exc_fingerprints=True)
+        logger, stream = setup_logger(formatter, name="exc_fingerprints_shared")
+        other = io.StringIO()
+        handler = logging.StreamHandler(other)
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+        self.log_failures(logger, "a", "b")
+        self.assertEqual(stream.getvalue().count("Traceback (most recent call last)"), 1)
+        self.assertEqual(other.getvalue(), stream.getvalue())
+
+    def test_different_locations(self):
+        formatter = LogfmtFormatter(colorize=False, exc_fingerprints=True)
+        logger, stream = setup_logger(formatter, name="exc_fingerprints_locations")
+        self.log_failures(logger, "a")
+        try:
+            int("x")
+        except ValueError:
+            logger.exception("Parse failed")
+        self.assertEqual(stream.getvalue().count("Traceback (most recent call last)"), 2)
+
+    def test_reemit_interval(self):
+        formatter = LogfmtFormatter(colorize=False, exc_fingerprints=True, exc_reemit_interval=0)
+        logger, stream = setup_logger(formatter, name="exc_fingerprints_reemit")
+        self.log_failures(logger, "a", "b")
+        self.assertEqual(stream.getvalue().count("Traceback (most recent call last)"), 2)
+
+    def test_stack_info(self):
+        formatter = LogfmtFormatter(colorize=False, exc_fingerprints=True)
+        logger, stream = setup_logger(formatter, name="exc_fingerprints_stack")
+        for _ in range(2):
+            logger.debug("Here", stack_info=True)
+        value = stream.getvalue()
+        self.assertEqual(value.count("Stack (most recent call last)"), 1)
+        self.assertEqual(value.count("stack_hash="), 2)
+
+
+class TestInstrumentation(TestCase):
+    def test_stats(self):
+        formatter = LogfmtFormatter(colorize=False, instrument=True)
+        logger, stream = setup_logger(formatter, name="instrumentation")
+        logger.debug("Hello", extra={"data": {"a": [1, 2]}})
+        logger.debug("World")
+        stats = formatter.stats()
+        self.assertEqual(stats["records"], 2)
+        self.assertEqual(stats["bytes"], len(stream.getvalue()) - 2)  # without the newlines
+        self.assertEqual(stats["keys"], stream.getvalue().count("="))
+        self.assertEqual(stats["phases"]["format"]["count"], 2)
+        self.assertEqual(stats["phases"]["expand"]["count"], 1)
+        self.assertEqual(stats["phases"]["exception"]["count"], 0)
+        self.assertEqual(sum(stats["phases"]["render"]["histogram_us"].values()), 2)
+        self.assertEqual(stats["formatter_hits"], {"format_mapping": 1, "format_iterable": 1})
+        formatter.reset_stats()
+        self.assertEqual(formatter.stats()["records"], 0)
+
+    def test_disabled_runs_plain_methods(self):
+        formatter = LogfmtFormatter(colorize=False, instrument=True, msg_regex=r"(?P<a>\d+)")
+        formatter.instrument = False
+        self.assertNotIn("format", vars(formatter))
+        self.assertIs(type(formatter.msg_regex), type(re.compile("")))
+        logger, _ = setup_logger(formatter, name="instrumentation_disabled")
+        logger.debug("Hello")
+        self.assertEqual(formatter.stats()["records"], 0)
+
+    def test_periodic_report(self):
+        formatter = LogfmtFormatter(colorize=False, instrument=True, stats_interval=0)
+        stats_logger, stream = setup_logger(LogfmtFormatter(colorize=False), name="harp_logfmt.stats")
+        stats_logger.propagate = False
+        logger, _ = setup_logger(formatter, name="instrumentation_report")
+        logger.debug("Hello")
+        value = stream.getvalue()
+        self.assertIn('message="Formatter stats"', value)
+        self.assertIn("data[records]=1 data[keys]=5", value)
+
+
+class TestDefaultFormatters(TestCase):
+    def test_namespaces(self):
+        import argparse
+        import types
+        from multiprocessing.dummy import Namespace as DummyNamespace
+
+        for namespace in (types.SimpleNamespace(a=1), argparse.Namespace(a=1), DummyNamespace(a=1)):
+            logger, stream = setup_logger(LogfmtFormatter(colorize=False), name="default_formatters_namespace")
+            logger.debug(namespace)
+            self.assertIn("message.a=1", stream.getvalue())
+
+    def test_dataclass_type_is_not_expanded(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False), name="default_formatters_dataclass_type")
+        logger.debug("Hello", extra={"data": {"type": SimpleDataclass, "value": SimpleDataclass(1, 2, 3)}})
+        value = stream.getvalue()
+        self.assertIn("data[type]=\"<class 'test.test.SimpleDataclass'>\"", value)
+        self.assertIn("data[value].a=1", value)
+
+
+class TestBoundFields(TestCase):
+    def test_bind_context_manager(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False), name="bound_fields")
+        with bind(request_id="r1", user="jane doe"):
+            with bind(tenant="acme"):
+                logger.debug("Inner")
+                self.assertEqual(bound_fields(), {"request_id": "r1", "user": "jane doe", "tenant": "acme"})
+            logger.debug("Outer")
+        logger.debug("Unbound")
+        lines = stream.getvalue().splitlines()
+        self.assertIn('function=test_bind_context_manager request_id=r1 user="jane doe" tenant=acme name=', lines[0])
+        self.assertIn('request_id=r1 user="jane doe" name=', lines[1])
+        self.assertNotIn("request_id", lines[2])
+        self.assertEqual(bound_fields(), {})
+
+    def test_unbind(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False), name="bound_fields_unbind")
+        with bind(request_id="r1", user="jane"), unbind("user"):
+            logger.debug("Hello")
+        self.assertIn("request_id=r1 name=", stream.getvalue())
+        self.assertNotIn("user", stream.getvalue())
+
+    def test_fragment_is_cached(self):
+        formatter = LogfmtFormatter(colorize=False)
+        logger, stream = setup_logger(formatter, name="bound_fields_cache")
+        with bind(request_id="r1"):
+            logger.debug("One")
+            with mock.patch.object(formatter, "kv_to_logfmt", wraps=formatter.kv_to_logfmt) as kv_to_logfmt:
+                logger.debug("Two")
+            self.assertNotIn("request_id", [call.args[0] for call in kv_to_logfmt.call_args_list])
+            formatter.colorize = True  # expires the fragment
+            logger.debug("Three")
+        self.assertIn(f"{ANSIColors.BOLD.BLACK}request_id={ANSIColors.RESET}", stream.getvalue().splitlines()[2])
+
+    def test_max_value_length_expires_fragment(self):
+        formatter = LogfmtFormatter(colorize=False)
+        logger, stream = setup_logger(formatter, name="bound_fields_max_value_length")
+        with bind(req="abcdefghijkl"):
+            logger.debug("One")
+            formatter.max_value_length = 3
+            logger.debug("Two")
+        lines = stream.getvalue().splitlines()
+        self.assertIn("req=abcdefghijkl", lines[0])
+        self.assertIn("req=abc...", lines[1])
+
+    def test_exclusion_and_extra_override(self):
+        formatter = LogfmtFormatter(colorize=False, exclude_keys=["secret"])
+        logger, stream = setup_logger(formatter, name="bound_fields_exclusion")
+        with bind(request_id="r1", secret="x"):
+            logger.debug("Hello", extra={"request_id": "r2"})
+            bytes_line = formatter.format_bytes(logging.makeLogRecord({"msg": "Hi", "levelno": logging.INFO}))
+        self.assertIn("request_id=r2 name=", stream.getvalue())
+        self.assertEqual(stream.getvalue().count("request_id"), 1)
+        self.assertNotIn("secret", stream.getvalue())
+        self.assertIn(b" request_id=r1 level=INFO message=Hi", bytes_line)
+
+    def test_core_keys_are_left_out(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False), name="bound_fields_core_keys")
+        with bind(name="alice", message="m", data="d", user="jane"):
+            logger.debug("Fragment")
+        with bind(time="yesterday", level="loud", user="jane"):
+            logger.debug("One by one")
+        for line in stream.getvalue().splitlines():
+            for key in ("time", "name", "level", "message"):
+                self.assertEqual(line.count(f" {key}=") + line.startswith(f"{key}="), 1)
+            self.assertIn(" user=jane name=bound_fields_core_keys level=DEBUG message=", line)
+        self.assertNotIn("data=", stream.getvalue())
+        self.assertNotIn("yesterday", stream.getvalue())
+
+    def test_asyncio_tasks(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False), name="bound_fields_asyncio")
+
+        async def handle(request_id: str):
+            bind(request_id=request_id)
+            await asyncio.sleep(0)
+            logger.debug("Handled")
+
+        async def main():
+            with bind(service="api"):
+                await asyncio.gather(*(handle(f"r{i}") for i in range(3)))
+            self.assertEqual(bound_fields(), {})
+
+        asyncio.run(main())
+        lines = sorted(stream.getvalue().splitlines())
+        self.assertEqual(len(lines), 3)
+        for i, line in enumerate(lines):
+            self.assertIn(f"service=api request_id=r{i} name=", line)
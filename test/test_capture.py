@@ -0,0 +1,186 @@
+from harp_logfmt import CaptureHandler, LogfmtFormatter, bind
+from harp_logfmt.__main__ import main
+from harp_logfmt.capture import CaptureEncoder, iter_frames, render
+from unittest import TestCase, mock
+import io
+import logging
+import os
+import sys
+import tempfile
+import uuid
+
+
+def make_record(msg: str = "Handled %s", args: tuple = ("order",), levelno: int = logging.INFO, **extra):
+    record = logging.LogRecord("orders", levelno, __file__, 12, msg, args, None, func="handle")
+    record.__dict__.update(extra)
+    return record
+
+
+class TestCapture(TestCase):
+    def assertRendersAsFormat(self, records: list[logging.LogRecord], **options):
+        """Captures `records` and checks that rendering them gives `format`'s lines, with the same options."""
+        capture_formatter = LogfmtFormatter(colorize=False)
+        encoder = CaptureEncoder(capture_formatter)
+        buffer = bytearray()
+        for record in records:
+            encoder.encode_into(record, buffer)
+        formatter = LogfmtFormatter(**options)
+        self.assertEqual(list(render(bytes(buffer), formatter)), [formatter.format(record) for record in records])
+
+    def test_plain(self):
+        self.assertRendersAsFormat([make_record(), make_record("Debug", (), logging.DEBUG)], colorize=False)
+
+    def test_nested(self):
+        records = [
+            make_record(data={"user": {"id": 1, "name": "jane doe"}, "items": [1, "two", None]}),
+            make_record(data={"user": {"id": 2, "name": 'a "quoted" name'}, "items": []}),
+            make_record(amount=1.5, flag=True, missing=None, when=b"bytes"),
+        ]
+        self.assertRendersAsFormat(records, colorize=False)
+        self.assertRendersAsFormat(records, colorize=True)
+        self.assertRendersAsFormat(records, colorize=False, exclude_keys=["function", "amount"], max_value_length=5)
+        self.assertRendersAsFormat(records, colorize=False, exclude_paths=["data.user.name", "when"])
+
+    def test_limit_markers(self):
+        cyclic: list = []
+        cyclic.append(cyclic)
+        records = [make_record(data={"big": list(range(99)), "cyclic": cyclic, "nested": [{"a": 1}]})]
+        capture_formatter = LogfmtFormatter(colorize=False, max_items=2)
+        captured = CaptureEncoder(capture_formatter).encode(records[0])
+        formatter = LogfmtFormatter(colorize=False, max_items=2, max_value_length=3)
+        rendered = list(render(captured, formatter))
+        self.assertEqual(rendered, [formatter.format(records[0])])
+        self.assertIn('data[big][...]="+97 more"', rendered[0])
+        self.assertIn("data[cyclic][0]=<cycle>", rendered[0])
+
+    def test_none(self):
+        records = [make_record(missing=None, data={"items": [1]})]
+        self.assertRendersAsFormat(records, colorize=False)
+        self.assertRendersAsFormat(records, colorize=False, discard_none=False)
+
+    def test_exc_info(self):
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record = make_record("Failed", (), logging.ERROR)
+            record.exc_info = sys.exc_info()
+        self.assertRendersAsFormat([record, make_record()], colorize=False)
+
+    def test_bound_fields(self):
+        with bind(request_id="r1", user="jane doe"):
+            records = [make_record(), make_record(tenant="acme")]
+        self.assertRendersAsFormat(records, colorize=False)
+
+    def test_time_format(self):
+        record = make_record()
+        record.created = 1700000000.123456
+        self.assertRendersAsFormat([record], colorize=False, time_format="epoch_ns")
+        self.assertRendersAsFormat([record], colorize=False, time_format="iso")
+
+    def test_overridden_time_and_level(self):
+        self.assertRendersAsFormat([make_record(time="yesterday", level="loud")], colorize=False)
+
+    def test_nul_in_value(self):
+        self.assertRendersAsFormat([make_record(data={"raw": "a\0b"})], colorize=False)
+
+    def test_instrumented_formatter(self):
+        formatter = LogfmtFormatter(colorize=False, instrument=True)
+        records = [make_record(data={"user": {"id": 1}}), make_record()]
+        captured = b"".join(CaptureEncoder(formatter).encode(record) for record in records)
+        self.assertEqual(list(render(captured, formatter)), [formatter.format(record) for record in records])
+
+    def test_unencodable_record(self):
+        encoder = CaptureEncoder(LogfmtFormatter(colorize=False))
+        buffer = bytearray()
+        for extra in ({"caf\udce9": 1}, {"caf\udce9": 2}, {"path": "caf\udce9"}):
+            with self.assertRaises(UnicodeEncodeError):
+                encoder.encode_into(make_record(**extra), buffer)
+        record = make_record()
+        encoder.encode_into(record, buffer)
+        formatter = LogfmtFormatter(colorize=False)
+        self.assertEqual(list(render(bytes(buffer), formatter)), [formatter.format(record)])
+
+    def test_shapes_are_interned(self):
+        encoder = CaptureEncoder(LogfmtFormatter(colorize=False))
+        buffer = bytearray()
+        for i in range(10):
+            encoder.encode_into(make_record(args=(i,)), buffer)
+        tags = [chr(tag) for tag, _ in iter_frames(bytes(buffer))]
+        self.assertEqual(tags, ["X", "S"] + ["R"] * 10)
+
+    def test_max_shapes(self):
+        encoder = CaptureEncoder(LogfmtFormatter(colorize=False), max_shapes=2)
+        records = [make_record(**{f"key{i % 3}": i}) for i in range(9)]
+        buffer = bytearray()
+        for record in records:
+            encoder.encode_into(record, buffer)
+        self.assertLessEqual(len(encoder._shapes), 2)
+        self.assertGreater([tag for tag, _ in iter_frames(bytes(buffer))].count(ord("X")), 1)
+        formatter = LogfmtFormatter(colorize=False)
+        self.assertEqual(list(render(bytes(buffer), formatter)), [formatter.format(record) for record in records])
+
+    def test_truncated_stream(self):
+        encoder = CaptureEncoder(LogfmtFormatter(colorize=False))
+        buffer = bytearray()
+        for i in range(3):
+            encoder.encode_into(make_record(args=(i,)), buffer)
+        self.assertEqual(len(list(render(bytes(buffer[:-1]), LogfmtFormatter(colorize=False)))), 2)
+
+    def test_not_a_capture(self):
+        with self.assertRaises(ValueError):
+            list(render(b"\x05Rxxxx", LogfmtFormatter()))
+
+
+class TestCaptureHandler(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "app.capture")
+
+    def log(self, messages: list[str]):
+        handler = CaptureHandler(os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT), close_fd=True)
+        handler.setFormatter(LogfmtFormatter(colorize=False))
+        logger = logging.getLogger(str(uuid.uuid4()))
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        for message in messages:
+            logger.info(message, extra={"data": {"order_id": 1}})
+        handler.close()
+
+    def test_appended_captures(self):
+        self.log(["one", "two"])
+        self.log(["three"])
+        with open(self.path, "rb") as file:
+            lines = list(render(file, LogfmtFormatter(colorize=False)))
+        self.assertEqual([line.split("message=")[1].split(" ")[0] for line in lines], ["one", "two", "three"])
+        self.assertIn("data[order_id]=1", lines[0])
+
+    def test_requires_logfmt_formatter(self):
+        handler = CaptureHandler(os.open(self.path, os.O_WRONLY | os.O_CREAT), close_fd=True)
+        handler.setFormatter(logging.Formatter())
+        with mock.patch.object(handler, "handleError") as handle_error:
+            handler.handle(make_record())
+        handler.close()
+        handle_error.assert_called_once()
+
+    def test_instrumented_formatter(self):
+        handler = CaptureHandler(os.open(self.path, os.O_WRONLY | os.O_CREAT), close_fd=True)
+        handler.setFormatter(LogfmtFormatter(colorize=False, instrument=True))
+        with mock.patch.object(handler, "handleError") as handle_error:
+            handler.handle(make_record())
+        handler.close()
+        handle_error.assert_not_called()
+        with open(self.path, "rb") as file:
+            self.assertEqual(len(list(render(file, LogfmtFormatter(colorize=False)))), 1)
+
+    def test_cli(self):
+        self.log(["one", "two"])
+        stdout = io.StringIO()
+        with mock.patch("sys.stdout", stdout):
+            self.assertEqual(main(["render", self.path, "--exclude-key", "function", "--exclude-path", "data"]), 0)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith("time="))
+        self.assertNotIn("function=", lines[0])
+        self.assertNotIn("order_id", lines[0])
@@ -0,0 +1,65 @@
+from harp_logfmt import LogfmtFormatter
+from harp_logfmt.__main__ import main
+from harp_logfmt.columnar import ColumnarReader, convert
+from harp_logfmt.parser import iter_parse
+from unittest import TestCase, mock
+from .test import setup_logger
+import io
+import os
+import tempfile
+
+
+class TestColumnar(TestCase):
+    def setUp(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False), name="columnar")
+        for i in range(250):
+            data = {"order_id": i, "price": i / 4, "status": "ok" if i % 3 else "failed"} if i % 2 else {"retry": True}
+            logger.info("Handled %d", i, extra={"data": data})
+        self.text = stream.getvalue()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "app.hlfc")
+        with open(self.path, "wb") as file:
+            self.assertEqual(convert(io.StringIO(self.text), file, chunk_records=100), 250)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        with ColumnarReader(self.path) as reader:
+            self.assertEqual(reader.rows, 250)
+            self.assertEqual(reader.chunks, 3)
+            for record, expected in zip(reader.records(), iter_parse(io.StringIO(self.text)), strict=True):
+                expected.pop("time")
+                self.assertEqual({key: str(value) for key, value in record.items() if key != "time"}, expected)
+
+    def test_column_kinds(self):
+        with ColumnarReader(self.path) as reader:
+            kinds = {key: reader.column_chunk(0, key).kind for key in reader.columns}
+            self.assertEqual(kinds["time"], "time")
+            self.assertEqual(kinds["data[order_id]"], "int")
+            self.assertEqual(kinds["data[price]"], "float")
+            self.assertEqual(kinds["data[status]"], "str")
+            self.assertEqual(kinds["message"], "str")
+            status = reader.column_chunk(0, "data[status]")
+            self.assertEqual(sorted(status.dictionary), ["failed", "ok"])
+            self.assertEqual(len(status.index), 50)  # sparse, only the odd rows
+            self.assertIsNone(reader.column_chunk(0, "time").index)
+            self.assertEqual(reader.column("data[order_id]")[:4], [None, 1, None, 3])
+            self.assertIsInstance(reader.column("time")[0], float)
+            self.assertEqual(sum(sum(values) for values in reader.column_values("data[order_id]")), 125**2)
+            del status
+
+    def test_not_columnar(self):
+        with open(self.path, "wb") as file:
+            file.write(b"time=1 level=INFO\n")
+        with self.assertRaises(ValueError):
+            ColumnarReader(self.path)
+
+    def test_cli(self):
+        source = os.path.join(self.directory.name, "app.log")
+        with open(source, "w") as file:
+            file.write(self.text)
+        with mock.patch("sys.stdout", io.StringIO()):
+            self.assertEqual(main(["columnar", source, self.path]), 0)
+        with ColumnarReader(self.path) as reader:
+            self.assertEqual(reader.rows, 250)
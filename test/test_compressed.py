@@ -0,0 +1,123 @@
+from harp_logfmt import BlockCompressedFileHandler, LogfmtFormatter
+from harp_logfmt.__main__ import main
+from harp_logfmt.compressed import CompressedLogReader, index_path, read_index, recover
+from unittest import TestCase, mock
+import gzip
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+
+def log(handler: logging.Handler, records: int, start: int = 0, created: float = 1700000000.0):
+    """Logs `records` records, one per second from `created`, with a traceback on every 10th."""
+    logger = logging.getLogger(str(uuid.uuid4()))
+    logger.propagate = False
+    logger.addHandler(handler)
+    for i in range(start, start + records):
+        record = logger.makeRecord("orders", logging.INFO, __file__, 1, "Handled %d", (i,), None)
+        record.created = created + i
+        if i % 10 == 0:
+            try:
+                raise ValueError(i)
+            except ValueError:
+                record.exc_info = sys.exc_info()
+        logger.handle(record)
+    logger.removeHandler(handler)
+
+
+class TestBlockCompressedFileHandler(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "app.log.gz")
+
+    def handler(self, **kwargs) -> BlockCompressedFileHandler:
+        handler = BlockCompressedFileHandler(self.path, **kwargs)
+        handler.setFormatter(LogfmtFormatter(colorize=False))
+        return handler
+
+    def messages(self, lines) -> list[int]:
+        return [int(line.split(b'message="Handled ')[1].split(b'"')[0]) for line in lines if line.startswith(b"time=")]
+
+    def test_round_trip(self):
+        handler = self.handler(block_size=2048)
+        log(handler, 200)
+        handler.close()
+        with gzip.open(self.path) as file:  # a valid multi-member gzip file
+            lines = file.read().splitlines(keepends=True)
+        self.assertEqual(self.messages(lines), list(range(200)))
+        reader = CompressedLogReader(self.path)
+        self.assertEqual(reader.blocks, read_index(self.path))
+        self.assertGreater(len(reader.blocks), 5)
+        self.assertEqual(sum(block.records for block in reader.blocks), 200)
+        self.assertEqual(reader.blocks[0].first, 1700000000.0)
+        self.assertEqual(list(reader.lines()), lines)
+
+    def test_time_range(self):
+        handler = self.handler(block_size=2048)
+        log(handler, 200)
+        handler.close()
+        reader = CompressedLogReader(self.path)
+        since, until = 1700000100.0, 1700000110.0
+        self.assertLess(len(reader.select(since, until)), 3)
+        lines = list(reader.lines(since, until))
+        self.assertEqual(self.messages(lines), list(range(100, 111)))
+        self.assertIn(b"ValueError: 110\n", lines)  # with its record
+        self.assertNotIn(b"ValueError: 100\n", lines[-3:])
+
+    def test_block_interval(self):
+        handler = self.handler(block_interval=0.05)
+        log(handler, 3)
+        deadline = time.monotonic() + 5
+        while not handler.blocks_written and time.monotonic() < deadline:
+            time.sleep(0.01)  # sealed by the writer thread, without any further record
+        self.assertEqual(handler.blocks_written, 1)
+        handler.close()
+
+    def test_append_and_recover(self):
+        handler = self.handler()
+        log(handler, 10)
+        handler.close()
+        with open(self.path, "ab") as file:
+            file.write(b"\x1f\x8b\x08\x00 cut short")
+        with open(index_path(self.path), "a") as file:
+            file.write("offset=")
+        handler = self.handler()
+        log(handler, 10, start=10)
+        handler.close()
+        reader = CompressedLogReader(self.path)
+        self.assertEqual(len(reader.blocks), 2)
+        self.assertEqual(self.messages(reader.lines()), list(range(20)))
+        os.remove(index_path(self.path))
+        self.assertEqual(CompressedLogReader(self.path).blocks, reader.blocks)  # found by scanning
+        self.assertEqual(recover(self.path), os.path.getsize(self.path))
+        self.assertEqual(read_index(self.path), reader.blocks)
+
+    def test_unencodable_record(self):
+        handler = self.handler()
+        logger = logging.getLogger(str(uuid.uuid4()))
+        logger.propagate = False
+        logger.addHandler(handler)
+        with mock.patch.object(handler, "handleError") as handle_error:
+            logger.warning("bad", extra={"data": {"path": "caf\udce9"}})
+        handle_error.assert_called_once()
+        logger.warning("after")
+        handler.close()
+        with gzip.open(self.path) as file:
+            lines = file.read().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertNotIn(b"message=bad", lines[0])
+        self.assertEqual(CompressedLogReader(self.path).blocks[0].records, 1)
+
+    def test_cli(self):
+        handler = self.handler(block_size=2048)
+        log(handler, 200)
+        handler.close()
+        stdout = io.TextIOWrapper(io.BytesIO())
+        with mock.patch("sys.stdout", stdout):
+            self.assertEqual(main(["cat", self.path, "--since", "2023-11-14T22:15:00+00:00"]), 0)
+        self.assertEqual(self.messages(stdout.buffer.getvalue().splitlines()), list(range(100, 200)))
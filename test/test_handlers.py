@@ -0,0 +1,533 @@
+from harp_logfmt import (
+    BackgroundStreamHandler,
+    BatchStreamHandler,
+    DedupHandler,
+    FileDescriptorHandler,
+    LogfmtFormatter,
+    RenderedLineListener,
+    RenderingQueueHandler,
+    ShardedFileHandler,
+    bind,
+)
+from unittest import TestCase, mock
+from uuid import uuid4
+import io
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+
+
+class CountingStringIO(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, s: str) -> int:
+        self.writes += 1
+        return super().write(s)
+
+
+def setup_handler(handler: logging.Handler, formatter: logging.Formatter | None = None) -> logging.Logger:
+    handler.setFormatter(formatter or LogfmtFormatter(colorize=False))
+    logger = logging.getLogger(str(uuid4()))
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.addHandler(handler)
+    return logger
+
+
+class TestFormatMany(TestCase):
+    def test_matches_format(self):
+        formatter = LogfmtFormatter(colorize=False)
+        records = [
+            logging.LogRecord("batch", logging.INFO, __file__, 1, "Message %d", (i,), None, func="f") for i in range(3)
+        ]
+        expected = [formatter.format(record) for record in records]
+        self.assertEqual(formatter.format_many(records, join=False), expected)
+        self.assertEqual(formatter.format_many(records), "\n".join(expected))
+
+    def test_on_error(self):
+        formatter = LogfmtFormatter(colorize=False)
+        records = [
+            logging.LogRecord("batch", logging.INFO, __file__, 1, msg, args, None, func="f")
+            for msg, args in (("ok1", ()), ("bad %d", ("x",)), ("ok2", ()))
+        ]
+        with self.assertRaises(TypeError):
+            formatter.format_many(records)
+        failed = []
+        lines = formatter.format_many(records, join=False, on_error=failed.append)
+        self.assertEqual(lines, [formatter.format(records[0]), formatter.format(records[2])])
+        self.assertEqual(failed, [records[1]])
+
+
+class TestBatchStreamHandler(TestCase):
+    def test_single_write_per_batch(self):
+        stream = CountingStringIO()
+        handler = BatchStreamHandler(stream, capacity=4)
+        logger = setup_handler(handler)
+        for i in range(8):
+            logger.info("Message %d", i)
+        self.assertEqual(stream.writes, 2)
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 8)
+        self.assertTrue(lines[7].endswith('message="Message 7"'))
+
+    def test_flush_level_and_close(self):
+        stream = CountingStringIO()
+        handler = BatchStreamHandler(stream, capacity=100)
+        logger = setup_handler(handler)
+        logger.info("Buffered")
+        self.assertEqual(stream.getvalue(), "")
+        logger.error("Flushes")
+        self.assertEqual(len(stream.getvalue().splitlines()), 2)
+        logger.info("Closing")
+        handler.close()
+        self.assertIn("message=Closing\n", stream.getvalue())
+
+    def test_bad_record(self):
+        stream = io.StringIO()
+        handler = BatchStreamHandler(stream, capacity=100)
+        logger = setup_handler(handler)
+        logger.info("ok1")
+        logger.info("bad %d", "x")
+        logger.info("ok2")
+        with mock.patch.object(handler, "handleError") as handle_error:
+            handler.flush()
+        self.assertEqual([call.args[0].msg for call in handle_error.call_args_list], ["bad %d"])
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn("message=ok2", lines[1])
+
+    def test_bound_fields_of_the_logging_context(self):
+        stream = io.StringIO()
+        handler = BatchStreamHandler(stream, capacity=100)
+        logger = setup_handler(handler)
+        with bind(request_id="A"):
+            logger.info("in A")
+        with bind(request_id="B"):
+            logger.info("in B")
+            handler.flush()
+        lines = stream.getvalue().splitlines()
+        self.assertIn("request_id=A", lines[0])
+        self.assertIn("request_id=B", lines[1])
+        self.assertNotIn("_harp_logfmt_bound", stream.getvalue())
+
+    def test_other_formatter(self):
+        stream = io.StringIO()
+        handler = BatchStreamHandler(stream, capacity=2)
+        logger = setup_handler(handler, logging.Formatter("%(levelname)s %(message)s"))
+        logger.info("a")
+        logger.info("b")
+        self.assertEqual(stream.getvalue(), "INFO a\nINFO b\n")
+
+
+class StallingStringIO(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.unstalled = threading.Event()
+
+    def write(self, s: str) -> int:
+        self.unstalled.wait()
+        return super().write(s)
+
+
+class TestBackgroundStreamHandler(TestCase):
+    def test_writes_in_background(self):
+        stream = io.StringIO()
+        handler = BackgroundStreamHandler(stream)
+        logger = setup_handler(handler)
+        for i in range(100):
+            logger.info("Message %d", i)
+        handler.flush()
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 100)
+        self.assertIn('message="Message 99"', lines[-1])
+        handler.close()
+
+    def test_bound_fields(self):
+        stream = io.StringIO()
+        handler = BackgroundStreamHandler(stream)
+        logger = setup_handler(handler)
+        with bind(request_id="A"):
+            logger.info("in A")
+        handler.close()
+        self.assertIn("request_id=A", stream.getvalue())
+
+    def test_close_drains_queue(self):
+        stream = io.StringIO()
+        handler = BackgroundStreamHandler(stream)
+        logger = setup_handler(handler)
+        logger.info("Before close")
+        handler.close()
+        self.assertIn('message="Before close"', stream.getvalue())
+        logger.info("After close")
+        self.assertEqual(handler.dropped, 1)
+
+    def test_bad_record(self):
+        stream = io.StringIO()
+        handler = BackgroundStreamHandler(stream)
+        logger = setup_handler(handler)
+        with mock.patch.object(handler, "handleError") as handle_error:
+            logger.warning("ok1")
+            logger.warning("bad %d", "x")
+            logger.warning("ok2")
+            handler.close()
+        self.assertEqual([call.args[0].msg for call in handle_error.call_args_list], ["bad %d"])
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn("message=ok1", lines[0])
+        self.assertIn("message=ok2", lines[1])
+
+    def test_drop_newest_does_not_block(self):
+        stream = StallingStringIO()
+        handler = BackgroundStreamHandler(stream, queue_size=2, overflow="drop_newest")
+        logger = setup_handler(handler)
+        start = time.monotonic()
+        for i in range(50):
+            logger.info("Message %d", i)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertGreater(handler.dropped, 0)
+        self.assertEqual(handler.dropped, handler.dropped_by_level[logging.INFO])
+        stream.unstalled.set()
+        handler.close()
+        self.assertEqual(len(stream.getvalue().splitlines()) + handler.dropped, 50)
+
+    def test_drop_oldest_keeps_latest(self):
+        stream = StallingStringIO()
+        handler = BackgroundStreamHandler(stream, queue_size=2, overflow="drop_oldest")
+        logger = setup_handler(handler)
+        for i in range(50):
+            logger.info("Message %d", i)
+        stream.unstalled.set()
+        handler.close()
+        self.assertIn('message="Message 49"', stream.getvalue())
+        self.assertEqual(len(stream.getvalue().splitlines()) + handler.dropped, 50)
+
+    def test_drop_below_level(self):
+        stream = StallingStringIO()
+        handler = BackgroundStreamHandler(stream, queue_size=1, overflow="drop_below_level", block_timeout=0.01)
+        logger = setup_handler(handler)
+        for i in range(5):
+            logger.debug("Debug %d", i)
+        logger.error("Important")
+        self.assertGreater(handler.dropped_by_level[logging.DEBUG], 0)
+        stream.unstalled.set()
+        handler.close()
+
+    def test_unknown_overflow(self):
+        with self.assertRaises(ValueError):
+            BackgroundStreamHandler(overflow="explode")  # type: ignore[arg-type]
+
+
+def log_from_worker(log_queue, worker: int):
+    logger = logging.getLogger(f"worker{worker}")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    handler = RenderingQueueHandler(log_queue)
+    handler.setFormatter(LogfmtFormatter(colorize=False))
+    logger.addHandler(handler)
+    unpicklable = threading.Lock()
+    for i in range(20):
+        logger.info("Message %d", i, extra={"data": {"worker": worker, "lock": unpicklable}})
+
+
+class TestRenderingQueueHandler(TestCase):
+    def test_enqueues_rendered_bytes(self):
+        log_queue: queue.Queue = queue.Queue()
+        handler = RenderingQueueHandler(log_queue)
+        logger = setup_handler(handler)
+        logger.info("Hello", extra={"data": {"lock": threading.Lock()}})
+        line = log_queue.get_nowait()
+        self.assertIsInstance(line, bytes)
+        self.assertIn(b'message=Hello data[lock]="<unlocked _thread.lock object at ', line)
+        self.assertTrue(line.endswith(b'>"\n'))
+
+    def test_multiprocess_pipeline(self):
+        context = multiprocessing.get_context()
+        log_queue = context.Queue()
+        stream = io.BytesIO()
+        listener = RenderedLineListener(log_queue, stream)
+        listener.start()
+        workers = [context.Process(target=log_from_worker, args=(log_queue, worker)) for worker in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        listener.stop()
+        lines = stream.getvalue().decode().splitlines()
+        self.assertEqual(len(lines), 60)
+        for worker in range(3):
+            messages = [line.split('message="')[1].split('"')[0] for line in lines if f"data[worker]={worker}" in line]
+            self.assertEqual(messages, [f"Message {i}" for i in range(20)])
+
+
+class TestFormatBytes(TestCase):
+    def test_matches_format(self):
+        for colorize in (False, True):
+            formatter = LogfmtFormatter(colorize=colorize)
+            try:
+                raise ValueError("boom")
+            except ValueError:
+                exc_info = sys.exc_info()
+            record = logging.LogRecord("bytes", logging.ERROR, __file__, 1, "Héllo wörld", None, exc_info, func="f")
+            record.data = {"a": [1, "two words"], "ü": "ö"}
+            self.assertEqual(formatter.format_bytes(record), formatter.format(record).encode())
+
+    def test_format_into_appends(self):
+        formatter = LogfmtFormatter(colorize=False)
+        record = logging.LogRecord("bytes", logging.INFO, __file__, 1, "Hello", None, None, func="f")
+        buffer = bytearray(b"prefix ")
+        formatter.format_into(record, buffer)
+        self.assertEqual(bytes(buffer), b"prefix " + formatter.format(record).encode())
+
+
+class TestFileDescriptorHandler(TestCase):
+    def test_batches_writes(self):
+        read_fd, write_fd = os.pipe()
+        try:
+            handler = FileDescriptorHandler(write_fd, buffer_size=1 << 20)
+            logger = setup_handler(handler)
+            for i in range(10):
+                logger.info("Message %d", i)
+            handler.flush()
+            output = os.read(read_fd, 1 << 20).decode()
+            lines = output.splitlines()
+            self.assertEqual(len(lines), 10)
+            self.assertIn('message="Message 9"', lines[-1])
+            handler.close()
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+
+    def test_unencodable_record(self):
+        read_fd, write_fd = os.pipe()
+        try:
+            handler = FileDescriptorHandler(write_fd, buffer_size=1 << 20)
+            logger = setup_handler(handler)
+            logger.info("before")
+            with mock.patch.object(handler, "handleError") as handle_error:
+                logger.info("bad", extra={"data": {"path": "caf\udce9"}})
+            handle_error.assert_called_once()
+            logger.info("after")
+            handler.flush()
+            lines = os.read(read_fd, 1 << 20).decode().splitlines()
+            self.assertEqual(len(lines), 2)
+            self.assertNotIn("message=bad", lines[1])
+            self.assertIn("message=after", lines[1])
+            handler.close()
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+
+    def test_flush_level_and_close_fd(self):
+        read_fd, write_fd = os.pipe()
+        try:
+            handler = FileDescriptorHandler(write_fd, close_fd=True)
+            logger = setup_handler(handler)
+            logger.info("Buffered")
+            logger.error("Flushes")
+            self.assertEqual(len(os.read(read_fd, 1 << 20).splitlines()), 2)
+            logger.info("On close")
+            handler.close()
+            self.assertIn(b'message="On close"', os.read(read_fd, 1 << 20))
+            self.assertEqual(os.read(read_fd, 1), b"")  # the write end was closed
+        finally:
+            os.close(read_fd)
+
+
+class TestShardedFileHandler(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def read(self, name: str) -> list[str]:
+        with open(os.path.join(self.directory, name)) as file:
+            return file.read().splitlines()
+
+    def test_shards_by_field(self):
+        handler = ShardedFileHandler(self.directory, "data[tenant]", flush_interval=None)
+        logger = setup_handler(handler)
+        for i in range(6):
+            logger.info("Order %d", i, extra={"data": {"tenant": ["acme", "globex/east"][i % 2]}})
+        logger.info("No tenant")
+        self.assertGreater(handler.buffered, 0)
+        self.assertEqual(os.path.getsize(os.path.join(self.directory, "acme.log")), 0)  # still buffered
+        handler.close()
+        self.assertEqual(sorted(os.listdir(self.directory)), ["acme.log", "default.log", "globex_east.log"])
+        acme = self.read("acme.log")
+        self.assertEqual(len(acme), 3)
+        self.assertIn('message="Order 4" data[tenant]=acme', acme[-1])
+        self.assertEqual(len(self.read("globex_east.log")), 3)
+        self.assertIn('message="No tenant"', self.read("default.log")[0])
+
+    def test_bound_fields(self):
+        handler = ShardedFileHandler(self.directory, "tenant", flush_interval=None)
+        logger = setup_handler(handler)
+        with bind(tenant="acme", request_id="r1"):
+            logger.info("Bound")
+            logger.info("Overridden", extra={"tenant": "zeta"})
+        logger.info("Unbound")
+        handler.close()
+        self.assertEqual(sorted(os.listdir(self.directory)), ["acme.log", "default.log", "zeta.log"])
+        self.assertIn("tenant=acme request_id=r1", self.read("acme.log")[0])
+
+    def test_unencodable_record(self):
+        handler = ShardedFileHandler(self.directory, flush_interval=None)
+        logger = setup_handler(handler)
+        with mock.patch.object(handler, "handleError") as handle_error:
+            logger.info("bad", extra={"data": {"path": "caf\udce9"}})
+        handle_error.assert_called_once()
+        logger.info("after")
+        handler.close()
+        lines = self.read(f"{logger.name}.log")
+        self.assertEqual(len(lines), 1)
+        self.assertNotIn("message=bad", lines[0])
+
+    def test_key_function_and_other_formatters(self):
+        handler = ShardedFileHandler(self.directory, lambda fields: fields["level"].lower())
+        logger = setup_handler(handler, logging.Formatter("level=%(levelname)s message=%(message)s"))
+        logger.info("Hello")
+        logger.warning("Careful")
+        handler.close()
+        self.assertEqual(self.read("info.log"), ["level=INFO message=Hello"])
+        self.assertEqual(self.read("warning.log"), ["level=WARNING message=Careful"])
+
+    def test_colorized_level(self):
+        handler = ShardedFileHandler(self.directory, "level", flush_interval=None)
+        logger = setup_handler(handler, LogfmtFormatter(colorize=True))
+        logger.info("Hello")
+        logger.warning("Careful")
+        handler.close()
+        self.assertEqual(sorted(os.listdir(self.directory)), ["INFO.log", "WARNING.log"])
+
+    def test_flush_interval(self):
+        handler = ShardedFileHandler(self.directory, flush_interval=0.05)
+        self.addCleanup(handler.close)
+        logger = setup_handler(handler)
+        path = os.path.join(self.directory, f"{logger.name}.log")
+        logger.info("Idle afterwards")
+        deadline = time.monotonic() + 5
+        while not os.path.getsize(path) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.read(f"{logger.name}.log")), 1)
+        handler.close()
+        self.assertFalse(handler._thread.is_alive())
+
+    def test_file_handle_pool(self):
+        handler = ShardedFileHandler(self.directory, max_open=2, flush_interval=None)
+        loggers = [setup_handler(handler) for _ in range(3)]
+        for _ in range(2):
+            for logger in loggers:
+                logger.info("Hello")
+                self.assertLessEqual(len(handler.shards), 2)
+        handler.close()
+        for logger in loggers:
+            self.assertEqual(len(self.read(f"{logger.name}.log")), 2)
+
+    def test_batched_flush(self):
+        handler = ShardedFileHandler(self.directory, buffer_size=400, flush_interval=None)
+        logger = setup_handler(handler)
+        path = os.path.join(self.directory, f"{logger.name}.log")
+        logger.info("Buffered")
+        self.assertEqual(os.path.getsize(path), 0)
+        while not os.path.getsize(path):
+            logger.info("Filling the buffer")
+        self.assertEqual(handler.buffered, 0)
+        logger.info("Buffered")
+        logger.error("Flushes")
+        self.assertIn("message=Flushes", self.read(path)[-1])
+        handler.close()
+
+    def test_rotation(self):
+        handler = ShardedFileHandler(self.directory, max_bytes=500, backup_count=2, flush_interval=None)
+        logger = setup_handler(handler)
+        for i in range(20):
+            logger.info("Record %d", i)
+        handler.close()
+        name = f"{logger.name}.log"
+        self.assertEqual(sorted(os.listdir(self.directory)), [name, f"{name}.1", f"{name}.2"])
+        for file in (name, f"{name}.1", f"{name}.2"):
+            self.assertLessEqual(os.path.getsize(os.path.join(self.directory, file)), 500)
+        self.assertIn('message="Record 19"', self.read(name)[-1])
+        lines = self.read(f"{name}.2") + self.read(f"{name}.1") + self.read(name)
+        numbers = [int(line.split('message="Record ')[1].split('"')[0]) for line in lines]
+        self.assertEqual(numbers, list(range(20 - len(numbers), 20)))
+        self.assertGreater(handler.rotations, 2)
+
+
+def make_record(msg: str, created: float, level: int = logging.ERROR, **extra) -> logging.LogRecord:
+    record = logging.LogRecord("dedup", level, __file__, 1, msg, None, None, func="f")
+    record.created = created
+    record.__dict__.update(extra)
+    return record
+
+
+class TestDedupHandler(TestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.target = logging.StreamHandler(self.stream)
+        self.target.setFormatter(LogfmtFormatter(colorize=False))
+
+    def test_suppresses_repeats_within_window(self):
+        handler = DedupHandler(self.target, window=10)
+        for i in range(5):
+            handler.handle(make_record("Disk full", 1000.0 + i))
+        handler.handle(make_record("Other", 1001.0))
+        handler.handle(make_record("Disk full", 1011.0))
+        lines = self.stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertIn('message="Disk full"', lines[0])
+        self.assertIn("message=Other", lines[1])
+        self.assertIn("time=1970-01-01T00:16:44+00:00", lines[2])
+        self.assertIn("repeated=4 first=1970-01-01T00:16:41+00:00 last=1970-01-01T00:16:44+00:00", lines[2])
+        self.assertNotIn("repeated", lines[3])
+
+    def test_summary_keeps_bound_fields(self):
+        handler = DedupHandler(self.target, window=10)
+        with bind(request_id="A"):
+            for i in range(3):
+                handler.handle(make_record("Disk full", 1000.0 + i))
+        handler.close()
+        lines = self.stream.getvalue().splitlines()
+        self.assertIn("repeated=2", lines[1])
+        self.assertIn("request_id=A", lines[1])
+
+    def test_flush_emits_summaries(self):
+        handler = DedupHandler(self.target, window=10)
+        for i in range(3):
+            handler.handle(make_record("Disk full", 1000.0 + i))
+        handler.close()
+        lines = self.stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn("repeated=2", lines[1])
+
+    def test_data_keys(self):
+        handler = DedupHandler(self.target, window=10, data_keys=["host"])
+        for host in ("a", "b", "a"):
+            handler.handle(make_record("Down", 1000.0, data={"host": host, "attempt": 1}))
+        self.assertEqual(len(self.stream.getvalue().splitlines()), 2)
+
+    def test_token_bucket(self):
+        handler = DedupHandler(self.target, window=100, rate=1, burst=2)
+        for i in range(10):
+            handler.handle(make_record("Disk full", 1000.0 + i * 0.1))  # 2 tokens, then 0.1 refilled per record
+        handler.handle(make_record("Disk full", 1001.0 + 0.5))
+        self.assertEqual(len(self.stream.getvalue().splitlines()), 4)
+
+    def test_lru_eviction_emits_summary(self):
+        handler = DedupHandler(self.target, window=10, max_fingerprints=2)
+        handler.handle(make_record("A", 1000.0))
+        handler.handle(make_record("A", 1000.0))
+        handler.handle(make_record("B", 1000.0))
+        handler.handle(make_record("C", 1000.0))  # evicts A
+        self.assertEqual(len(handler.fingerprints), 2)
+        lines = self.stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertIn("message=A", lines[2])
+        self.assertIn("repeated=1", lines[2])
@@ -0,0 +1,36 @@
+from unittest import TestCase
+import os
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+# Generous, so that only a real regression (like an eagerly imported heavy module) fails it. About 35 ms at the time of
+# writing, see benchmarks/import_time.py
+IMPORT_BUDGET_MS = 150
+
+
+def run(code: str, *flags: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (SRC, os.environ.get("PYTHONPATH")))))
+    return subprocess.run([sys.executable, *flags, "-c", code], env=env, capture_output=True, text=True, check=True)
+
+
+class TestImport(TestCase):
+    def test_heavy_modules_are_not_imported(self):
+        modules = ("argparse", "multiprocessing", "dataclasses", "hashlib", "logging.handlers", "socket")
+        output = run(f"import sys, harp_logfmt; print([m for m in {modules!r} if m in sys.modules])").stdout
+        self.assertEqual(output.strip(), "[]")
+
+    def test_lazy_exports(self):
+        output = run("import harp_logfmt; print(harp_logfmt.BatchStreamHandler.__module__)").stdout
+        self.assertEqual(output.strip(), "harp_logfmt.handlers")
+        with self.assertRaises(subprocess.CalledProcessError):
+            run("import harp_logfmt; harp_logfmt.Missing")
+
+    def test_import_time_budget(self):
+        fastest = float("inf")
+        for _ in range(3):
+            stderr = run("import logging; import harp_logfmt", "-X", "importtime").stderr
+            line = stderr.strip().splitlines()[-1]  # harp_logfmt itself is the last import to finish
+            self.assertTrue(line.endswith("| harp_logfmt"), line)
+            fastest = min(fastest, int(line.split("|")[1]) / 1000)
+        self.assertLess(fastest, IMPORT_BUDGET_MS)
@@ -0,0 +1,132 @@
+from harp_logfmt import LogfmtFormatter
+from harp_logfmt.__main__ import main
+from harp_logfmt.index import LogIndex, parse_time
+from unittest import TestCase, mock
+import io
+import logging
+import os
+import sys
+import tempfile
+import uuid
+
+
+def write_log(path: str, records: int, start: int = 0, created: float = 1700000000.0):
+    """Appends `records` records, one per second from `created`, with a traceback on every 10th."""
+    handler = logging.FileHandler(path)
+    handler.setFormatter(LogfmtFormatter(colorize=False))
+    logger = logging.getLogger(str(uuid.uuid4()))
+    logger.propagate = False
+    logger.addHandler(handler)
+    for i in range(start, start + records):
+        record = logger.makeRecord(
+            "payments" if i % 3 == 0 else "orders",
+            logging.ERROR if i % 5 == 0 else logging.INFO,
+            __file__,
+            1,
+            "Handled %d",
+            (i,),
+            None,
+            extra={"data": {"order_id": i}},
+        )
+        record.created = created + i
+        if i % 10 == 0:
+            try:
+                raise ValueError(i)
+            except ValueError:
+                record.exc_info = sys.exc_info()
+        handler.handle(record)
+    handler.close()
+
+
+class TestLogIndex(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "app.log")
+        write_log(self.path, 200)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def lines(self, records) -> list[str]:
+        return [record.decode() for record in records]
+
+    def test_query(self):
+        index = LogIndex.open(self.path, block_size=512)
+        self.assertGreater(len(index.blocks), 10)
+        records = self.lines(index.query({"level": "ERROR", "name": "payments"}))
+        self.assertEqual(len(records), len(range(0, 200, 15)))
+        self.assertIn('message="Handled 0"', records[0])
+        self.assertIn("Traceback (most recent call last)", records[0])
+        # Only the blocks holding payments errors are scanned
+        self.assertLess(len(index.candidate_blocks({"level": "ERROR", "name": "payments"})), len(index.blocks))
+
+    def test_unindexed_key_and_time_range(self):
+        index = LogIndex.open(self.path, block_size=512)
+        records = self.lines(index.query({"data[order_id]": "42"}))
+        self.assertEqual(len(records), 1)
+        self.assertIn('message="Handled 42"', records[0])
+        since, until = 1700000000.0 + 100, 1700000000.0 + 109
+        records = self.lines(index.query({}, since, until))
+        self.assertEqual([f'message="Handled {i}"' in r for i, r in zip(range(100, 110), records)], [True] * 10)
+        self.assertLess(len(index.candidate_blocks({}, since, until)), len(index.blocks))
+
+    def test_indexed_data_key(self):
+        index = LogIndex.open(self.path, keys=["data[order_id]"], block_size=512)
+        self.assertEqual(len(index.candidate_blocks({"data[order_id]": "42"})), 1)
+
+    def test_incremental_update(self):
+        index = LogIndex.open(self.path, block_size=512)
+        blocks = len(index.blocks)
+        write_log(self.path, 50, start=200)
+        reopened = LogIndex.open(self.path, block_size=512)
+        self.assertGreater(len(reopened.blocks), blocks)
+        self.assertEqual(reopened.blocks[:blocks], index.blocks)
+        self.assertEqual(len(list(reopened.query({"name": "payments"}))), len(range(0, 250, 3)))
+
+    def test_parallel_matches_serial(self):
+        serial = LogIndex(self.path, block_size=512)
+        serial.update()
+        os.remove(serial.index_path)
+        parallel = LogIndex(self.path, block_size=512)
+        parallel.update(jobs=3)
+        query = {"level": "ERROR"}
+        self.assertEqual(list(parallel.query(query)), list(serial.query(query)))
+        self.assertEqual(parallel.size, serial.size)
+
+    def test_replaced_file_is_reindexed(self):
+        index = LogIndex.open(self.path, block_size=512)
+        write_log(self.path + ".new", 5)
+        os.replace(self.path + ".new", self.path)
+        self.assertEqual(index.update(), 1)
+        self.assertEqual(index.resets, 1)
+        self.assertEqual(len(list(index.query({}))), 5)
+
+    def test_small_file_replaced_by_larger_one(self):
+        path = self.path + ".small"
+        write_log(path, 5)
+        index = LogIndex.open(path, block_size=512)
+        self.assertLess(index.size, 4096)
+        os.remove(path)
+        write_log(path, 50, created=1800000000.0)
+        index.update()
+        self.assertEqual(index.resets, 1)
+        self.assertEqual(len(list(index.query({"level": "ERROR"}))), 10)
+        write_log(path, 5, start=50, created=1800000000.0)
+        index.update()
+        self.assertEqual(index.resets, 1)  # appended to, not replaced
+        self.assertEqual(len(list(index.query({}))), 55)
+
+    def test_parse_time(self):
+        self.assertEqual(parse_time("2023-11-14T22:13:20+00:00"), 1700000000.0)
+        self.assertEqual(parse_time("1700000000.5"), 1700000000.5)
+        self.assertEqual(parse_time("1700000000500"), 1700000000.5)
+        self.assertEqual(parse_time("1700000000500000000"), 1700000000.5)
+        self.assertIsNone(parse_time("yesterday"))
+
+    def test_cli(self):
+        stdout = io.TextIOWrapper(io.BytesIO())
+        with mock.patch("sys.stdout", stdout):
+            self.assertEqual(main(["query", self.path, "level=ERROR", "--since", "2023-11-14T22:15:00+00:00"]), 0)
+        lines = [line for line in stdout.buffer.getvalue().decode().splitlines() if line.startswith("time=")]
+        self.assertEqual(len(lines), len(range(100, 200, 5)))
+        self.assertTrue(os.path.exists(self.path + ".idx"))
@@ -0,0 +1,70 @@
+from harp_logfmt import LogfmtFormatter
+from harp_logfmt.parser import iter_parse, iter_parse_buffer, parse_line, split_key, unflatten
+from unittest import TestCase
+from .test import SimpleDataclass, setup_logger
+import io
+import mmap
+import tempfile
+
+
+class TestParser(TestCase):
+    def test_round_trip(self):
+        for colorize in (False, True):
+            logger, stream = setup_logger(LogfmtFormatter(colorize=colorize), name="parser_round_trip")
+            logger.debug("Hello, world!", extra={"data": {"a": [1, SimpleDataclass(2, 3, 4)]}, "user": "jane doe"})
+            record = parse_line(stream.getvalue())
+            self.assertEqual(record["message"], "Hello, world!")
+            self.assertEqual(record["level"], "DEBUG")
+            self.assertEqual(record["name"], "parser_round_trip")
+            self.assertEqual(record["function"], "test_round_trip")
+            self.assertEqual(record["user"], "jane doe")
+            self.assertEqual(record["data[a][0]"], "1")
+            self.assertEqual(record["data[a][1].c"], "4")
+
+    def test_nested(self):
+        record = parse_line("message[a][0]=1 message[a][1].b=2 data.x=3 level=INFO", nested=True)
+        self.assertEqual(record, {"message": {"a": ["1", {"b": "2"}]}, "data": {"x": "3"}, "level": "INFO"})
+
+    def test_split_key(self):
+        self.assertEqual(split_key("data[a][0].b"), ["data", "a", "0", "b"])
+        self.assertEqual(split_key("level"), ["level"])
+        self.assertEqual(unflatten({"a[0]": "x", "a[2]": "y"}), {"a": {"0": "x", "2": "y"}})
+
+    def test_escaped_quotes(self):
+        self.assertEqual(parse_line(r'a="say \"hi\" now" b=1'), {"a": 'say "hi" now', "b": "1"})
+
+    def test_iter_parse_continuation(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=False), name="parser_continuation")
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("Failed")
+        logger.info("After")
+        records = list(iter_parse(io.StringIO(stream.getvalue()), continuation_key="exc"))
+        self.assertEqual([record["message"] for record in records], ["Failed", "After"])
+        self.assertIn("ValueError: boom", records[0]["exc"])
+        self.assertNotIn("exc", records[1])
+
+    def test_iter_parse_buffer_mmap(self):
+        logger, stream = setup_logger(LogfmtFormatter(colorize=True), name="parser_mmap")
+        for i in range(10):
+            logger.info("Message %d", i, extra={"data": {"i": i}})
+        with tempfile.TemporaryFile() as file:
+            file.write(stream.getvalue().encode())
+            file.flush()
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                records = list(iter_parse_buffer(buffer, nested=True))
+        self.assertEqual(len(records), 10)
+        self.assertEqual(records[3]["message"], "Message 3")
+        self.assertEqual(records[3]["data"], {"i": "3"})
+        self.assertEqual(records, list(iter_parse(io.StringIO(stream.getvalue()), nested=True)))
+
+    def test_round_trip_escaped_values(self):
+        hostile = ['say "hi"', "a=b", "line\nbreak", "tab\there", "back\\slash", "\x1b[31mred", "", " ", "ü ö"]
+        for colorize in (False, True):
+            logger, stream = setup_logger(LogfmtFormatter(colorize=colorize), name="parser_escaped")
+            logger.debug("Hello", extra={"data": hostile})
+            lines = stream.getvalue().splitlines()
+            self.assertEqual(len(lines), 1)
+            record = parse_line(lines[0], nested=True)
+            self.assertEqual(record["data"], hostile)